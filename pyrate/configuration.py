@@ -17,14 +17,16 @@
 This Python module contains utilities to validate user input parameters
 parsed in a PyRate configuration file.
 """
+import os
 import re
+import pickle
 from configparser import ConfigParser
 from pathlib import Path, PurePath
 from typing import Union
 from pyrate.constants import NO_OF_PARALLEL_PROCESSES, sixteen_digits_pattern, twelve_digits_pattern
 from pyrate.default_parameters import PYRATE_DEFAULT_CONFIGURATION
 from pyrate.core.algorithm import factorise_integer
-from pyrate.core.shared import extract_epochs_from_filename, InputTypes, get_tiles
+from pyrate.core.shared import extract_epochs_from_filename, InputTypes, get_tiles, plan_tiles, Ifg
 from pyrate.core.config import parse_namelist, ConfigException, ORB_ERROR_DIR, TEMP_MLOOKED_DIR
 from pyrate.core import config as cf, mpiops
 
@@ -224,6 +226,10 @@ class Configuration:
                 else: # i.e. serial
                     self.rows, self.cols = 1, 1
 
+        # memory budget per worker from the environment if not set in the config file
+        if not self.memorybudget and os.environ.get(cf.MEMORY_BUDGET_ENV):
+            self.memorybudget = float(os.environ[cf.MEMORY_BUDGET_ENV])
+
         # force offset = 1 for both method options. This adds the required intercept term to the design matrix
         self.orbfitoffset = 1
 
@@ -301,6 +307,19 @@ class Configuration:
     def preread_ifgs(params: dict) -> Path:
         return Path(params[cf.TMPDIR], 'preread_ifgs.pk')
 
+    @staticmethod
+    def load_preread_ifgs(params: dict) -> dict:
+        """
+        Returns the preread ifgs dictionary saved by 'correct', including the
+        geotiff header and epoch list. A complete dictionary already in params,
+        kept by a workflow session, is returned instead of reading the file.
+        """
+        preread_ifgs = params.get(cf.PREREAD_IFGS)
+        if preread_ifgs is None or 'epochlist' not in preread_ifgs:
+            with open(Configuration.preread_ifgs(params), 'rb') as f:
+                preread_ifgs = pickle.load(f)
+        return preread_ifgs
+
     @staticmethod
     def vcmt_path(params):
         return Path(params[cf.OUT_DIR], cf.VCMT).with_suffix('.npy')
@@ -314,10 +333,30 @@ class Configuration:
             '_'.join(['ref_phs', str(params[cf.REF_EST_METHOD]), '.npy'])
         )
 
+    @staticmethod
+    def tile_rows_cols(params):
+        """
+        Returns the number of rows and cols of tiles. With a memory budget,
+        these are planned from the interferogram size and the number of
+        interferograms and epochs, with at least one tile per worker.
+        Otherwise the configured 'rows' and 'cols' are returned.
+        """
+        budget = params.get(cf.MEMORY_BUDGET)
+        if not budget:
+            return params['rows'], params['cols']
+        multi_paths = params[cf.INTERFEROGRAM_FILES]
+        ifg = Ifg(multi_paths[0].sampled_path)
+        ifg.open(readonly=True)
+        shape = ifg.shape
+        ifg.close()
+        nepochs = len({e for m in multi_paths for e in extract_epochs_from_filename(Path(m.sampled_path).name)})
+        workers = mpiops.size * (params[cf.PROCESSES] if params[cf.PARALLEL] else 1)
+        return plan_tiles(shape, len(multi_paths), nepochs, budget * 2 ** 20, min_tiles=workers)
+
     @staticmethod
     def get_tiles(params):
         ifg_path = params[cf.INTERFEROGRAM_FILES][0].sampled_path
-        rows, cols = params['rows'], params['cols']
+        rows, cols = Configuration.tile_rows_cols(params)
         return get_tiles(ifg_path, rows, cols)
 
     def __get_files_from_attr(self, attr, input_type=InputTypes.IFG):
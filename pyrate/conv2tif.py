@@ -20,12 +20,12 @@ into geotiff format files
 # -*- coding: utf-8 -*-
 import os
 from typing import Tuple, List
-from joblib import Parallel, delayed
+from joblib import delayed
 import numpy as np
 from pathlib import Path
 
 from pyrate.core.prepifg_helper import PreprocessError
-from pyrate.core import shared, mpiops, config as cf, gamma, roipac
+from pyrate.core import shared, mpiops, config as cf, gamma, roipac, stepcache
 from pyrate.core import ifgconstants as ifc
 from pyrate.core.logger import pyratelogger as log
 from pyrate.configuration import MultiplePaths
@@ -64,12 +64,41 @@ def main(params):
         base_ifg_paths.append(params[cf.DEM_FILE_PATH])
 
     process_base_ifgs_paths = np.array_split(base_ifg_paths, mpiops.size)[mpiops.rank]
+    manifest = stepcache.load_manifest(params)
+    cache_keys = [_invalidate_stale_geotiff(p, params, manifest) for p in process_base_ifgs_paths]
     gtiff_paths = do_geotiff(process_base_ifgs_paths, params)
+    entries = [('conv2tif:' + p.converted_path, k, [p.converted_path])
+               for p, k in zip(process_base_ifgs_paths, cache_keys)]
+    entries = [e for process_entries in mpiops.comm.allgather(entries) for e in process_entries]
+    files = shared.join_dicts(mpiops.comm.allgather(manifest['files']))
+    stepcache.record(params, entries, files)
     mpiops.comm.barrier()
     log.info("Finished 'conv2tif' step")
     return gtiff_paths
 
 
+def _invalidate_stale_geotiff(unw_path: MultiplePaths, params: dict, manifest: dict) -> str:
+    """
+    Returns the step cache key of a converted geotiff, from the contents of
+    the input file and its headers, and deletes the geotiff if it was not
+    converted from the same inputs and parameters.
+    """
+    dest = unw_path.converted_path
+    epochs = set(shared.extract_epochs_from_filename(Path(unw_path.unwrapped_path).name))
+    headers = [h.unwrapped_path for h in params[cf.HEADER_FILE_PATHS]
+               if epochs & set(shared.extract_epochs_from_filename(Path(h.unwrapped_path).name))]
+    headers.append(params[cf.DEM_HEADER_FILE])
+    key = stepcache.hash_key(
+        'conv2tif', unw_path.input_type, stepcache.file_fingerprint(unw_path.unwrapped_path, manifest),
+        [stepcache.file_fingerprint(h, manifest) for h in headers if h is not None],
+        [params.get(p) for p in stepcache.STEP_PARAMS['conv2tif']]
+    )
+    if os.path.exists(dest) and not stepcache.is_current(params, 'conv2tif:' + dest, key, [dest], manifest):
+        log.info(f"Removing geotiff {dest} converted from different inputs or parameters")
+        os.remove(dest)
+    return key
+
+
 def do_geotiff(unw_paths: List[MultiplePaths], params: dict) -> List[str]:
     """
     Convert input interferograms to geotiff format.
@@ -80,8 +109,8 @@ def do_geotiff(unw_paths: List[MultiplePaths], params: dict) -> List[str]:
 
     if parallel:
         log.info("Running geotiff conversion in parallel with {} processes".format(params[cf.PROCESSES]))
-        dest_base_ifgs = Parallel(n_jobs=params[cf.PROCESSES], verbose=shared.joblib_log_level(cf.LOG_LEVEL))(
-            delayed(_geotiff_multiprocessing)(p, params) for p in unw_paths)
+        with shared.worker_pool(params) as pool:
+            dest_base_ifgs = pool(delayed(_geotiff_multiprocessing)(p, params) for p in unw_paths)
     else:
         log.info("Running geotiff conversion in serial")
         dest_base_ifgs = [_geotiff_multiprocessing(b, params) for b in unw_paths]
@@ -17,6 +17,7 @@
 This Python module contains a collection of generic algorithms used in PyRate
 """
 from typing import Union, Iterable, Dict, Tuple
+import numpy as np
 from numpy import sin, cos, unique, histogram, diag, dot
 from scipy.linalg import qr, solve, lstsq
 from pyrate.core.shared import EpochList, IfgException, PrereadIfg
@@ -237,6 +238,32 @@ def first_second_ids(dates):
     return dict([(date_, i) for i, date_ in enumerate(dset)])
 
 
+def unique_observation_patterns(mask):
+    """
+    Groups the pixels of a 3D observation mask by their observation pattern.
+    The boolean vector of each pixel is packed into bytes and hashed, so that
+    pixels with an identical set of valid observations (e.g. the same MST
+    network) can be processed together.
+
+    :param ndarray mask: 3D boolean array of shape (nobs, nrows, ncols)
+
+    :return: generator of (sel, pixels) tuples, where sel is the vector of
+        observation indices of the pattern and pixels is the vector of
+        flattened (row-major) pixel indices sharing that pattern
+    :rtype: generator
+    """
+    nobs = mask.shape[0]
+    flat = np.asarray(mask, dtype=bool).reshape(nobs, -1)
+    packed = np.ascontiguousarray(np.packbits(flat, axis=0).T)
+    keys = packed.view(np.dtype((np.void, packed.shape[1]))).ravel()
+    _, first, inverse = unique(keys, return_index=True, return_inverse=True)
+    inverse = inverse.ravel()
+    order = np.argsort(inverse, kind='stable')
+    bounds = np.cumsum(np.bincount(inverse, minlength=len(first)))[:-1]
+    for k, pixels in enumerate(np.split(order, bounds)):
+        yield np.nonzero(flat[:, first[k]])[0], pixels
+
+
 def factorise_integer(n, memo={}, left=2):
     """
     Returns two factors a and b of a supplied number n such that a * b = n.
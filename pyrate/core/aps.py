@@ -21,15 +21,16 @@ signals.
 # pylint: disable=invalid-name, too-many-locals, too-many-arguments
 import os
 from copy import deepcopy
+from functools import lru_cache
 from collections import OrderedDict
 from typing import List
 import numpy as np
 from numpy import isnan
-from scipy.fftpack import fft2, ifft2, fftshift, ifftshift
+from scipy.fft import rfft2, irfft2, next_fast_len
 from scipy.interpolate import griddata
 from pyrate.core.logger import pyratelogger as log
 
-from pyrate.core import shared, ifgconstants as ifc, mpiops, config as cf
+from pyrate.core import shared, ifgconstants as ifc, mpiops, config as cf, stepcache
 from pyrate.core.covariance import cvd_from_phase, RDist
 from pyrate.core.algorithm import get_epochs
 from pyrate.core.shared import Ifg
@@ -37,6 +38,9 @@ from pyrate.core.timeseries import time_series
 from pyrate.merge import assemble_tiles
 from pyrate.configuration import MultiplePaths, Configuration
 
+# approximate size in bytes of the spectra filtered in one spatial filter call
+SLPF_BATCH_BYTES = 2 ** 28
+
 
 def wrap_spatio_temporal_filter(params):
     """
@@ -59,18 +63,32 @@ def wrap_spatio_temporal_filter(params):
         return  # return if True condition returned
 
     aps_error_files_on_disc = [MultiplePaths.aps_error_path(i, params) for i in ifg_paths]
+    cache_key = stepcache.step_key(params, 'apscorrect')
+    stepcache.invalidate_stale(params, 'apscorrect', cache_key, aps_error_files_on_disc)
     if all(a.exists() for a in aps_error_files_on_disc):
         log.warning("Reusing APS errors from previous run!!!")
-        for ifg_path, a in mpiops.array_split(list(zip(ifg_paths, aps_error_files_on_disc))):
-            phase = np.load(a)
-            _save_aps_corrected_phase(ifg_path, phase)
+        if not shared.uses_correction_layers(params):
+            for ifg_path, a in mpiops.array_split(list(zip(ifg_paths, aps_error_files_on_disc))):
+                phase = np.load(a)
+                _save_aps_corrected_phase(ifg_path, phase)
+    elif params[cf.APS_OUT_OF_CORE]:
+        shared.update_phase_cubes(ifg_paths, params)
+        nvels = _calc_svd_time_series_tiles(ifg_paths, params, preread_ifgs, tiles)
+        mpiops.comm.barrier()
+
+        spatio_temporal_filter_out_of_core(nvels, ifg_paths, params, preread_ifgs, tiles)
     else:
+        shared.update_phase_cubes(ifg_paths, params)
         tsincr = _calc_svd_time_series(ifg_paths, params, preread_ifgs, tiles)
         mpiops.comm.barrier()
 
         spatio_temporal_filter(tsincr, ifg_paths, params, preread_ifgs)
     mpiops.comm.barrier()
-    shared.save_numpy_phase(ifg_paths, params)
+    stepcache.record(params, [('apscorrect', cache_key, aps_error_files_on_disc)])
+    if shared.uses_correction_layers(params):
+        shared.record_correction_layer(params, _apply_aps_layer)
+    else:
+        shared.save_numpy_phase(ifg_paths, params)
 
 
 def spatio_temporal_filter(tsincr, ifg_paths, params, preread_ifgs):
@@ -101,11 +119,176 @@ def spatio_temporal_filter(tsincr, ifg_paths, params, preread_ifgs):
     ifg.close()
 
 
+def spatio_temporal_filter_out_of_core(nvels, ifg_paths, params, preread_ifgs, tiles):
+    """
+    Applies the spatio-temporal filter of 'spatio_temporal_filter' without
+    holding the time series of the whole scene in memory. The temporal filter
+    is applied a tile at a time to the time series tiles saved on disc, and
+    the high pass time series is written to an epoch-major memory mapped
+    store. The spatial filter then reads the store an epoch at a time,
+    replacing each epoch with the APS corrected time series. Each ifg is
+    reconstructed from only the epochs it spans.
+
+    :param int nvels: number of epochs of the incremental time series
+    :param list ifg_paths: List of interferogram paths
+    :param dict params: Dictionary of configuration parameters
+    :param dict preread_ifgs: Dictionary of shared.PrereadIfg class instances
+    :param list tiles: List of pyrate.shared.Tile class objects
+
+    :return: None, corrected interferograms are saved to disk
+    """
+    ifg = Ifg(ifg_paths[0])  # just grab any for parameters in slpfilter
+    ifg.open()
+    epochlist = mpiops.run_once(get_epochs, preread_ifgs)[0]
+    store_path = aps_store_path(params)
+    offset = mpiops.run_once(_create_store, store_path, (nvels,) + ifg.shape)
+
+    _temporal_filter_tiles(store_path, offset, epochlist, params, tiles)
+    mpiops.comm.barrier()
+    _spatial_filter_epochs(store_path, offset, ifg, params, tiles)
+    mpiops.comm.barrier()
+    _ts_store_to_ifgs(store_path, preread_ifgs, params)
+    mpiops.comm.barrier()
+
+    mpiops.run_once(os.remove, store_path)
+    ifg.close()
+
+
+def aps_store_path(params):
+    """
+    Returns the path of the epoch-major store of the APS time series
+    """
+    return os.path.join(params[cf.TMPDIR], 'tsincr_aps_store.npy')
+
+
+def _create_store(store_path, shape):
+    """
+    Create the float32 store of the given shape and return the byte offset
+    of its data in the file
+    """
+    store = np.lib.format.open_memmap(store_path, mode='w+', dtype=np.float32, shape=shape)
+    offset = store.offset
+    del store
+    return offset
+
+
+def _write_store_window(f, offset, shape, data, start):
+    """
+    Write an epoch-major window of data to the store from its first epoch
+    and top left pixel, by positioned writes of each contiguous run of the
+    window
+    """
+    _, rows, cols = shape
+    e0, y0, x0 = start
+    data = np.ascontiguousarray(data, dtype=np.float32)
+    nepochs, wrows, wcols = data.shape
+    for e in range(nepochs):
+        if wcols == cols:  # full width, the window of the epoch is contiguous
+            f.seek(offset + ((e0 + e) * rows + y0) * cols * data.itemsize)
+            f.write(data[e].tobytes())
+            continue
+        for r in range(wrows):
+            f.seek(offset + (((e0 + e) * rows + y0 + r) * cols + x0) * data.itemsize)
+            f.write(data[e, r].tobytes())
+
+
+def _temporal_filter_tiles(store_path, offset, epochlist, params, tiles):
+    """
+    Apply the temporal low pass filter to each time series tile saved on
+    disc, writing the high pass time series to the store
+    """
+    log.info('Applying temporal low-pass filter by tile')
+    shape = np.load(store_path, mmap_mode='r').shape
+    kernel, threshold = _tlpf_kernel(epochlist, shape[0], params)
+    # each process writes the disjoint byte ranges of its own tiles
+    with open(store_path, 'r+b') as f:
+        for t in mpiops.array_split(tiles):
+            tsincr = np.moveaxis(np.load(os.path.join(params[cf.TMPDIR], 'tsincr_aps_{}.npy'.format(t.index))), 0, 2)
+            ts_hp = tsincr - _tlpf_pixels(tsincr, kernel, threshold)
+            _write_store_window(f, offset, shape, np.moveaxis(ts_hp, 2, 0), (0,) + tuple(t.top_left))
+
+
+def _spatial_filter_epochs(store_path, offset, ifg, params, tiles):
+    """
+    Apply the spatial low pass filter to the high pass time series in the
+    store a batch of epochs at a time, and replace each epoch in the store
+    with the time series less the filtered APS
+    """
+    log.info('Applying spatial low-pass filter by epoch')
+    store = np.load(store_path, mmap_mode='r')
+    nvels, rows, cols = store.shape
+    r_dist = RDist(ifg)()
+    indices = np.indices((rows, cols)) if params[cf.SLPF_NANFILL] else None
+    process_nvel = mpiops.array_split(range(nvels))
+    batch = max(1, SLPF_BATCH_BYTES // (rows * cols * 16))
+    # each process writes the disjoint epochs it filters
+    with open(store_path, 'r+b') as f:
+        for b in range(0, len(process_nvel), batch):
+            nvel_b = process_nvel[b:b + batch]
+            ts_hp = np.array(store[nvel_b[0]:nvel_b[-1] + 1])
+            for ts in ts_hp:
+                if params[cf.SLPF_NANFILL] == 0:
+                    ts[np.isnan(ts)] = 0  # need it here for cvd and fft
+                else:
+                    _interpolate_nans_2d(ts, indices[0], indices[1], params[cf.SLPF_NANFILL_METHOD])
+            # epochs that are all nan are returned unfiltered
+            filt = [k for k in range(len(ts_hp)) if not np.all(np.isnan(ts_hp[k]))]
+            cutoffs = [_slpf_cutoff(ts_hp[k], ifg, r_dist, params) for k in filt]
+            ts_aps = ts_hp.astype(np.float64)
+            if filt:
+                ts_aps[filt] = slp_filter_stack(ts_hp[filt], cutoffs, ifg.x_size, ifg.y_size, params)
+            for k, i in enumerate(nvel_b):
+                tsincr = assemble_tiles((rows, cols), params[cf.TMPDIR], tiles, out_type='tsincr_aps', index=i)
+                tsincr -= ts_aps[k]
+                _write_store_window(f, offset, store.shape, tsincr[np.newaxis], (i, 0, 0))
+    del store
+    log.debug('Finished applying spatial low pass filter')
+
+
+def _ts_store_to_ifgs(store_path, preread_ifgs, params):
+    """
+    Reconstruct the APS corrected interferograms from the corrected
+    incremental time series in the store, reading only the epochs spanned
+    by each interferogram
+    """
+    log.debug('Reconstructing interferometric observations from time series')
+    store = np.load(store_path, mmap_mode='r')
+    ifgs = list(OrderedDict(sorted(preread_ifgs.items())).values())
+    _, n = mpiops.run_once(get_epochs, ifgs)
+    index_first, index_second = n[:len(ifgs)], n[len(ifgs):]
+
+    num_ifgs_tuples = mpiops.array_split(list(enumerate(ifgs)))
+    num_ifgs_tuples = [(int(num), ifg) for num, ifg in num_ifgs_tuples]
+
+    for i, ifg in num_ifgs_tuples:
+        phase = np.zeros(store.shape[1:], dtype=np.float32)
+        for e in range(index_first[i], index_second[i]):
+            phase += store[e]
+        np.save(file=MultiplePaths.aps_error_path(ifg.tmp_path, params), arr=phase)
+        if not shared.uses_correction_layers(params):
+            _save_aps_corrected_phase(ifg.tmp_path, phase)
+    del store
+
+
 def _calc_svd_time_series(ifg_paths, params, preread_ifgs, tiles: List[shared.Tile]):
     """
     Helper function to obtain time series for spatio-temporal filter
     using SVD method
     """
+    nvels = _calc_svd_time_series_tiles(ifg_paths, params, preread_ifgs, tiles)
+    mpiops.comm.barrier()
+    # need to assemble tsincr from all processes
+    tsincr_g = _assemble_tsincr(ifg_paths, params, preread_ifgs, tiles, nvels)
+    log.debug('Finished calculating time series for spatio-temporal filter')
+    return tsincr_g
+
+
+def _calc_svd_time_series_tiles(ifg_paths, params, preread_ifgs, tiles: List[shared.Tile]):
+    """
+    Helper function to calculate the time series of each tile for the
+    spatio-temporal filter using SVD method, saved to disc. Returns the
+    number of epochs of the incremental time series.
+    """
     # Is there other existing functions that can perform this same job?
     log.info('Calculating time series via SVD method for '
              'APS correction')
@@ -121,15 +304,13 @@ def _calc_svd_time_series(ifg_paths, params, preread_ifgs, tiles: List[shared.Ti
         ifg_parts = [shared.IfgPart(p, t, preread_ifgs, params) for p in ifg_paths]
         mst_tile = np.load(Configuration.mst_path(params, t.index))
         tsincr = time_series(ifg_parts, new_params, vcmt=None, mst=mst_tile)[0]
-        np.save(file=os.path.join(params[cf.TMPDIR], 'tsincr_aps_{}.npy'.format(t.index)), arr=tsincr)
+        # epoch-major, as merge.assemble_tiles reads one epoch at a time
+        np.save(file=os.path.join(params[cf.TMPDIR], 'tsincr_aps_{}.npy'.format(t.index)),
+                arr=np.moveaxis(tsincr, 2, 0))
         nvels = tsincr.shape[2]
 
     nvels = mpiops.comm.bcast(nvels, root=0)
-    mpiops.comm.barrier()
-    # need to assemble tsincr from all processes
-    tsincr_g = _assemble_tsincr(ifg_paths, params, preread_ifgs, tiles, nvels)
-    log.debug('Finished calculating time series for spatio-temporal filter')
-    return tsincr_g
+    return nvels
 
 
 def _assemble_tsincr(ifg_paths, params, preread_ifgs, tiles, nvels):
@@ -138,12 +319,11 @@ def _assemble_tsincr(ifg_paths, params, preread_ifgs, tiles, nvels):
     """
     # pre-allocate dest 3D array
     shape = preread_ifgs[ifg_paths[0]].shape
-    tsincr_p = {}
     process_nvels = mpiops.array_split(range(nvels))
-    for i in process_nvels:
-        tsincr_p[i] = assemble_tiles(shape, params[cf.TMPDIR], tiles, out_type='tsincr_aps', index=i)
-    tsincr_g = shared.join_dicts(mpiops.comm.allgather(tsincr_p))
-    return np.dstack([v[1] for v in sorted(tsincr_g.items())])
+    tsincr_p = np.empty((len(process_nvels),) + shape, dtype=np.float32)
+    for n, i in enumerate(process_nvels):
+        tsincr_p[n] = assemble_tiles(shape, params[cf.TMPDIR], tiles, out_type='tsincr_aps', index=i)
+    return np.moveaxis(mpiops.allgatherv(tsincr_p), 0, 2)
 
 
 def _ts_to_ifgs(tsincr, preread_ifgs, params):
@@ -156,7 +336,7 @@ def _ts_to_ifgs(tsincr, preread_ifgs, params):
                 (ifg.shape, nepochs-1)
     :param dict preread_ifgs: Dictionary of shared.PrereadIfg class instances
 
-    :return: None, interferograms are saved to disk
+    :return: None, APS corrected phase and interferograms are saved to disk
     """
     log.debug('Reconstructing interferometric observations from time series')
     ifgs = list(OrderedDict(sorted(preread_ifgs.items())).values())
@@ -170,7 +350,8 @@ def _ts_to_ifgs(tsincr, preread_ifgs, params):
         aps_correction_on_disc = MultiplePaths.aps_error_path(ifg.tmp_path, params)
         phase = np.sum(tsincr[:, :, index_first[i]: index_second[i]], axis=2)
         np.save(file=aps_correction_on_disc, arr=phase)
-        _save_aps_corrected_phase(ifg.tmp_path, phase)
+        if not shared.uses_correction_layers(params):
+            _save_aps_corrected_phase(ifg.tmp_path, phase)
 
 
 def _save_aps_corrected_phase(ifg_path, phase):
@@ -187,6 +368,17 @@ def _save_aps_corrected_phase(ifg_path, phase):
     ifg.close()
 
 
+def _apply_aps_layer(ifg, params):
+    """
+    Correction layer replacing the valid phase of an ifg with the APS
+    corrected phase saved on disc.
+    """
+    phase = np.load(MultiplePaths.aps_error_path(ifg.data_path, params))
+    valid = ~np.isnan(ifg.phase_data)
+    ifg.phase_data[valid] = phase[valid]
+    ifg.meta_data[ifc.PYRATE_APS_ERROR] = ifc.APS_REMOVED
+
+
 def spatial_low_pass_filter(ts_lp, ifg, params):
     """
     Filter time series data spatially using either a Butterworth or Gaussian
@@ -212,13 +404,20 @@ def spatial_low_pass_filter(ts_lp, ifg, params):
     nvels = ts_lp.shape[2]
 
     process_nvel = mpiops.array_split(range(nvels))
-    process_ts_lp = {}
-
-    for i in process_nvel:
-        process_ts_lp[i] = _slpfilter(ts_lp[:, :, i], ifg, r_dist, params)
-
-    ts_lp_d = shared.join_dicts(mpiops.comm.allgather(process_ts_lp))
-    ts_lp = np.dstack([v[1] for v in sorted(ts_lp_d.items())])
+    # epochs that are all nan are returned unfiltered
+    process_ts_lp = np.array([ts_lp[:, :, i] for i in process_nvel], dtype=np.float64).reshape(
+        (len(process_nvel),) + ts_lp.shape[:2])
+    filt = [k for k in range(len(process_nvel)) if not np.all(np.isnan(process_ts_lp[k]))]
+    cutoffs = [_slpf_cutoff(process_ts_lp[k], ifg, r_dist, params) for k in filt]
+
+    # filter several epochs per FFT call, bounding the size of the spectra
+    batch = max(1, SLPF_BATCH_BYTES // (ts_lp[:, :, 0].size * 16))
+    for b in range(0, len(filt), batch):
+        filt_b = filt[b:b + batch]
+        process_ts_lp[filt_b] = slp_filter_stack(process_ts_lp[filt_b], cutoffs[b:b + batch], ifg.x_size,
+                                                 ifg.y_size, params)
+
+    ts_lp = np.moveaxis(mpiops.allgatherv(process_ts_lp), 0, 2)
     log.debug('Finished applying spatial low pass filter')
     return ts_lp
 
@@ -258,38 +457,84 @@ def _slpfilter(phase, ifg, r_dist, params):
     """
     if np.all(np.isnan(phase)):  # return for nan matrix
         return phase
-    cutoff = params[cf.SLPF_CUTOFF]
+    cutoff = _slpf_cutoff(phase, ifg, r_dist, params)
+    rows, cols = ifg.shape
+    return _slp_filter(phase, cutoff, rows, cols, ifg.x_size, ifg.y_size, params)
+
 
+def _slpf_cutoff(phase, ifg, r_dist, params):
+    """
+    Returns the spatial filter cut-off distance, calculated from the
+    covariance of the phase if the configured cut-off is zero
+    """
+    cutoff = params[cf.SLPF_CUTOFF]
     if cutoff == 0:
-        _, alpha = cvd_from_phase(phase, ifg, r_dist, calc_alpha=True)
+        _, alpha = cvd_from_phase(phase, ifg, r_dist, calc_alpha=True, params=params)
         cutoff = 1.0/alpha
-    rows, cols = ifg.shape
-    return _slp_filter(phase, cutoff, rows, cols, ifg.x_size, ifg.y_size, params)
+    return cutoff
 
 
 def _slp_filter(phase, cutoff, rows, cols, x_size, y_size, params):
     """
     Function to perform spatial low pass filter
     """
-    cx = np.floor(cols/2)
-    cy = np.floor(rows/2)
-    # fft for the input image
-    imf = fftshift(fft2(phase))
-    # calculate distance
+    return slp_filter_stack(phase[np.newaxis, :rows, :cols], [cutoff], x_size, y_size, params)[0]
+
+
+def slp_filter_stack(phase, cutoffs, x_size, y_size, params, pad=False, dtype=np.float64, workers=None):
+    """
+    Spatial low pass filter for a stack of epochs using real FFTs. The
+    filter transfer function is cached per image shape and cut-off, so it is
+    not rebuilt for every epoch.
+
+    :param ndarray phase: Array of phase data of shape (nepochs, rows, cols)
+    :param list cutoffs: Filter cut-off distance in km for each epoch
+    :param float x_size: Pixel size in metres in the x direction
+    :param float y_size: Pixel size in metres in the y direction
+    :param dict params: Dictionary of configuration parameters
+    :param bool pad: True to zero pad each image to the next fast FFT length.
+        This speeds up awkward image sizes but changes the image boundary
+        treatment from periodic to zero padding (optional)
+    :param dtype dtype: Precision of the FFTs; float32 halves memory and time
+        at the cost of precision (optional)
+    :param int workers: Number of threads used by each FFT (optional)
+
+    :return: out: filtered phase data of shape (nepochs, rows, cols)
+    :rtype: ndarray
+    """
+    _, rows, cols = phase.shape
+    fft_shape = (next_fast_len(rows, real=True), next_fast_len(cols, real=True)) if pad else (rows, cols)
+    spectra = rfft2(phase.astype(dtype, copy=False), s=fft_shape, workers=workers)
+    for k, cutoff in enumerate(cutoffs):
+        spectra[k] *= _slpf_transfer_function(
+            rows, cols, fft_shape, x_size, y_size, float(cutoff), params[cf.SLPF_METHOD],
+            params[cf.SLPF_ORDER], np.dtype(dtype).str)
+    out = irfft2(spectra, s=fft_shape, workers=workers)[:, :rows, :cols]
+    out[np.isnan(phase)] = np.nan
+    return out  # out is units of phase, i.e. mm
+
+
+@lru_cache(maxsize=32)
+def _slpf_transfer_function(rows, cols, fft_shape, x_size, y_size, cutoff, method, order, dtype):
+    """
+    Returns the Butterworth or Gaussian low pass transfer function on the
+    half spectrum of 'rfft2', i.e. the transfer function of the centred
+    frequency grid without the FFT shifts. When zero padded, frequency
+    indices are rescaled so the filter response is that of the unpadded image.
+    """
+    # distance from the zero frequency, scaled to the unpadded image
+    fy = np.fft.fftfreq(fft_shape[0]) * rows
+    fx = np.fft.rfftfreq(fft_shape[1]) * cols
     distfact = 1.0e3  # to convert into meters
-    [xx, yy] = np.meshgrid(range(cols), range(rows))
-    xx = (xx - cx) * x_size  # these are in meters as x_size in meters
-    yy = (yy - cy) * y_size
+    xx = fx[np.newaxis, :] * x_size  # these are in meters as x_size in meters
+    yy = fy[:, np.newaxis] * y_size
     dist = np.sqrt(xx ** 2 + yy ** 2)/distfact  # km
 
-    if params[cf.SLPF_METHOD] == 1:  # butterworth low pass filter
-        H = 1. / (1 + ((dist / cutoff) ** (2 * params[cf.SLPF_ORDER])))
+    if method == 1:  # butterworth low pass filter
+        H = 1. / (1 + ((dist / cutoff) ** (2 * order)))
     else:  # Gaussian low pass filter
         H = np.exp(-(dist ** 2) / (2 * cutoff ** 2))
-    outf = imf * H
-    out = np.real(ifft2(ifftshift(outf)))
-    out[np.isnan(phase)] = np.nan
-    return out  # out is units of phase, i.e. mm
+    return H.astype(dtype)
 
 
 # TODO: use tiles here and distribute amongst processes
@@ -308,8 +553,7 @@ def temporal_low_pass_filter(tsincr, epochlist, params):
     """
     log.info('Applying temporal low-pass filter')
     nanmat = ~isnan(tsincr)
-    intv = np.diff(epochlist.spans)  # time interval for the neighboring epoch
-    span = epochlist.spans[: tsincr.shape[2]] + intv/2  # accumulated time
+    span = _tlpf_span(epochlist, tsincr.shape[2])
     rows, cols = tsincr.shape[:2]
     cutoff = params[cf.TLPF_CUTOFF]
     method = params[cf.TLPF_METHOD]
@@ -319,6 +563,25 @@ def temporal_low_pass_filter(tsincr, epochlist, params):
     return tsfilt_incr
 
 
+def _tlpf_span(epochlist, nvels):
+    """
+    Returns the time in years at the middle of each increment of the time series
+    """
+    intv = np.diff(epochlist.spans)  # time interval for the neighboring epoch
+    return epochlist.spans[: nvels] + intv/2  # accumulated time
+
+
+def _tlpf_kernel(epochlist, nvels, params):
+    """
+    Returns the temporal filter kernel and valid observation threshold of
+    the configured filter method
+    """
+    span = _tlpf_span(epochlist, nvels)
+    yr = span[np.newaxis, :] - span[:, np.newaxis]
+    kernel = tlpf_methods[params[cf.TLPF_METHOD]](yr.shape, yr, params[cf.TLPF_CUTOFF])
+    return np.asarray(kernel, dtype=np.float64), params[cf.TLPF_PTHR]
+
+
 gauss = lambda m, yr, cutoff: np.exp(-(yr / cutoff) ** 2 / 2)
 
 
@@ -338,23 +601,32 @@ tlpf_methods = {1: gauss, 2: _triangle, 3: mean_filter}
 
 def _tlpfilter(nanmat, rows, cols, cutoff, span, threshold, tsincr, func):
     """
-    Wrapper function for temporal low pass filter
+    Wrapper function for temporal low pass filter. For a fixed vector of
+    epoch spans the filter is a weighted average over the valid epochs of
+    each pixel, so whole rows are filtered at once as (W @ (x*m)) / (W @ m)
+    using the precomputed (nepochs x nepochs) kernel W of the filter method.
     """
-    tsfilt_incr_each_row = {}
+    # yr[k, l] is the time from epoch k to epoch l
+    yr = span[np.newaxis, :] - span[:, np.newaxis]
+    kernel = np.asarray(func(yr.shape, yr, cutoff), dtype=np.float64)
+
     process_rows = mpiops.array_split(list(range(rows)))
+    tsfilt_incr_rows = np.empty((len(process_rows), cols, tsincr.shape[2]), dtype=np.float32)
+    for n, r in enumerate(process_rows):
+        tsfilt_incr_rows[n] = _tlpf_pixels(tsincr[r], kernel, threshold, nanmat[r])
 
-    for r in process_rows:
-        tsfilt_incr_each_row[r] = np.empty(tsincr.shape[1:], dtype=np.float32) * np.nan
-        for j in range(cols):
-            sel = np.nonzero(nanmat[r, j, :])[0]  # don't select if nan
-            m = len(sel)
-            if m >= threshold:
-                for k in range(m):
-                    yr = span[sel] - span[sel[k]]
-                    wgt = func(m, yr, cutoff)
-                    wgt /= np.sum(wgt)
-                    tsfilt_incr_each_row[r][j, sel[k]] = np.sum(tsincr[r, j, sel] * wgt)
-
-    tsfilt_incr_combined = shared.join_dicts(mpiops.comm.allgather(tsfilt_incr_each_row))
-    tsfilt_incr = np.array([v[1] for v in tsfilt_incr_combined.items()])
-    return tsfilt_incr
+    return mpiops.allgatherv(tsfilt_incr_rows)
+
+
+def _tlpf_pixels(tsincr, kernel, threshold, valid=None):
+    """
+    Temporal low pass filter of the time series of an array of pixels, with
+    epochs along the last axis, as the weighted average over valid epochs
+    """
+    valid = ~isnan(tsincr) if valid is None else valid  # don't select if nan
+    obs = np.where(valid, tsincr, 0).astype(np.float64)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        filt = np.dot(obs, kernel.T) / np.dot(valid.astype(np.float64), kernel.T)
+    filt[~valid] = np.nan
+    filt[np.sum(valid, axis=-1) < threshold, :] = np.nan
+    return filt.astype(np.float32)
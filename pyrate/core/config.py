@@ -114,6 +114,12 @@ MAXVAR = 'maxvar'
 VCMT = 'vcmt'
 PREREAD_IFGS = 'preread_ifgs'
 TILES = 'tiles'
+# correction layers recorded by the 'correct' steps and not yet written to the interferograms
+CORRECTION_LAYERS = 'correction_layers'
+# correction layers included in the phase cubes last saved to disk
+PHASE_CUBE_LAYERS = 'phase_cube_layers'
+# step cache key of the state of the interferograms during the 'correct' steps
+STEP_STATE = 'step_state'
 
 # coherence masking parameters
 #: BOOL (0/1); Perform coherence masking (1: yes, 0: no)
@@ -155,6 +161,10 @@ LR_PTHRESH = 'pthr'
 #: FLOAT; Maximum allowable standard error for pixels in stacking
 LR_MAXSIG = 'maxsig'
 
+# Covariance parameters
+#: INT (1/2); Method for fitting the covariance decay exponent alpha (1: fmin simplex search, 2: binned least squares)
+COV_ALPHA_FIT_METHOD = 'alphafitmethod'
+
 # atmospheric delay errors fitting parameters NOT CURRENTLY USED
 # atmfitmethod = 1: interferogram by interferogram; atmfitmethod = 2, epoch by epoch
 #ATM_FIT = 'atmfit'
@@ -181,6 +191,8 @@ SLPF_ORDER = 'slpforder'
 SLPF_NANFILL = 'slpnanfill'
 #: #: STR; Method for spatial interpolation (one of: linear, nearest, cubic), only used when slpnanfill=1
 SLPF_NANFILL_METHOD = 'slpnanfill_method'
+#: BOOL (0/1); Filter the APS time series out of core, a tile or epoch at a time (1: yes, 0: in memory)
+APS_OUT_OF_CORE = 'apsoutofcore'
 
 # Time series parameters
 #: INT (1/2); Method for time series inversion (1: Laplacian Smoothing; 2: SVD)
@@ -198,13 +210,26 @@ TIME_SERIES_SM_FACTOR = 'smfactor'
 PARALLEL = 'parallel'
 #: INT; Number of processes for multi-threading
 PROCESSES = 'processes'
+#: FLOAT; Memory budget in MB per worker used to choose 'rows' and 'cols' of tiles (0: not used)
+MEMORY_BUDGET = 'memorybudget'
+#: STR; Environment variable with the memory budget in MB per worker, used if 'memorybudget' is not set
+MEMORY_BUDGET_ENV = 'PYRATE_MEMORY_BUDGET'
+#: INT (0/1); Distribution of tiles over processes (0: static split, 1: dynamic, most costly tiles first)
+TILE_SCHEDULE = 'tileschedule'
 LARGE_TIFS = 'largetifs'
+# Tile scheduling constants
+STATIC_TILES = 0
+DYNAMIC_TILES = 1
+
 # Orbital error correction constants for conversion to readable strings
 INDEPENDENT_METHOD = 1
 NETWORK_METHOD = 2
 PLANAR = 1
 QUADRATIC = 2
 PART_CUBIC = 3
+# Covariance alpha fitting constants
+ALPHA_FMIN = 1
+ALPHA_BINNED_LSQ = 2
 
 # Orbital error name look up for logging
 ORB_METHOD_NAMES = {INDEPENDENT_METHOD: 'INDEPENDENT', 
@@ -252,6 +277,8 @@ PARAM_CONVERSION = {
     LR_PTHRESH: (int, 3),
     LR_MAXSIG: (int, 10),
 
+    COV_ALPHA_FIT_METHOD: (int, ALPHA_FMIN),
+
     #ATM_FIT: (int, 0), NOT CURRENTLY USED
     #ATM_FIT_METHOD: (int, 2),
 
@@ -264,6 +291,7 @@ PARAM_CONVERSION = {
     SLPF_CUTOFF: (float, 1.0),
     SLPF_ORDER: (int, 1),
     SLPF_NANFILL: (int, 0),
+    APS_OUT_OF_CORE: (int, 0),
 
     # pixel thresh based on nepochs? not every project may have 20 epochs
     TIME_SERIES_PTHRESH: (int, 3),
@@ -273,6 +301,8 @@ PARAM_CONVERSION = {
 
     PARALLEL: (int, 0),
     PROCESSES: (int, 8),
+    TILE_SCHEDULE: (int, 1),
+    MEMORY_BUDGET: (float, 0.0),
     PROCESSOR: (int, None),
     NAN_CONVERSION: (int, 0),
     NO_DATA_AVERAGING_THRESHOLD: (float, 0.0),
@@ -585,6 +615,14 @@ _PARAM_VALIDATION = {
         lambda a: a >= 1,
         f"'{PROCESSES}': must be >= 1."
     ),
+    TILE_SCHEDULE: (
+        lambda a: a in (0, 1),
+        f"'{TILE_SCHEDULE}': must select option 0 or 1."
+    ),
+    MEMORY_BUDGET: (
+        lambda a: a >= 0,
+        f"'{MEMORY_BUDGET}': must be >= 0."
+    ),
     PROCESSOR: (
         lambda a: a in (0, 1, 2),
         f"'{PROCESSOR}': must select option 0 or 1."
@@ -688,6 +726,10 @@ _APSEST_VALIDATION = {
         lambda a: a in (0, 1),
         f"'{SLPF_NANFILL}': must select option 0 or 1."
     ),
+    APS_OUT_OF_CORE: (
+        lambda a: a in (0, 1),
+        f"'{APS_OUT_OF_CORE}': must select option 0 or 1."
+    ),
 }
 """dict: basic validation functions for atmospheric correction parameters."""
 
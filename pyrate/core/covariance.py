@@ -19,13 +19,14 @@ Variance/Covariance matrix functionality.
 """
 # coding: utf-8
 from os.path import basename, join
-from collections import OrderedDict
+from collections import OrderedDict, namedtuple
 from numpy import array, where, isnan, real, imag, sqrt, meshgrid
-from numpy import zeros, vstack, ceil, mean, exp, reshape
+from numpy import zeros, vstack, ceil, exp, reshape
 from numpy.linalg import norm
 import numpy as np
 from scipy.fftpack import fft2, ifft2, fftshift
 from scipy.optimize import fmin
+from scipy.linalg import cholesky, inv
 
 from pyrate.core import shared, ifgconstants as ifc, config as cf, mpiops
 from pyrate.core.shared import PrereadIfg, Ifg
@@ -38,6 +39,10 @@ from pyrate.configuration import Configuration
 
 MAIN_PROCESS = 0
 DISTFACT = 1000
+# memory budget of the factorisations held by a VcmFactorCache
+VCM_CACHE_BYTES = 2**28
+
+VcmFactors = namedtuple('VcmFactors', ['chol', 'inv', 'weight'])
 
 
 def _pendiffexp(alphamod, cvdav):
@@ -200,19 +205,77 @@ def cvd_from_phase(phase, ifg, r_dist, calc_alpha, save_acg=False, params=None):
         # distance instead of bin number
         cvdav[0, :] = np.multiply(range(maxbin + 1), bin_width)
         # mean variance for the bins
-        cvdav[1, :] = [mean(acg[rbin == b]) for b in range(maxbin + 1)]
+        cvdav[1, :] = _bin_means(acg, rbin, maxbin + 1)
         # calculate best fit function maxvar*exp(-alpha*r_dist)
         alphaguess = 2 / (maxbin * bin_width)
-        alpha = fmin(_pendiffexp, x0=alphaguess, args=(cvdav,), disp=False,
-                     xtol=1e-6, ftol=1e-6)
+        if params is not None and params.get(cf.COV_ALPHA_FIT_METHOD, cf.ALPHA_FMIN) == cf.ALPHA_BINNED_LSQ:
+            alpha = _fit_alpha_binned(cvdav, alphaguess)
+        else:
+            alpha = fmin(_pendiffexp, x0=alphaguess, args=(cvdav,), disp=False,
+                         xtol=1e-6, ftol=1e-6)[0]
         log.debug("1st guess alpha {}, converged "
                  "alpha: {}".format(alphaguess, alpha))
         # maximum variance usually at the zero lag: max(acg[:len(r_dist)])
-        return np.max(acg), alpha[0]  # alpha unit 1/km
+        return np.max(acg), alpha  # alpha unit 1/km
     else:
         return np.max(acg), None
 
 
+def _bin_means(values, bins, nbins):
+    """
+    Mean of values in each of the first nbins integer bins. Empty bins
+    are returned as NaN, as for the mean of an empty selection.
+
+    :param ndarray values: 1D array of values
+    :param ndarray bins: non-negative integer bin number of each value
+    :param int nbins: number of bins to return
+
+    :return: means: mean value in each bin
+    :rtype: ndarray
+    """
+    sums = np.bincount(bins, weights=values, minlength=nbins)[:nbins]
+    counts = np.bincount(bins, minlength=nbins)[:nbins]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return sums / counts
+
+
+def _fit_alpha_binned(cvdav, alphaguess, ngrid=41, niter=50, tol=1e-8):
+    """
+    Fit the exponential decay exponent to the binned covariance curve
+    without a simplex search. The misfit used by _pendiffexp is evaluated
+    for a log-spaced grid of candidates around the first guess in one
+    vectorised step, and the best candidate is refined with Gauss-Newton
+    iterations on the one parameter least squares problem.
+
+    :param ndarray cvdav: 2 row array of bin distance and mean covariance
+    :param float alphaguess: first guess of alpha
+    :param int ngrid: number of grid candidates
+    :param int niter: maximum number of Gauss-Newton iterations
+    :param float tol: relative step size at which iterations stop
+
+    :return: alpha: the exponential length-scale of decay factor
+    :rtype: float
+    """
+    valid = ~isnan(cvdav[1, :])
+    dist, cov = cvdav[0, valid], cvdav[1, valid]
+    mx = cvdav[1, 0]
+    grid = alphaguess * np.logspace(-2, 2, ngrid)
+    misfit = norm(cov[np.newaxis, :] - mx * exp(-np.outer(grid, dist)), axis=1)
+    alpha = grid[np.argmin(misfit)]
+    for _ in range(niter):
+        model = mx * exp(-alpha * dist)
+        jac = -dist * model
+        jtj = np.dot(jac, jac)
+        if jtj == 0:
+            break
+        step = np.dot(jac, cov - model) / jtj
+        # keep the decay exponent positive
+        alpha = max(alpha + step, alpha / 10)
+        if abs(step) <= tol * abs(alpha):
+            break
+    return alpha
+
+
 class RDist():
     """
     RDist class used for caching r_dist during maxvar/alpha computation
@@ -301,24 +364,21 @@ def get_vcmt(ifgs, maxvar):
         ifgs = ifgs.values()
 
     nifgs = len(ifgs)
-    vcm_pat = zeros((nifgs, nifgs))
 
     dates = [ifg.first for ifg in ifgs] + [ifg.second for ifg in ifgs]
     ids = first_second_ids(dates)
+    firsts = array([ids[ifg.first] for ifg in ifgs])
+    seconds = array([ids[ifg.second] for ifg in ifgs])
 
-    for i, ifg in enumerate(ifgs):
-        mas1, slv1 = ids[ifg.first], ids[ifg.second]
-
-        for j, ifg2 in enumerate(ifgs):
-            mas2, slv2 = ids[ifg2.first], ids[ifg2.second]
-            if mas1 == mas2 or slv1 == slv2:
-                vcm_pat[i, j] = 0.5
+    same_first = firsts[:, np.newaxis] == firsts[np.newaxis, :]
+    same_second = seconds[:, np.newaxis] == seconds[np.newaxis, :]
+    cross = (firsts[:, np.newaxis] == seconds[np.newaxis, :]) | \
+            (seconds[:, np.newaxis] == firsts[np.newaxis, :])
 
-            if mas1 == slv2 or slv1 == mas2:
-                vcm_pat[i, j] = -0.5
-
-            if mas1 == mas2 and slv1 == slv2:
-                vcm_pat[i, j] = 1.0  # diagonal elements
+    vcm_pat = zeros((nifgs, nifgs))
+    vcm_pat[same_first | same_second] = 0.5
+    vcm_pat[cross] = -0.5
+    vcm_pat[same_first & same_second] = 1.0  # diagonal elements
 
     # make covariance matrix in time domain
     std = sqrt(maxvar).reshape((nifgs, 1))
@@ -326,6 +386,74 @@ def get_vcmt(ifgs, maxvar):
     return vcm_t * vcm_pat
 
 
+class VcmFactorCache():
+    """
+    Least recently used cache of the factorisations of subsets of the
+    temporal variance/covariance matrix. Pixels of a tile mostly share a
+    small number of observation index sets, so one cache is shared by all
+    pixels of a tile and each subset is only factored once. Entries are
+    keyed on the bitset of the selected observations and evicted once the
+    cached factors exceed the memory budget.
+    """
+    # pylint: disable=invalid-name
+    def __init__(self, vcmt, maxbytes=None):
+        self.vcmt = np.asarray(vcmt, dtype=np.float64)
+        self.maxbytes = VCM_CACHE_BYTES if maxbytes is None else maxbytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._cache = OrderedDict()
+
+    def __call__(self, sel):
+        """
+        Return the factors of the VCM subset for the observation indices sel.
+
+        :param ndarray sel: Vector of selected observation indices
+
+        :return: factors: lower Cholesky factor of the VCM subset 'chol', its
+            inverse 'inv' and the upper Cholesky factor of the inverse
+            'weight' used to whiten residuals and design matrices
+        :rtype: VcmFactors
+        """
+        mask = zeros(self.vcmt.shape[0], dtype=bool)
+        mask[sel] = True
+        key = np.packbits(mask).tobytes()
+        factors = self._cache.get(key)
+        if factors is not None:
+            self.hits += 1
+            self._cache.move_to_end(key)
+            return factors
+
+        self.misses += 1
+        vcm = self.vcmt[np.ix_(sel, sel)]
+        vcm_inv = inv(vcm)
+        factors = VcmFactors(cholesky(vcm, lower=True), vcm_inv, cholesky(vcm_inv))
+        self._cache[key] = factors
+        self.nbytes += 3 * vcm.nbytes
+        while self.nbytes > self.maxbytes and len(self._cache) > 1:
+            _, old = self._cache.popitem(last=False)
+            self.nbytes -= 3 * old.inv.nbytes
+        return factors
+
+    @property
+    def hit_rate(self):
+        """
+        Fraction of look ups served from the cache
+        """
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def stats(self):
+        """
+        Summary of cache usage
+
+        :return: stats: number of hits, misses, cached entries and hit rate
+        :rtype: dict
+        """
+        return {'hits': self.hits, 'misses': self.misses, 'entries': len(self._cache),
+                'hit_rate': self.hit_rate}
+
+
 def maxvar_vcm_calc_wrapper(params):
     """
     MPI wrapper for maxvar and vcmt computation
@@ -333,6 +461,7 @@ def maxvar_vcm_calc_wrapper(params):
     preread_ifgs = params[cf.PREREAD_IFGS]
     ifg_paths = [ifg_path.tmp_sampled_path for ifg_path in params[cf.INTERFEROGRAM_FILES]]
     log.info('Calculating the temporal variance-covariance matrix')
+    shared.write_correction_layers(ifg_paths, params)
 
     def _get_r_dist(ifg_path):
         """
@@ -346,12 +475,11 @@ def maxvar_vcm_calc_wrapper(params):
 
     r_dist = mpiops.run_once(_get_r_dist, ifg_paths[0])
     prcs_ifgs = mpiops.array_split(list(enumerate(ifg_paths)))
-    process_maxvar = {}
-    for n, i in prcs_ifgs:
+    process_maxvar = np.empty(len(prcs_ifgs), dtype=np.float64)
+    for k, (n, i) in enumerate(prcs_ifgs):
         log.debug(f'Calculating maxvar for {n} of process ifgs {len(prcs_ifgs)} of total {len(ifg_paths)}')
-        process_maxvar[int(n)] = cvd(i, params, r_dist, calc_alpha=True, write_vals=True, save_acg=True)[0]
-    maxvar_d = shared.join_dicts(mpiops.comm.allgather(process_maxvar))
-    maxvar = [v[1] for v in sorted(maxvar_d.items(), key=lambda s: s[0])]
+        process_maxvar[k] = cvd(i, params, r_dist, calc_alpha=True, write_vals=True, save_acg=True)[0]
+    maxvar = list(mpiops.allgatherv(process_maxvar))
 
     vcmt = mpiops.run_once(get_vcmt, preread_ifgs, maxvar)
     log.debug("Finished maxvar and vcm calc!")
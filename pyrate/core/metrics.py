@@ -0,0 +1,263 @@
+#   This Python module is part of the PyRate software package.
+#
+#   Copyright 2020 Geoscience Australia
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+"""
+This Python module records performance metrics of PyRate steps and tiles:
+wall time, CPU time, peak resident memory and bytes read and written. The
+metrics of all MPI processes are gathered and written as JSON to the output
+directory at the end of each PyRate command.
+"""
+import os
+import sys
+import json
+import time
+import resource
+from contextlib import contextmanager
+from pathlib import Path
+from typing import List
+
+from pyrate.core import config as cf, mpiops
+
+# metrics recorded by this process
+_records = []
+
+# names of the steps being measured by this process, innermost last
+_steps = []
+
+# records of the blocks being measured by this process, innermost last
+_open = []
+
+_COUNTERS = ['wall_time', 'cpu_time', 'read_bytes', 'write_bytes']
+
+
+def _io_counters() -> dict:
+    """
+    Returns the bytes read and written by this process, including reads
+    served from the page cache. Zero if not available on this platform.
+    """
+    counters = {'read_bytes': 0, 'write_bytes': 0}
+    try:
+        with open('/proc/self/io') as f:
+            io = dict(line.split(':') for line in f.read().splitlines())
+        counters['read_bytes'], counters['write_bytes'] = int(io['rchar']), int(io['wchar'])
+    except (OSError, KeyError, ValueError):
+        pass
+    return counters
+
+
+def _peak_rss() -> int:
+    """
+    Returns the peak resident memory in bytes of this process since the
+    last call to '_reset_peak_rss'. Where the peak can not be reset this is
+    the peak of the process so far.
+    """
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError):
+        pass
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss if sys.platform == 'darwin' else maxrss * 1024
+
+
+def _reset_peak_rss() -> None:
+    """
+    Reset the peak resident memory of this process to its current resident
+    memory, on Linux 4.0 or later. The peak so far is first added to the
+    blocks being measured, so enclosing blocks keep the peaks of their
+    inner blocks.
+    """
+    peak = _peak_rss()
+    for record in _open:
+        record['peak_rss'] = max(record['peak_rss'], peak)
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        pass
+
+
+def _snapshot() -> dict:
+    """
+    Returns the current values of the cumulative counters of this process
+    """
+    return dict(wall_time=time.perf_counter(), cpu_time=time.process_time(), **_io_counters())
+
+
+@contextmanager
+def measure(kind: str, name: str, store: bool = True, **fields):
+    """
+    Context manager recording the metrics of a block of code. Steps can be
+    nested; other records are attributed to the innermost step. The peak
+    resident memory is that of the block where the platform allows the
+    peak to be reset (Linux), otherwise that of the process so far.
+
+    :param str kind: kind of record, 'step' or 'tile'
+    :param str name: name of the step or tile
+    :param bool store: add the record to the records of this process (optional)
+    :param dict fields: other values to store in the record (optional)
+
+    :return: record: dictionary of metrics, completed when the block exits
+    :rtype: dict
+    """
+    record = dict(kind=kind, name=name, rank=mpiops.rank, step=_steps[-1] if _steps else None,
+                  steps=list(_steps), peak_rss=0, **fields)
+    _reset_peak_rss()
+    _open.append(record)
+    start = _snapshot()
+    if kind == 'step':
+        _steps.append(name)
+    try:
+        yield record
+    finally:
+        if kind == 'step':
+            _steps.pop()
+        end = _snapshot()
+        record.update({k: end[k] - start[k] for k in _COUNTERS})
+        peak = _peak_rss()
+        for r in _open:
+            r['peak_rss'] = max(r['peak_rss'], peak)
+        _open.remove(record)
+        if store:
+            _records.append(record)
+
+
+def run_tile(func, tile, params, *args, **kwargs) -> dict:
+    """
+    Run a tile function, measuring its metrics. The record is not kept by
+    the process running the tile, which may be a long lived joblib worker;
+    it must be passed to 'add_records' by the process running the step.
+
+    :param function func: Function with signature func(tile, params, *args, **kwargs)
+    :param Tile tile: Tile instance
+    :param dict params: Dictionary of configuration parameters
+
+    :return: record: dictionary of tile metrics
+    :rtype: dict
+    """
+    with measure('tile', str(tile.index), store=False, pid=os.getpid()) as record:
+        func(tile, params, *args, **kwargs)
+    return record
+
+
+def add_records(records: List[dict], worker: bool = True) -> None:
+    """
+    Add records returned by 'run_tile' to the records of this process,
+    attributed to the current step.
+
+    :param list records: metrics records returned by 'run_tile'
+    :param bool worker: the records were made in other processes, such as
+        joblib workers, so are not part of the metrics of the step (optional)
+
+    :return: None
+    """
+    for r in records:
+        r['step'] = _steps[-1] if _steps else None
+        r['steps'] = list(_steps)
+        if worker:
+            r['worker'] = True
+        _records.append(r)
+
+
+def records() -> List[dict]:
+    """
+    Returns the metrics recorded by this process
+
+    :return: list of records
+    :rtype: list
+    """
+    return list(_records)
+
+
+def summarise(all_records: List[dict]) -> dict:
+    """
+    Summarise the records of all processes by step. Wall time is the
+    longest total of any process, peak memory is the largest of any process,
+    CPU time and bytes are summed over processes, and tiles counts the tiles
+    run within the step. The CPU time, bytes and memory of tiles run in
+    joblib workers are added to the steps they were run in.
+
+    :param list all_records: records of all processes
+
+    :return: summary: dictionary of metrics for each step
+    :rtype: dict
+    """
+    summary = {}
+    for r in all_records:
+        if r['kind'] != 'step':
+            continue
+        s = summary.setdefault(r['name'], {'wall_time': {}, 'cpu_time': 0.0, 'peak_rss': 0,
+                                           'read_bytes': 0, 'write_bytes': 0, 'tiles': 0})
+        s['wall_time'][r['rank']] = s['wall_time'].get(r['rank'], 0.0) + r['wall_time']
+        s['cpu_time'] += r['cpu_time']
+        s['peak_rss'] = max(s['peak_rss'], r['peak_rss'])
+        s['read_bytes'] += r['read_bytes']
+        s['write_bytes'] += r['write_bytes']
+    for r in all_records:
+        if r['kind'] != 'tile':
+            continue
+        for step in set(r['steps']).intersection(summary):
+            s = summary[step]
+            s['tiles'] += 1
+            if r.get('worker'):
+                s['cpu_time'] += r['cpu_time']
+                s['peak_rss'] = max(s['peak_rss'], r['peak_rss'])
+                s['read_bytes'] += r['read_bytes']
+                s['write_bytes'] += r['write_bytes']
+    for s in summary.values():
+        s['wall_time'] = max(s['wall_time'].values())
+    return summary
+
+
+def metrics_path(params: dict, command: str) -> Path:
+    """
+    Returns the path of the metrics file of a PyRate command
+
+    :param dict params: Dictionary of configuration parameters
+    :param str command: name of the PyRate command
+
+    :return: path of the metrics file
+    :rtype: Path
+    """
+    return Path(params[cf.OUT_DIR], 'metrics_{}.json'.format(command))
+
+
+def write_metrics(params: dict, command: str) -> None:
+    """
+    Gather the metrics of all MPI processes and write them to a JSON file in
+    the output directory. The records of this process are then cleared.
+
+    :param dict params: Dictionary of configuration parameters
+    :param str command: name of the PyRate command
+
+    :return: None, file saved to disk
+    """
+    gathered = mpiops.comm.gather(records(), root=0)
+    del _records[:]
+    if mpiops.rank != 0:
+        return
+    all_records = [r for process_records in gathered for r in process_records]
+    out = {
+        'command': command,
+        'mpi_processes': mpiops.size,
+        'parallel': params.get(cf.PARALLEL),
+        'processes': params.get(cf.PROCESSES),
+        'steps': summarise(all_records),
+        'records': all_records,
+    }
+    with open(metrics_path(params, command), 'w') as f:
+        json.dump(out, f, indent=1, default=str)
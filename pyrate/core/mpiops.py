@@ -20,7 +20,9 @@ This Python module contains MPI convenience functions for PyRate
 # pylint: disable=invalid-name
 import logging
 import pickle
-from typing import Callable, Any, Iterable
+from contextlib import contextmanager
+from functools import lru_cache
+from typing import Callable, Any, Iterable, List, Tuple
 from mpi4py import MPI
 import numpy as np
 
@@ -38,6 +40,9 @@ size = comm.Get_size()
 # the rank of the node.
 rank = comm.Get_rank()
 
+# largest message in bytes of a buffer broadcast; MPI counts are 32 bit integers
+MAX_MESSAGE_BYTES = 2 ** 30
+
 
 def run_once(f: Callable, *args, **kwargs) -> Any:
     """
@@ -55,10 +60,169 @@ def run_once(f: Callable, *args, **kwargs) -> Any:
         f_result = f(*args, **kwargs)
     else:
         f_result = None
-    result = comm.bcast(f_result, root=0)
+    result = bcast(f_result, root=0)
     return result
 
 
+def bcast(obj: Any, root: int = 0) -> Any:
+    """
+    Broadcast an object from the root process to all. NumPy arrays are sent
+    as contiguous buffers, in messages of at most MAX_MESSAGE_BYTES, rather
+    than pickled; other objects are pickled as by 'comm.bcast'.
+
+    :param obj: The object to broadcast; ignored on other processes
+    :param int root: Process to broadcast from (optional)
+
+    :return: The object of the root process
+    :rtype: unknown
+    """
+    if rank == root and isinstance(obj, np.ndarray) and not obj.dtype.hasobject:
+        header = (obj.shape, obj.dtype, None)
+    else:
+        header = (None, None, obj)
+    shape, dtype, value = comm.bcast(header, root=root)
+    if shape is None:
+        return value
+    arr = np.ascontiguousarray(obj) if rank == root else np.empty(shape, dtype=dtype)
+    buf = arr.reshape(-1).view(np.uint8)
+    for start in range(0, buf.size, MAX_MESSAGE_BYTES):
+        comm.Bcast(buf[start:start + MAX_MESSAGE_BYTES], root=root)
+    return arr
+
+
+def _gather_layout(arr: np.ndarray, axis: int) -> Tuple[np.ndarray, List[int], tuple, np.dtype]:
+    """
+    Returns the array of this process with the gather axis first and made
+    contiguous, the lengths along the gather axis of the arrays of all
+    processes, and the shape and dtype of the gathered rows. The shape and
+    dtype are those of the first process with a non-empty array.
+    """
+    arr = np.moveaxis(np.asarray(arr), axis, 0)
+    layouts = comm.allgather((arr.shape[0], arr.shape[1:], arr.dtype))
+    lengths = [n for n, _, _ in layouts]
+    row_shape, dtype = next(((s, d) for n, s, d in layouts if n), layouts[0][1:])
+    if not arr.shape[0]:
+        arr = arr.reshape((0,) + row_shape)
+    return np.ascontiguousarray(arr, dtype=dtype), lengths, row_shape, np.dtype(dtype)
+
+
+def _row_type(row_shape: tuple, dtype: np.dtype):
+    """
+    Returns a committed MPI datatype of one gathered row, so counts and
+    displacements are in rows rather than elements
+    """
+    row_type = MPI.BYTE.Create_contiguous(int(np.prod(row_shape)) * dtype.itemsize)
+    row_type.Commit()
+    return row_type
+
+
+def _displacements(lengths: List[int]) -> List[int]:
+    return [int(d) for d in np.cumsum([0] + lengths[:-1])]
+
+
+def allgatherv(arr: np.ndarray, axis: int = 0) -> np.ndarray:
+    """
+    Gather the arrays of all processes on all processes, concatenated in rank
+    order along an axis. Unlike 'comm.allgather' the arrays are sent as
+    contiguous buffers without pickling, using counts and displacements
+    computed from the length of the array of each process along the axis.
+    The arrays must have the same shape on the other axes.
+
+    :param ndarray arr: Array of this process
+    :param int axis: Axis to concatenate along (optional)
+
+    :return: The concatenated array
+    :rtype: ndarray
+    """
+    send, lengths, row_shape, dtype = _gather_layout(arr, axis)
+    out = np.empty((sum(lengths),) + row_shape, dtype=dtype)
+    if out.size:
+        row_type = _row_type(row_shape, dtype)
+        comm.Allgatherv([send, len(send), row_type], [out, (lengths, _displacements(lengths)), row_type])
+        row_type.Free()
+    return np.moveaxis(out, 0, axis)
+
+
+def gatherv(arr: np.ndarray, axis: int = 0, root: int = 0) -> np.ndarray:
+    """
+    As 'allgatherv', but the concatenated array is only returned on the
+    root process.
+
+    :param ndarray arr: Array of this process
+    :param int axis: Axis to concatenate along (optional)
+    :param int root: Process to gather on (optional)
+
+    :return: The concatenated array on the root process, None on others
+    :rtype: ndarray
+    """
+    send, lengths, row_shape, dtype = _gather_layout(arr, axis)
+    out = np.empty((sum(lengths),) + row_shape, dtype=dtype) if rank == root else None
+    if sum(lengths) * int(np.prod(row_shape)):
+        row_type = _row_type(row_shape, dtype)
+        recv = [out, (lengths, _displacements(lengths)), row_type] if rank == root else None
+        comm.Gatherv([send, len(send), row_type], recv, root=root)
+        row_type.Free()
+    return np.moveaxis(out, 0, axis) if rank == root else None
+
+
+@lru_cache(maxsize=None)
+def _node_comms():
+    """
+    Returns the communicator of the processes on this node, which can share
+    memory, and the communicator of the first process of each node, or
+    MPI.COMM_NULL on other processes.
+    """
+    node = comm.Split_type(MPI.COMM_TYPE_SHARED, key=rank)
+    leaders = comm.Split(0 if node.Get_rank() == 0 else MPI.UNDEFINED, key=rank)
+    return node, leaders
+
+
+@contextmanager
+def shared_allgatherv(arr: np.ndarray, axis: int = 0):
+    """
+    Context manager version of 'allgatherv' holding the concatenated array
+    once per node, in an MPI shared memory window, rather than once per
+    process. Each process copies its array into the window of its node; the
+    first process of each node then broadcasts the arrays of its node to the
+    other nodes. The concatenated array is read-only and only valid within
+    the context, as the window is freed on exit. Creating and freeing the
+    window are collective operations.
+
+    :param ndarray arr: Array of this process
+    :param int axis: Axis to concatenate along (optional)
+
+    :return: The concatenated array
+    :rtype: ndarray
+    """
+    send, lengths, row_shape, dtype = _gather_layout(arr, axis)
+    node, leaders = _node_comms()
+    # global rank of the first process on the node of each process
+    node_leaders = comm.allgather(node.bcast(rank, root=0))
+    shape = (sum(lengths),) + row_shape
+    nbytes = int(np.prod(shape)) * dtype.itemsize
+    win = MPI.Win.Allocate_shared(nbytes if node.Get_rank() == 0 else 0, dtype.itemsize, comm=node)
+    try:
+        buf, _ = win.Shared_query(0)
+        out = np.ndarray(buffer=buf, dtype=dtype, shape=shape) if nbytes else np.empty(shape, dtype=dtype)
+        displs = _displacements(lengths)
+        out[displs[rank]:displs[rank] + lengths[rank]] = send
+        node.Barrier()
+        if leaders != MPI.COMM_NULL and leaders.Get_size() > 1 and nbytes:
+            leader_ranks = sorted(set(node_leaders))
+            row_type = _row_type(row_shape, dtype)
+            for r in range(size):
+                if lengths[r]:
+                    leaders.Bcast([out[displs[r]:displs[r] + lengths[r]], lengths[r], row_type],
+                                  root=leader_ranks.index(node_leaders[r]))
+            row_type.Free()
+        node.Barrier()
+        out.flags.writeable = False
+        yield np.moveaxis(out, 0, axis)
+    finally:
+        node.Barrier()
+        win.Free()
+
+
 def array_split(arr: Iterable, process: int = None) -> Iterable:
     """
     Convenience function for splitting array elements across MPI processes
@@ -79,3 +243,43 @@ def sum_axis_0(x, y, dtype):
     return s
 
 sum0_op = MPI.Op.Create(sum_axis_0, commute=True)
+
+
+class SharedCounter:
+    """
+    Integer counter held in the memory of rank 0 and incremented atomically
+    by any process with MPI one-sided operations, without the participation
+    of rank 0. Creating and freeing the counter are collective operations;
+    used as a context manager, the counter is freed however the block exits.
+    """
+    def __init__(self):
+        self._value = np.zeros(1, dtype=np.int64) if rank == 0 else None
+        self._win = MPI.Win.Create(self._value, comm=comm)
+
+    def fetch_and_add(self, increment: int = 1) -> int:
+        """
+        Atomically add to the counter.
+
+        :param int increment: Value to add to the counter (optional)
+
+        :return: The value of the counter before the addition
+        :rtype: int
+        """
+        origin = np.array([increment], dtype=np.int64)
+        result = np.empty(1, dtype=np.int64)
+        self._win.Lock(0, MPI.LOCK_SHARED)
+        self._win.Fetch_and_op(origin, result, 0, 0, MPI.SUM)
+        self._win.Unlock(0)
+        return int(result[0])
+
+    def free(self) -> None:
+        """
+        Free the counter memory window on all processes.
+        """
+        self._win.Free()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.free()
@@ -25,13 +25,14 @@ from numpy import array, nan, isnan, float32, empty, sum as nsum
 import numpy as np
 from networkx.classes.reportviews import EdgeView
 import networkx as nx
-from joblib import Parallel, delayed
+from joblib import delayed
 
 from pyrate.core.algorithm import ifg_date_lookup
 from pyrate.core.algorithm import ifg_date_index_lookup
-from pyrate.core import config as cf
-from pyrate.core.shared import IfgPart, create_tiles, tiles_split
-from pyrate.core.shared import joblib_log_level, Tile
+from pyrate.core.algorithm import first_second_ids, unique_observation_patterns
+from pyrate.core import config as cf, stepcache
+from pyrate.core.shared import IfgPart, create_tiles, tiles_split, update_phase_cubes
+from pyrate.core.shared import worker_pool, Tile
 from pyrate.core.logger import pyratelogger as log
 from pyrate.configuration import Configuration
 
@@ -98,10 +99,8 @@ def mst_parallel(ifgs, params):
     if params[cf.PARALLEL]:
         log.info('Calculating MST using {} tiles in parallel using {} ' \
                  'processes'.format(no_tiles, ncpus))
-        t_msts = Parallel(n_jobs=params[cf.PROCESSES], 
-                          verbose=joblib_log_level(cf.LOG_LEVEL))(
-            delayed(mst_multiprocessing)(t, ifg_paths, params=params)
-            for t in tiles)
+        with worker_pool(params) as pool:
+            t_msts = pool(delayed(mst_multiprocessing)(t, ifg_paths, params=params) for t in tiles)
         for k, tile in enumerate(tiles):
             result[:, tile.top_left_y:tile.bottom_right_y,
                    tile.top_left_x: tile.bottom_right_x] = t_msts[k]
@@ -135,7 +134,7 @@ def mst_multiprocessing(tile, ifgs_or_paths, preread_ifgs=None, params=None):
     #of interferograms increases
 
     ifg_parts = [IfgPart(p, tile, preread_ifgs, params) for p in ifgs_or_paths]
-    return mst_boolean_array(ifg_parts)
+    return mst_boolean_array_kruskal(ifg_parts)
 
 
 def _build_graph_networkx(edges_with_weights):
@@ -174,6 +173,171 @@ def mst_boolean_array(ifgs):
     return result
 
 
+def mst_boolean_array_kruskal(ifgs):
+    """
+    Returns a 3D array of booleans constituting valid interferogram connections
+    in the Minimum Spanning Tree matrix. Equivalent to 'mst_boolean_array', but
+    the edges are sorted once and a union-find Kruskal pass is run for all
+    pixels together in NumPy arrays instead of building a networkx MST for
+    every pixel. Pixels sharing the same set of valid interferograms are
+    solved only once.
+
+    :param list ifgs: Sequence of interferogram objects
+
+    :return: result: Array of booleans representing valid ifg connections
+    :rtype: ndarray
+    """
+    nifgs = len(ifgs)
+    ny, nx = ifgs[0].phase_data.shape
+    data_stack = array([i.phase_data for i in ifgs], dtype=float32)
+    valid = ~isnan(data_stack).reshape(nifgs, ny * nx)
+
+    ids = first_second_ids([i.first for i in ifgs] + [i.second for i in ifgs])
+    first = np.array([ids[i.first] for i in ifgs])
+    second = np.array([ids[i.second] for i in ifgs])
+    weights = np.array([i.nan_fraction for i in ifgs])
+
+    if len(np.unique(weights)) == nifgs:
+        # without equal weights every pixel takes its edges in weight order,
+        # so one column per unique observation pattern
+        order = np.argsort(weights)
+        patterns = []
+        inverse = np.empty(ny * nx, dtype=np.intp)
+        for sel, pixels in unique_observation_patterns(valid):
+            inverse[pixels] = len(patterns)
+            patterns.append(np.isin(order, sel))
+        orders = np.tile(order[:, np.newaxis], (1, len(patterns)))
+        present = np.array(patterns, dtype=bool).T
+    else:
+        orders, present, inverse = _networkx_edge_orders(first, second, weights, valid)
+
+    forest = np.zeros(orders.shape, dtype=bool)
+    selected = _kruskal_forests(first[orders], second[orders], len(ids), present)
+    forest[orders[selected], np.nonzero(selected)[1]] = True
+    return forest[:, inverse].reshape(nifgs, ny, nx)
+
+
+def _networkx_edge_orders(first, second, weights, valid):
+    """
+    Convenience function returning the order in which the networkx Kruskal's
+    algorithm of 'mst_matrix_networkx' takes the valid edges of each pixel.
+    networkx breaks ties between equal weights in the edge order of its
+    graph, which depends on the edges removed and re-added for the pixels
+    before, so the graph updates are replayed without computing any MST.
+
+    Returns the (nifgs, ncolumns) array of edge orders of each unique column,
+    the flag of whether each ordered edge is present, and the column of each
+    pixel.
+    """
+    nifgs, npixels = valid.shape
+    edge = {}
+    # nodes and neighbours in insertion order, as held by a networkx graph
+    adj = {}
+    for k, (u, v) in enumerate(zip(first.tolist(), second.tolist())):
+        edge[(u, v)] = edge[(v, u)] = k
+        adj.setdefault(u, {})[v] = None
+        adj.setdefault(v, {})[u] = None
+
+    def _edge_order():
+        # edges of the graph in networkx iteration order, stably sorted by weight
+        position = np.full(nifgs, -1)
+        seen = set()
+        n = 0
+        for node, nbrs in adj.items():
+            for nbr in nbrs:
+                if nbr not in seen:
+                    position[edge[(node, nbr)]] = n
+                    n += 1
+            seen.add(node)
+        sel = np.nonzero(position >= 0)[0]
+        return sel[np.lexsort((position[sel], weights[sel]))]
+
+    columns = {}
+    orders = []
+
+    def _column(order):
+        key = order.tobytes()
+        if key not in columns:
+            columns[key] = len(orders)
+            orders.append(order)
+        return columns[key]
+
+    counts = valid.sum(axis=0)
+    inverse = np.empty(npixels, dtype=np.intp)
+    full = _column(_edge_order())
+    inverse[counts == nifgs] = full
+    inverse[counts == 0] = _column(np.empty(0, dtype=np.intp))
+
+    # the shared graph only changes at pixels with a new observation pattern
+    partial = np.nonzero((counts > 0) & (counts < nifgs))[0]
+    patterns = np.concatenate([np.ones((nifgs, 1), dtype=bool), valid[:, partial]], axis=1)
+    changed = np.any(patterns[:, 1:] != patterns[:, :-1], axis=0)
+    column = full
+    for n, pixel in enumerate(partial):
+        if changed[n]:
+            add = np.nonzero(patterns[:, n + 1] & ~patterns[:, n])[0]
+            remove = np.nonzero(~patterns[:, n + 1] & patterns[:, n])[0]
+            for k in add.tolist():
+                adj[first[k]][second[k]] = None
+                adj[second[k]][first[k]] = None
+            for k in remove.tolist():
+                del adj[first[k]][second[k]]
+                del adj[second[k]][first[k]]
+            column = _column(_edge_order())
+        inverse[pixel] = column
+
+    # pad each order with the missing edges, flagged as not present
+    ordered = np.empty((nifgs, len(orders)), dtype=np.intp)
+    present = np.zeros((nifgs, len(orders)), dtype=bool)
+    for c, order in enumerate(orders):
+        ordered[:, c] = np.concatenate([order, np.setdiff1d(np.arange(nifgs), order)])
+        present[:len(order), c] = True
+    return ordered, present, inverse
+
+
+def _kruskal_forests(first, second, nepochs, valid):
+    """
+    Convenience function running Kruskal's algorithm on many graphs at once.
+    Row e of first[e, c] and second[e, c] holds the e-th edge of graph c in
+    weight order; valid[e, c] flags whether that edge is present in graph c.
+    Returns the boolean array, in the same layout, of edges selected for the
+    minimum spanning forest of each graph.
+    """
+    nedges, ngraphs = valid.shape
+    parent = np.tile(np.arange(nepochs), (ngraphs, 1))
+    size = np.ones((ngraphs, nepochs), dtype=np.intp)
+    forest = np.zeros((nedges, ngraphs), dtype=bool)
+
+    for e in range(nedges):
+        cols = np.nonzero(valid[e])[0]
+        root_u = _find_roots(parent, cols, first[e, cols])
+        root_v = _find_roots(parent, cols, second[e, cols])
+        # skip edges closing a cycle
+        join = root_u != root_v
+        cols, root_u, root_v = cols[join], root_u[join], root_v[join]
+        forest[e, cols] = True
+        # union by size keeps the trees shallow
+        swap = size[cols, root_u] > size[cols, root_v]
+        small = np.where(swap, root_v, root_u)
+        big = np.where(swap, root_u, root_v)
+        parent[cols, small] = big
+        size[cols, big] += size[cols, small]
+    return forest
+
+
+def _find_roots(parent, cols, node):
+    """
+    Convenience function returning the union-find root of each 'node' in
+    the graphs 'cols'
+    """
+    roots = node
+    nxt = parent[cols, roots]
+    while np.any(nxt != roots):
+        roots = nxt
+        nxt = parent[cols, roots]
+    return roots
+
+
 def _mst_matrix_ifgs_only(ifgs):
     """
     Alternative method for producing 3D MST array
@@ -281,6 +445,11 @@ def mst_calc_wrapper(params):
     """
 
     log.info('Calculating minimum spanning tree matrix')
+    update_phase_cubes([p.tmp_sampled_path for p in params[cf.INTERFEROGRAM_FILES]], params)
+    tiles = params[cf.TILES]
+    cache_key = stepcache.step_key(params, 'mst', [(t.top_left, t.bottom_right) for t in tiles])
+    mst_files = [Configuration.mst_path(params, index=t.index) for t in tiles]
+    stepcache.invalidate_stale(params, 'mst', cache_key, mst_files)
 
     def _save_mst_tile(tile: Tile, params: dict) -> None:
         """
@@ -296,5 +465,6 @@ def mst_calc_wrapper(params):
         np.save(file=mst_file_process_n, arr=mst_tile)
 
     tiles_split(_save_mst_tile, params)
+    stepcache.record(params, [('mst', cache_key, mst_files)])
 
     log.debug('Finished minimum spanning tree calculation')
@@ -21,14 +21,14 @@ import tempfile
 from typing import Optional, List, Dict, Iterable
 from collections import OrderedDict
 from pathlib import Path
-from numpy import empty, isnan, reshape, float32, squeeze
-from numpy import dot, vstack, zeros, meshgrid
+from numpy import empty, isnan, reshape, float32
+from numpy import dot, zeros, meshgrid
 import numpy as np
 from numpy.linalg import pinv
 from scipy.linalg import lstsq
 
 from pyrate.core.algorithm import first_second_ids, get_all_epochs
-from pyrate.core import shared, ifgconstants as ifc, config as cf, prepifg_helper, mst, mpiops
+from pyrate.core import shared, ifgconstants as ifc, config as cf, prepifg_helper, mst, mpiops, stepcache
 from pyrate.core.shared import nanmedian, Ifg, InputTypes
 from pyrate.core.logger import pyratelogger as log
 from pyrate.prepifg import find_header
@@ -101,6 +101,8 @@ def remove_orbital_error(ifgs: List, params: dict) -> None:
         # remove_orbital_error step
         # A performance comparison should be made for saving multilooked
         # files on disc vs in memory single process multilooking
+        # multi-looking reads the interferograms from disc
+        shared.write_correction_layers(ifg_paths, params)
         if mpiops.rank == MAIN_PROCESS:
             mlooked = __create_multilooked_dataset_for_network_correction(params)
             _validate_mlooked(mlooked, ifg_paths)
@@ -189,7 +191,8 @@ def _get_num_params(degree, offset=None):
 def independent_orbital_correction(ifg, params):
     """
     Calculates and removes an orbital error surface from a single independent
-    interferogram.
+    interferogram. The orbital model coefficients are saved to disk; when
+    correction layers are used the interferogram itself is not modified.
 
     Warning: This will write orbital error corrected phase_data to the ifg.
 
@@ -206,10 +209,11 @@ def independent_orbital_correction(ifg, params):
     if not ifg.is_open:
         ifg.open()
 
+    shared.apply_correction_layers(ifg, params)
     shared.nan_and_mm_convert(ifg, params)
-    if orbfit_correction_on_disc.exists():
+    coefs = _load_orbital_coefficients(orbfit_correction_on_disc)
+    if coefs is not None:
         log.info(f'Reusing already computed orbital fit correction for {ifg.data_path}')
-        orbital_correction = np.load(file=orbfit_correction_on_disc)
     else:
         # vectorise, keeping NODATA
         vphase = reshape(ifg.phase_data, ifg.num_cells)
@@ -222,24 +226,68 @@ def independent_orbital_correction(ifg, params):
 
         # calculate forward model & morph back to 2D
         if offset:
-            fullorb = np.reshape(np.dot(dm[:, :-1], model[:-1]), ifg.phase_data.shape)
+            coefs = model[:-1]
+            fullorb = np.reshape(np.dot(dm[:, :-1], coefs), ifg.phase_data.shape)
         else:
-            fullorb = np.reshape(np.dot(dm, model), ifg.phase_data.shape)
+            coefs = model
+            fullorb = np.reshape(np.dot(dm, coefs), ifg.phase_data.shape)
 
         if not orbfit_correction_on_disc.parent.exists():
             shared.mkdir_p(orbfit_correction_on_disc.parent)
         offset_removal = nanmedian(np.ravel(ifg.phase_data - fullorb))
-        orbital_correction = fullorb - offset_removal
-        # dump to disc
-        np.save(file=orbfit_correction_on_disc, arr=orbital_correction)
+        # dump model coefficients and constant offset to disc
+        coefs = np.append(coefs, -offset_removal)
+        np.save(file=orbfit_correction_on_disc, arr=coefs)
 
+    if shared.uses_correction_layers(params):
+        ifg.close()
+        return
     # subtract orbital error from the ifg
-    ifg.phase_data -= orbital_correction
+    ifg.phase_data -= orbital_correction_surface(ifg, degree, coefs)
     # set orbfit meta tag and save phase to file
     _save_orbital_error_corrected_phase(ifg)
     ifg.close()
 
 
+def _load_orbital_coefficients(path):
+    """
+    Returns the orbital model coefficients saved on disc, or None if they
+    are not available (full resolution corrections saved by earlier versions
+    are ignored)
+    """
+    if not path.exists():
+        return None
+    coefs = np.load(file=path)
+    return coefs if coefs.ndim == 1 else None
+
+
+def orbital_correction_surface(ifg, degree, coefs):
+    """
+    Forward models the full resolution orbital correction of an
+    interferogram from its saved orbital model coefficients.
+
+    :param Ifg class instance ifg: the interferogram to model the correction for
+    :param str degree: model to fit (PLANAR / QUADRATIC / PART_CUBIC)
+    :param ndarray coefs: polynomial model coefficients followed by a
+        constant offset
+
+    :return: orbital correction surface of the shape of the interferogram
+    :rtype: ndarray
+    """
+    dm = get_design_matrix(ifg, degree, offset=False)
+    return np.reshape(dot(dm, coefs[:-1]), ifg.shape) + coefs[-1]
+
+
+def _apply_orbital_layer(ifg, params):
+    """
+    Correction layer removing the saved orbital correction from an ifg
+    """
+    shared.nan_and_mm_convert(ifg, params)
+    coefs = np.load(file=MultiplePaths.orb_error_path(ifg.data_path, params))
+    ifg.phase_data -= orbital_correction_surface(ifg, params[cf.ORBITAL_FIT_DEGREE], coefs)
+    ifg.meta_data[ifc.PYRATE_ORBITAL_ERROR] = ifc.ORB_REMOVED
+
+
 def network_orbital_correction(ifg_paths, params, m_ifgs: Optional[List] = None):
     """
     This algorithm implements a network inversion to determine orbital
@@ -276,14 +324,9 @@ def network_orbital_correction(ifg_paths, params, m_ifgs: Optional[List] = None)
     src_ifgs = ifgs if m_ifgs is None else m_ifgs
     src_ifgs = mst.mst_from_ifgs(src_ifgs)[3]  # use networkx mst
 
-    vphase = vstack([i.phase_data.reshape((i.num_cells, 1)) for i in src_ifgs])
-    vphase = squeeze(vphase)
-
-    B = get_network_design_matrix(src_ifgs, degree, offset)
-
-    # filter NaNs out before getting model
-    B = B[~isnan(vphase)]
-    orbparams = dot(pinv(B, 1e-6), vphase[~isnan(vphase)])
+    # solve the small normal equations instead of the full network design matrix
+    norm_mat, rhs = get_network_normal_equations(src_ifgs, degree, offset)
+    orbparams = _solve_normal_equations(norm_mat, rhs)
 
     ncoef = _get_num_params(degree)
     if preread_ifgs:
@@ -311,15 +354,19 @@ def network_orbital_correction(ifg_paths, params, m_ifgs: Optional[List] = None)
             # are paths
             i = Ifg(i)
             i.open(readonly=False)
+            shared.apply_correction_layers(i, params)
             shared.nan_and_mm_convert(i, params)
         _remove_network_orb_error(coefs, dm, i, ids, offset, params)
 
 
 def __check_and_apply_orberrors_found_on_disc(ifg_paths, params):
     saved_orb_err_paths = [MultiplePaths.orb_error_path(ifg_path, params) for ifg_path in ifg_paths]
-    for p, i in zip(saved_orb_err_paths, ifg_paths):
-        if p.exists():
-            orb = np.load(p)
+    saved_coefs = [_load_orbital_coefficients(p) for p in saved_orb_err_paths]
+    found = all(c is not None for c in saved_coefs)
+    if shared.uses_correction_layers(params):
+        return found
+    for coefs, i in zip(saved_coefs, ifg_paths):
+        if coefs is not None:
             if isinstance(i, str):
                 # are paths
                 ifg = Ifg(i)
@@ -327,10 +374,10 @@ def __check_and_apply_orberrors_found_on_disc(ifg_paths, params):
                 shared.nan_and_mm_convert(ifg, params)
             else:
                 ifg = i
-            ifg.phase_data -= orb
+            ifg.phase_data -= orbital_correction_surface(ifg, params[cf.ORBITAL_FIT_DEGREE], coefs)
             # set orbfit meta tag and save phase to file
             _save_orbital_error_corrected_phase(ifg)
-    return all(p.exists() for p in saved_orb_err_paths)
+    return found
 
 
 def _remove_network_orb_error(coefs, dm, ifg, ids, offset, params):
@@ -338,17 +385,22 @@ def _remove_network_orb_error(coefs, dm, ifg, ids, offset, params):
     remove network orbital error from input interferograms
     """
     saved_orb_err_path = MultiplePaths.orb_error_path(ifg.data_path, params)
-    orb = dm.dot(coefs[ids[ifg.second]] - coefs[ids[ifg.first]])
+    orb_coefs = coefs[ids[ifg.second]] - coefs[ids[ifg.first]]
+    orb = dm.dot(orb_coefs)
     orb = orb.reshape(ifg.shape)
     # offset estimation
+    constant = 0.0
     if offset:
         # bring all ifgs to same base level
-        orb -= nanmedian(np.ravel(ifg.phase_data - orb))
+        constant = -nanmedian(np.ravel(ifg.phase_data - orb))
+    # save orb model coefficients and constant offset on disc
+    np.save(file=saved_orb_err_path, arr=np.append(orb_coefs, constant))
+    if shared.uses_correction_layers(params):
+        ifg.close()
+        return
     # subtract orbital error from the ifg
-    ifg.phase_data -= orb
+    ifg.phase_data -= orb + constant
 
-    # save orb error on disc
-    np.save(file=saved_orb_err_path, arr=orb)
     # set orbfit meta tag and save phase to file
     _save_orbital_error_corrected_phase(ifg)
 
@@ -473,6 +525,78 @@ def get_network_design_matrix(ifgs, degree, offset):
     return netdm
 
 
+def get_network_normal_equations(ifgs, degree, offset):
+    # pylint: disable=too-many-locals
+    """
+    Returns the normal equations BᵀB and Bᵀd of the network orbital error
+    inversion, where B is the network design matrix of
+    'get_network_design_matrix' with NaN cells removed and d the vector of
+    valid phase observations. The normal equations are accumulated one
+    interferogram at a time from the shared per-ifg design matrix, so memory
+    does not grow with the number of cells times interferograms. The result
+    is a sum over interferograms, so partial sums over subsets of the
+    network (e.g. per MPI process) can be added together.
+
+    :param list ifgs: List of Ifg class objects
+    :param str degree: model to fit (PLANAR / QUADRATIC / PART_CUBIC)
+    :param bool offset: True to include offset cols, otherwise False.
+
+    :return: norm_mat: normal matrix BᵀB
+    :rtype: ndarray
+    :return: rhs: right hand side vector Bᵀd
+    :rtype: ndarray
+    """
+    if degree not in [PLANAR, QUADRATIC, PART_CUBIC]:
+        raise OrbitalError("Invalid degree argument")
+
+    nifgs = len(ifgs)
+    if nifgs < 1:
+        # can feasibly do correction on a single Ifg/2 epochs
+        raise OrbitalError("Invalid number of Ifgs: %s" % nifgs)
+
+    # same parameter layout as the network design matrix
+    nepochs = len(set(get_all_epochs(ifgs)))
+    ncoef = _get_num_params(degree)
+    nparams = ncoef * nepochs + (nifgs if offset else 0)
+    dates = [ifg.first for ifg in ifgs] + [ifg.second for ifg in ifgs]
+    ids = first_second_ids(dates)
+    offset_col = nepochs * ncoef  # base offset for the offset cols
+    tmpdm = get_design_matrix(ifgs[0], degree, offset=False).astype(np.float64)
+
+    norm_mat = zeros((nparams, nparams), dtype=np.float64)
+    rhs = zeros(nparams, dtype=np.float64)
+    for i, ifg in enumerate(ifgs):
+        vphase = reshape(ifg.phase_data, ifg.num_cells)
+        valid = ~isnan(vphase)
+        # non-zero columns of this ifg's block of the network design matrix
+        cols = np.r_[ids[ifg.first] * ncoef + np.arange(ncoef), ids[ifg.second] * ncoef + np.arange(ncoef)]
+        blocks = [-tmpdm[valid], tmpdm[valid]]
+        if offset:
+            cols = np.r_[cols, offset_col + i]
+            blocks.append(np.ones((np.count_nonzero(valid), 1)))
+        b_ifg = np.hstack(blocks)
+        norm_mat[np.ix_(cols, cols)] += dot(b_ifg.T, b_ifg)
+        rhs[cols] += dot(b_ifg.T, vphase[valid])
+
+    return norm_mat, rhs
+
+
+def _solve_normal_equations(norm_mat, rhs, rcond=1e-12):
+    """
+    Convenience function returning a least-squares solution of the
+    (rank deficient) network normal equations. Columns are scaled to unit
+    diagonal before the pseudo-inverse to limit the squared condition number
+    of BᵀB; rcond of 1e-12 matches a 1e-6 singular value cut-off on B.
+    Network orbital corrections only depend on coefficient differences between
+    epochs, which are unique for a connected network.
+    """
+    diag = np.diag(norm_mat)
+    scale = np.ones_like(diag)
+    scale[diag > 0] = 1 / np.sqrt(diag[diag > 0])
+    scaled = norm_mat * scale[:, np.newaxis] * scale[np.newaxis, :]
+    return scale * dot(pinv(scaled, rcond, hermitian=True), scale * rhs)
+
+
 class OrbitalError(Exception):
     """
     Generic class for errors in orbital correction.
@@ -488,7 +612,14 @@ def orb_fit_calc_wrapper(params: dict) -> None:
         log.info('Orbital correction not required!')
         return
     ifg_paths = [p.tmp_sampled_path for p in multi_paths]
+    cache_key = stepcache.step_key(params, 'orbfit')
+    orb_error_files = [MultiplePaths.orb_error_path(p, params) for p in ifg_paths]
+    stepcache.invalidate_stale(params, 'orbfit', cache_key, orb_error_files)
     remove_orbital_error(ifg_paths, params)
     mpiops.comm.barrier()
-    shared.save_numpy_phase(ifg_paths, params)
+    stepcache.record(params, [('orbfit', cache_key, orb_error_files)])
+    if shared.uses_correction_layers(params):
+        shared.record_correction_layer(params, _apply_orbital_layer)
+    else:
+        shared.save_numpy_phase(ifg_paths, params)
     log.debug('Finished Orbital error correction')
@@ -17,13 +17,14 @@
 """
 This Python module implements a reference phase estimation algorithm.
 """
+import os
 from pathlib import Path
 from typing import List
-from joblib import Parallel, delayed
+from joblib import delayed
 import numpy as np
 
-from pyrate.core import ifgconstants as ifc, config as cf, mpiops, shared
-from pyrate.core.shared import joblib_log_level, nanmedian, Ifg
+from pyrate.core import ifgconstants as ifc, config as cf, mpiops, shared, stepcache
+from pyrate.core.shared import nanmedian, Ifg
 from pyrate.core import mpiops
 from pyrate.configuration import Configuration
 from pyrate.core.logger import pyratelogger as log
@@ -58,13 +59,13 @@ def est_ref_phase_patch_median(ifg_paths, params, refpx, refpy):
         for ifg in ifgs:
             if not ifg.is_open:
                 ifg.open(readonly=False)
+                shared.apply_correction_layers(ifg, params)
 
         phase_data = [i.phase_data for i in ifgs]
         if params[cf.PARALLEL]:
-            ref_phs = Parallel(n_jobs=params[cf.PROCESSES],
-                               verbose=joblib_log_level(cf.LOG_LEVEL))(
-                delayed(_est_ref_phs_patch_median)(p, half_chip_size, refpx, refpy, thresh)
-                for p in phase_data)
+            with shared.worker_pool(params) as pool:
+                ref_phs = pool(delayed(_est_ref_phs_patch_median)(p, half_chip_size, refpx, refpy, thresh)
+                               for p in phase_data)
 
             for n, ifg in enumerate(ifgs):
                 ifg.phase_data -= ref_phs[n]
@@ -118,6 +119,7 @@ def est_ref_phase_ifg_median(ifg_paths, params):
         for ifg in proc_ifgs:
             if not ifg.is_open:
                 ifg.open(readonly=False)
+                shared.apply_correction_layers(ifg, params)
 
         ifg_phase_data_sum = np.zeros(proc_ifgs[0].shape, dtype=np.float32)
 
@@ -135,15 +137,15 @@ def est_ref_phase_ifg_median(ifg_paths, params):
         for ifg in proc_ifgs:
             if not ifg.is_open:
                 ifg.open(readonly=False)
+                shared.apply_correction_layers(ifg, params)
 
         comp = np.isnan(phase_data_sum)
         comp = np.ravel(comp, order='F')
 
         if params[cf.PARALLEL]:
             log.info("Calculating ref phase using multiprocessing")
-            ref_phs = Parallel(n_jobs=params[cf.PROCESSES], verbose=joblib_log_level(cf.LOG_LEVEL))(
-                delayed(_est_ref_phs_ifg_median)(p.phase_data, comp) for p in proc_ifgs
-            )
+            with shared.worker_pool(params) as pool:
+                ref_phs = pool(delayed(_est_ref_phs_ifg_median)(p.phase_data, comp) for p in proc_ifgs)
             for n, ifg in enumerate(proc_ifgs):
                 ifg.phase_data -= ref_phs[n]
         else:
@@ -189,6 +191,34 @@ def _update_phase_and_metadata(ifgs, ref_phs):
         __inner(i, rp)
 
 
+# reference phases loaded by this process, keyed by file, with a path to position lookup
+_ref_phases = {}
+
+
+def _load_ref_phases(params):
+    """
+    Convenience function returning the saved reference phases and a dict of
+    interferogram path to position. They are loaded once and reused until the
+    file is rewritten.
+    """
+    path = Configuration.ref_phs_file(params)
+    stat = os.stat(path)
+    stamp = (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+    if path not in _ref_phases or _ref_phases[path][0] != stamp:
+        ifg_index = {ifg_path.tmp_sampled_path: k for k, ifg_path in enumerate(params[cf.INTERFEROGRAM_FILES])}
+        _ref_phases[path] = stamp, np.load(path), ifg_index
+    return _ref_phases[path][1:]
+
+
+def _apply_ref_phase_layer(ifg, params):
+    """
+    Correction layer removing the saved reference phase from an ifg
+    """
+    ref_phs, ifg_index = _load_ref_phases(params)
+    ifg.phase_data -= ref_phs[ifg_index[ifg.data_path]]
+    ifg.meta_data[ifc.PYRATE_REF_PHASE] = ifc.REF_PHASE_REMOVED
+
+
 class ReferencePhaseError(Exception):
     """
     Generic class for errors in reference phase estimation.
@@ -216,11 +246,16 @@ def ref_phase_est_wrapper(params):
     ifgs = [Ifg(ifg_path) for ifg_path in ifg_paths]
     # Save reference phase numpy arrays to disk.
     ref_phs_file = Configuration.ref_phs_file(params)
+    cache_key = stepcache.step_key(params, 'refphase')
+    stepcache.invalidate_stale(params, 'refphase', cache_key, [ref_phs_file])
 
     if ref_phs_file.exists():
         ref_phs = np.load(ref_phs_file)
-        _update_phase_and_metadata(ifgs, ref_phs)
-        shared.save_numpy_phase(ifg_paths, params)
+        if shared.uses_correction_layers(params):
+            shared.record_correction_layer(params, _apply_ref_phase_layer)
+        else:
+            _update_phase_and_metadata(ifgs, ref_phs)
+            shared.save_numpy_phase(ifg_paths, params)
         return ref_phs, ifgs
 
     if params[cf.REF_EST_METHOD] == 1:
@@ -232,30 +267,24 @@ def ref_phase_est_wrapper(params):
     else:
         raise ReferencePhaseError("No such option, set parameter 'refest' to '1' or '2'.")
 
+    collected_ref_phs = mpiops.allgatherv(np.asarray(ref_phs, dtype=np.float64))
     if mpiops.rank == MAIN_PROCESS:
-        collected_ref_phs = np.zeros(len(ifg_paths), dtype=np.float64)
-        process_indices = mpiops.array_split(range(len(ifg_paths)))
-        collected_ref_phs[process_indices] = ref_phs
-        for r in range(1, mpiops.size):
-            process_indices = mpiops.array_split(range(len(ifg_paths)), r)
-            this_process_ref_phs = np.zeros(shape=len(process_indices),
-                                            dtype=np.float64)
-            mpiops.comm.Recv(this_process_ref_phs, source=r, tag=r)
-            collected_ref_phs[process_indices] = this_process_ref_phs
         np.save(file=ref_phs_file, arr=collected_ref_phs)
-    else:
-        collected_ref_phs = np.empty(len(ifg_paths), dtype=np.float64)
-        mpiops.comm.Send(ref_phs, dest=MAIN_PROCESS, tag=mpiops.rank)
-
-    mpiops.comm.Bcast(collected_ref_phs, root=0)
+    _ref_phases.pop(ref_phs_file, None)
 
-    _update_phase_and_metadata(ifgs, collected_ref_phs)
+    if shared.uses_correction_layers(params):
+        mpiops.comm.barrier()  # reference phases are saved on disc
+        shared.record_correction_layer(params, _apply_ref_phase_layer)
+        log.debug('Finished reference phase correction')
+    else:
+        _update_phase_and_metadata(ifgs, collected_ref_phs)
 
-    log.debug('Finished reference phase correction')
+        log.debug('Finished reference phase correction')
 
-    mpiops.comm.barrier()
-    shared.save_numpy_phase(ifg_paths, params)
+        mpiops.comm.barrier()
+        shared.save_numpy_phase(ifg_paths, params)
 
+    stepcache.record(params, [('refphase', cache_key, [ref_phs_file])])
     log.debug("Reference phase computed!")
 
     # Preserve old return value so tests don't break.
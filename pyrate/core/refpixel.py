@@ -17,20 +17,18 @@
 This Python module implements an algorithm to search for the location
 of the interferometric reference pixel
 """
-import os
-from os.path import join
 from typing import Tuple
 
 from itertools import product
 
 import numpy as np
 from numpy import isnan, std, mean, sum as nsum
-from joblib import Parallel, delayed
+from joblib import delayed
 
-from pyrate.core import ifgconstants as ifc, config as cf, mpiops
+from pyrate.core import ifgconstants as ifc, config as cf, mpiops, stepcache
 from pyrate.core import mpiops
 from pyrate.core.shared import Ifg
-from pyrate.core.shared import joblib_log_level
+from pyrate.core.shared import worker_pool
 from pyrate.core.logger import pyratelogger as log
 from pyrate.core import prepifg_helper
 from pyrate.configuration import Configuration
@@ -148,10 +146,9 @@ def ref_pixel(ifgs, params):
     parallel = params[cf.PARALLEL]
     if parallel:
         phase_data = [i.phase_data for i in ifgs]
-        mean_sds = Parallel(n_jobs=params[cf.PROCESSES], 
-                            verbose=joblib_log_level(cf.LOG_LEVEL))(
-            delayed(_ref_pixel_multi)(g, half_patch_size, phase_data,
-                                     thresh, params) for g in grid)
+        with worker_pool(params) as pool:
+            mean_sds = pool(delayed(_ref_pixel_multi)(g, half_patch_size, phase_data, thresh, params)
+                            for g in grid)
         refxy = find_min_mean(mean_sds, grid)
     else:
         phase_data = [i.phase_data for i in ifgs]
@@ -238,70 +235,76 @@ def ref_pixel_setup(ifgs_or_paths, params):
     return half_patch_size, thresh, list(product(ysteps, xsteps))
 
 
-def save_ref_pixel_blocks(grid, half_patch_size, ifg_paths, params):
+def ref_pixel_sat(grid, half_patch_size, ifg_paths, thresh, params):
     """
-    Save reference pixel grid blocks to numpy array files on disk
+    Computes the mean standard deviation of the chips around each reference
+    pixel candidate from summed-area tables (integral images) of the valid
+    pixel count, sum and sum of squares of each interferogram. Interferograms
+    are distributed across MPI processes; each process reads one
+    interferogram at a time and no intermediate files are written.
 
     :param list grid: List of tuples (y, x) corresponding to ref pixel grids
     :param int half_patch_size: patch size in pixels
     :param list ifg_paths: list of interferogram paths
+    :param float thresh: minimum number of valid pixels in a chip
     :param dict params: Dictionary of configuration parameters
 
-    :return: None, file saved to disk
+    :return: mean_sds: mean standard deviation for each candidate; NaN if
+        any interferogram has too few valid pixels in the chip
+    :rtype: ndarray
     """
-    log.debug('Saving ref pixel blocks')
-    outdir = params[cf.TMPDIR]
-    for pth in ifg_paths:
+    log.debug('Scoring ref pixel candidates using summed-area tables')
+    ys, xs = np.array(grid, dtype=int).reshape(-1, 2).T
+    sd_sum = np.zeros(len(grid), dtype=np.float64)
+    for pth in mpiops.array_split(ifg_paths):
         ifg = Ifg(pth)
         ifg.open(readonly=True)
         ifg.nodata_value = params[cf.NO_DATA_VALUE]
         ifg.convert_to_nans()
         ifg.convert_to_mm()
-        for y, x in grid:
-            data = ifg.phase_data[y - half_patch_size:y + half_patch_size + 1,
-                                  x - half_patch_size:x + half_patch_size + 1]
-
-            data_file = join(outdir, 'ref_phase_data_{b}_{y}_{x}.npy'.format(
-                    b=os.path.basename(pth).split('.')[0], y=y, x=x))
-            np.save(file=data_file, arr=data)
+        sd_sum += _chip_sds(ifg.phase_data, ys, xs, half_patch_size, thresh)
         ifg.close()
-    log.debug('Saved ref pixel blocks')
+    sd_sum = mpiops.comm.allreduce(sd_sum, mpiops.sum0_op)
+    return sd_sum / len(ifg_paths)
 
 
-def _ref_pixel_mpi(process_grid, half_patch_size, ifgs, thresh, params):
+def _chip_sds(phase_data, ys, xs, half_patch_size, thresh):
     """
-    Convenience function for MPI-enabled ref pixel calculation
+    Convenience function returning the standard deviation of the valid
+    pixels in the chip around each candidate (ys, xs), or NaN where the
+    chip has too few valid pixels
     """
-    log.debug('Ref pixel calculation started')
-    mean_sds = []
-    for g in process_grid:
-        mean_sds.append(_ref_pixel_multi(g, half_patch_size, ifgs, thresh, params))
-    return mean_sds
+    valid = ~isnan(phase_data)
+    if not valid.any():
+        return np.full(ys.shape, np.nan)
+    # remove the mean to limit cancellation in the sum of squares
+    data = np.where(valid, phase_data - np.nanmean(phase_data), 0).astype(np.float64)
+    y0, y1 = ys - half_patch_size, ys + half_patch_size + 1
+    x0, x1 = xs - half_patch_size, xs + half_patch_size + 1
+
+    def _chip_sum(arr):
+        sat = np.zeros((arr.shape[0] + 1, arr.shape[1] + 1), dtype=np.float64)
+        sat[1:, 1:] = arr.cumsum(axis=0).cumsum(axis=1)
+        return sat[y1, x1] - sat[y0, x1] - sat[y1, x0] + sat[y0, x0]
+
+    count = _chip_sum(valid)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        chip_mean = _chip_sum(data) / count
+        var = _chip_sum(data * data) / count - chip_mean ** 2
+    sd = np.sqrt(np.maximum(var, 0))
+    return np.where(count > thresh, sd, np.nan)
 
 
-def _ref_pixel_multi(g, half_patch_size, phase_data_or_ifg_paths,
-                    thresh, params):
+def _ref_pixel_multi(g, half_patch_size, phase_data, thresh, params):
     """
     Convenience function for ref pixel optimisation
     """
     # pylint: disable=invalid-name
-    # phase_data_or_ifg is list of ifgs
+    # phase_data is list of ifg phase arrays
     y, x, = g
-    if isinstance(phase_data_or_ifg_paths[0], str):
-        # this consumes a lot less memory
-        # one ifg.phase_data in memory at any time
-        data = []
-        output_dir = params[cf.TMPDIR]
-        for p in phase_data_or_ifg_paths:
-            data_file = os.path.join(output_dir,
-                                     'ref_phase_data_{b}_{y}_{x}.npy'.format(
-                                         b=os.path.basename(p).split('.')[0],
-                                         y=y, x=x))
-            data.append(np.load(file=data_file))
-    else:  # phase_data_or_ifg is phase_data list
-        data = [p[y - half_patch_size:y + half_patch_size + 1,
-                  x - half_patch_size:x + half_patch_size + 1]
-                for p in phase_data_or_ifg_paths]
+    data = [p[y - half_patch_size:y + half_patch_size + 1,
+              x - half_patch_size:x + half_patch_size + 1]
+            for p in phase_data]
     valid = [nsum(~isnan(d)) > thresh for d in data]
     if all(valid):  # ignore if 1+ ifgs have too many incoherent cells
         sd = [std(i[~isnan(i)]) for i in data]
@@ -424,6 +427,8 @@ def ref_pixel_calc_wrapper(params: dict) -> Tuple[int, int]:
     transform = ifg.dataset.GetGeoTransform()
 
     ref_pixel_file = Configuration.ref_pixel_path(params)
+    cache_key = stepcache.step_key(params, 'refpixel')
+    stepcache.invalidate_stale(params, 'refpixel', cache_key, [ref_pixel_file])
 
     def __reuse_ref_pixel_file_if_exists():
         if ref_pixel_file.exists():
@@ -446,12 +451,7 @@ def ref_pixel_calc_wrapper(params: dict) -> Tuple[int, int]:
         log.info('Searching for best reference pixel location')
 
         half_patch_size, thresh, grid = ref_pixel_setup(ifg_paths, params)
-        process_grid = mpiops.array_split(grid)
-        save_ref_pixel_blocks(process_grid, half_patch_size, ifg_paths, params)
-        mean_sds = _ref_pixel_mpi(process_grid, half_patch_size, ifg_paths, thresh, params)
-        mean_sds = mpiops.comm.gather(mean_sds, root=0)
-        if mpiops.rank == MAIN_PROCESS:
-            mean_sds = np.hstack(mean_sds)
+        mean_sds = ref_pixel_sat(grid, half_patch_size, ifg_paths, thresh, params)
 
         refpixel_returned = mpiops.run_once(find_min_mean, mean_sds, grid)
 
@@ -471,6 +471,7 @@ def ref_pixel_calc_wrapper(params: dict) -> Tuple[int, int]:
         log.info('Converted reference pixel coordinate (x, y): ({}, {})'.format(refx, refy))
 
     np.save(file=ref_pixel_file, arr=[int(refx), int(refy)])
+    stepcache.record(params, [('refpixel', cache_key, [ref_pixel_file])])
     update_refpix_metadata(ifg_paths, refx, refy, transform, params)
 
     log.debug("refpx, refpy: "+str(refx) + " " + str(refy))
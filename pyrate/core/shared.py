@@ -20,16 +20,18 @@ all other PyRate modules
 """
 # pylint: disable=too-many-lines
 import re
+from contextlib import contextmanager, ExitStack
 from typing import List, Union
 
 import errno
 import math
+import pickle
+import uuid
 from joblib import Parallel, delayed
 from math import floor
 import os
-from os.path import basename, join
+from os.path import basename
 from pathlib import Path
-import struct
 from datetime import date
 from itertools import product
 from enum import Enum
@@ -43,7 +45,7 @@ try:
 except ImportError:
     import gdal
 
-from pyrate.core import ifgconstants as ifc, mpiops, config as cf
+from pyrate.core import ifgconstants as ifc, mpiops, config as cf, metrics
 from pyrate.core.logger import pyratelogger as log
 
 
@@ -64,6 +66,20 @@ GDAL_Y_CELLSIZE = 5
 GDAL_X_FIRST = 0
 GDAL_Y_FIRST = 3
 
+# approximate number of bytes read/written per block in binary conversions
+BLOCK_BYTES = 2 ** 24
+
+# size in pixels of the internal tiles of merged output GeoTIFF files
+OUTPUT_BLOCK_SIZE = 256
+
+# headroom on the modelled peak bytes per pixel of a tile, for allocator
+# overheads and temporaries not counted by 'tile_memory_per_pixel'
+TILE_MEMORY_SAFETY = 1.5
+
+# approximate fixed memory in bytes of a worker before it reads any tile:
+# the interpreter and the NumPy, SciPy, networkx and GDAL libraries
+WORKER_MEMORY_OVERHEAD = 200 * 2 ** 20
+
 
 class InputTypes(Enum):
     IFG = 'ifg'
@@ -81,6 +97,39 @@ def joblib_log_level(level: str) -> int:
     else:
         return 60
 
+
+# joblib pool of the innermost active 'worker_pool' context of this process, or None
+_worker_pool = None
+
+
+@contextmanager
+def worker_pool(params: dict):
+    """
+    Context manager providing the joblib pool of worker processes for
+    parallel calls. The first context opens a pool of 'processes' workers
+    that stays open until it exits; contexts entered within it reuse that
+    pool. Wrapping several steps, or a whole workflow, in one context
+    means the workers start once. Their imports and per-process caches,
+    such as memory-mapped phase cubes and published parameters, stay warm
+    from one step to the next. No pool is opened if 'parallel' is not set.
+
+    :param dict params: Dictionary of configuration parameters
+
+    :return: parallel: joblib Parallel instance of the pool, or None
+    :rtype: Parallel
+    """
+    global _worker_pool
+    if _worker_pool is not None or not params[cf.PARALLEL]:
+        yield _worker_pool
+        return
+    with Parallel(n_jobs=params[cf.PROCESSES], verbose=joblib_log_level(cf.LOG_LEVEL)) as parallel:
+        _worker_pool = parallel
+        try:
+            yield parallel
+        finally:
+            _worker_pool = None
+
+
 def mkdir_p(path):
     """
     Make new directory and create parent directories as necessary.
@@ -514,8 +563,8 @@ class IfgPart(object):
             self.first = ifg.first
             self.second = ifg.second
             self.time_span = ifg.time_span
-            phase_file = 'phase_data_{}_{}.npy'.format(basename(ifg_or_path).split('.')[0], tile.index)
-            self.phase_data = np.load(join(params[cf.TMPDIR], phase_file))
+            cube, ifg_index = load_phase_cube(params, tile)
+            self.phase_data = cube[ifg_index[basename(ifg_or_path).split('.')[0]]]
         else:
             # check if Ifg was sent.
             if isinstance(ifg_or_path, Ifg):
@@ -742,12 +791,10 @@ def write_fullres_geotiff(header, data_path, dest, nodata):
     ifg_proc = header[ifc.PYRATE_INSAR_PROCESSOR]
     ncols = header[ifc.PYRATE_NCOLS]
     nrows = header[ifc.PYRATE_NROWS]
-    bytes_per_col, fmtstr = _data_format(ifg_proc, _is_interferogram(header), ncols)
-    if _is_interferogram(header) and ifg_proc == ROIPAC:
-        # roipac ifg has 2 bands
-        _check_raw_data(bytes_per_col*2, data_path, ncols, nrows)
-    else:
-        _check_raw_data(bytes_per_col, data_path, ncols, nrows)
+    file_dtype = _data_dtype(ifg_proc, _is_interferogram(header))
+    # roipac ifg has 2 bands interleaved by line; phase is the second band
+    nbands = 2 if (_is_interferogram(header) and ifg_proc == ROIPAC) else 1
+    _check_raw_data(file_dtype.itemsize * nbands, data_path, ncols, nrows)
 
     # position and projection data
     gt = [header[ifc.PYRATE_LONG], header[ifc.PYRATE_X_STEP], 0, header[ifc.PYRATE_LAT], 0, header[ifc.PYRATE_Y_STEP]]
@@ -769,20 +816,16 @@ def write_fullres_geotiff(header, data_path, dest, nodata):
         creation_opts=["compress=packbits"]
     )
 
-    # copy data from the binary file
     band = ds.GetRasterBand(1)
     band.SetNoDataValue(nodata)
 
-    row_bytes = ncols * bytes_per_col
-
-    with open(data_path, 'rb') as f:
-        for y in range(nrows):
-            if ifg_proc == ROIPAC:
-                if _is_interferogram(header):
-                    f.seek(row_bytes, 1)  # skip interleaved band 1
-
-            data = struct.unpack(fmtstr, f.read(row_bytes))
-            band.WriteArray(np.array(data).reshape(1, ncols), yoff=y)
+    # copy data from the binary file, a multiple of the GeoTIFF block height at a time
+    raw = np.memmap(data_path, dtype=file_dtype, mode='r', shape=(nrows, nbands * ncols))
+    block_rows = _block_rows(ncols * file_dtype.itemsize * nbands, band.GetBlockSize()[1])
+    for y in range(0, nrows, block_rows):
+        data = raw[y:y + block_rows, (nbands - 1) * ncols:]
+        band.WriteArray(data.astype(file_dtype.newbyteorder('=')), yoff=y)
+    del raw
 
     ds = None  # manual close
     del ds
@@ -852,24 +895,30 @@ def collate_metadata(header):
     return md
 
 
-def _data_format(ifg_proc, is_ifg, ncols):
+def _data_dtype(ifg_proc, is_ifg):
     """
-    Convenience function to determine the bytesize and format of input files
+    Convenience function to determine the numpy dtype (including byte order)
+    of input files
     """
     if ifg_proc == GAMMA:
-        fmtstr = '!' + ('f' * ncols)  # data format is big endian float32s
-        bytes_per_col = 4
+        return np.dtype('>f4')  # data format is big endian float32s
     elif ifg_proc == ROIPAC:
         if is_ifg:
-            fmtstr = '<' + ('f' * ncols)  # roipac ifgs are little endian float32s
-            bytes_per_col = 4
+            return np.dtype('<f4')  # roipac ifgs are little endian float32s
         else:
-            fmtstr = '<' + ('h' * ncols)  # roipac DEM is little endian signed int16
-            bytes_per_col = 2
+            return np.dtype('<i2')  # roipac DEM is little endian signed int16
     else:  # pragma: no cover
         msg = 'Unrecognised InSAR Processor: %s' % ifg_proc
         raise GeotiffException(msg)
-    return bytes_per_col, fmtstr
+
+
+def _block_rows(row_bytes, block_height=1):
+    """
+    Convenience function returning the number of rows to read/write at once:
+    a whole multiple of the raster block height of roughly BLOCK_BYTES
+    """
+    block_height = max(int(block_height), 1)
+    return max(BLOCK_BYTES // (row_bytes * block_height), 1) * block_height
 
 
 def _check_raw_data(bytes_per_col, data_path, ncols, nrows):
@@ -898,21 +947,32 @@ def write_unw_from_data_or_geotiff(geotif_or_data, dest_unw, ifg_proc):
     """
     if ifg_proc != 1:
         raise NotImplementedError('only supports GAMMA format for now')
+    unw_dtype = np.dtype('>f4')  # data format is big endian float32s
     if isinstance(geotif_or_data, str):
         assert os.path.exists(geotif_or_data), 'make sure geotif exists'
         ds = gdal.Open(geotif_or_data)
-        data = ds.ReadAsArray()
-        ds = None
+        band = ds.GetRasterBand(1)
+        nrows, ncols = ds.RasterYSize, ds.RasterXSize
+        block_height = band.GetBlockSize()[1]
+
+        def _read(y, n):
+            return band.ReadAsArray(0, y, ncols, n)
     else:
         data = geotif_or_data
+        nrows, ncols = data.shape
+        block_height = 1
 
-    nrows, ncols = data.shape
-    fmtstr = '!' + ('f' * ncols)  # data format is big endian float32s
+        def _read(y, n):
+            return data[y:y + n, :]
 
+    block_rows = _block_rows(ncols * unw_dtype.itemsize, block_height)
     with open(dest_unw, 'wb') as f:
-        for y in range(nrows):
-            col_data = struct.pack(fmtstr, *data[y, :])
-            f.write(col_data)
+        for y in range(0, nrows, block_rows):
+            n = min(block_rows, nrows - y)
+            np.asarray(_read(y, n), dtype=unw_dtype).tofile(f)
+    if isinstance(geotif_or_data, str):
+        band = None
+        ds = None
 
 
 # This function may be able to be deprecated
@@ -930,10 +990,35 @@ def write_output_geotiff(md, gt, wkt, data, dest, nodata):
 
     :return None, file saved to disk
     """
+    ds = create_output_geotiff(md, gt, wkt, data.shape, dest, nodata)
+    band = ds.GetRasterBand(1)
+    band.WriteArray(data, 0, 0)
+
+
+def create_output_geotiff(md, gt, wkt, shape, dest, nodata, tiled=False):
+    # pylint: disable=too-many-arguments
+    """
+    Creates a PyRate output GeoTIFF file, for data to be written to its
+    band in windows.
+
+    :param dict md: Dictionary containing PyRate metadata
+    :param list gt: GDAL geotransform for the data
+    :param list wkt: GDAL projection information for the data
+    :param tuple shape: (rows, cols) of the output data
+    :param str dest: Destination file name
+    :param float nodata: No data value of data
+    :param bool tiled: Use internal tiles of OUTPUT_BLOCK_SIZE pixels rather
+        than strips (optional)
 
+    :return: ds: GDAL dataset; data is flushed to disk when it is closed
+    :rtype: gdal.Dataset
+    """
     driver = gdal.GetDriverByName("GTiff")
-    nrows, ncols = data.shape
-    ds = driver.Create(dest, ncols, nrows, 1, gdal.GDT_Float32, options=['compress=packbits'])
+    nrows, ncols = shape
+    options = ['compress=packbits']
+    if tiled:
+        options += ['TILED=YES', f'BLOCKXSIZE={OUTPUT_BLOCK_SIZE}', f'BLOCKYSIZE={OUTPUT_BLOCK_SIZE}']
+    ds = driver.Create(dest, ncols, nrows, 1, gdal.GDT_Float32, options=options)
     # set spatial reference for geotiff
     ds.SetGeoTransform(gt)
     ds.SetProjection(wkt)
@@ -949,10 +1034,136 @@ def write_output_geotiff(md, gt, wkt, data, dest, nodata):
         if k in md:
             ds.SetMetadataItem(k, str(md[k]))
 
-    # write data to geotiff
     band = ds.GetRasterBand(1)
     band.SetNoDataValue(nodata)
-    band.WriteArray(data, 0, 0)
+    return ds
+
+
+class OutputGeotiffWriter():
+    """
+    Writer of a PyRate output GeoTIFF file one window at a time, so the
+    whole array is never held in memory. Windows need not be aligned to the
+    internal tiles of the file: they are buffered in full-width rows of
+    tiles, and each row of tiles is written once it is complete, so every
+    compressed tile is written exactly once. Band statistics are accumulated
+    from the windows written and saved with the file when it is closed.
+    """
+    def __init__(self, md, gt, wkt, shape, dest, nodata):
+        # pylint: disable=too-many-arguments
+        """
+        :param dict md: Dictionary containing PyRate metadata
+        :param list gt: GDAL geotransform for the data
+        :param list wkt: GDAL projection information for the data
+        :param tuple shape: (rows, cols) of the output data
+        :param str dest: Destination file name
+        :param float nodata: No data value of data
+        """
+        self.dest = dest
+        self.nodata = nodata
+        self.ds = create_output_geotiff(md, gt, wkt, shape, dest, nodata, tiled=True)
+        self.band = self.ds.GetRasterBand(1)
+        self.shape = shape
+        self.count, self.mean, self.m2 = 0, 0.0, 0.0
+        self.minimum, self.maximum = np.inf, -np.inf
+        # buffered rows of tiles, keyed by index, with the pixels written per row
+        self._block_rows = {}
+        self._next_block_row = 0
+
+    def write(self, data, xoff, yoff):
+        """
+        Write a window of data and update the band statistics
+
+        :param ndarray data: 2D array of the window
+        :param int xoff: column of the top left of the window
+        :param int yoff: row of the top left of the window
+
+        :return: None
+        """
+        data = np.asarray(data, dtype=np.float32)
+        xoff, yoff = int(xoff), int(yoff)
+        rows, cols = data.shape
+        for b in range(yoff // OUTPUT_BLOCK_SIZE, (yoff + rows - 1) // OUTPUT_BLOCK_SIZE + 1):
+            top = b * OUTPUT_BLOCK_SIZE
+            if b not in self._block_rows:
+                height = min(OUTPUT_BLOCK_SIZE, self.shape[0] - top)
+                self._block_rows[b] = (np.full((height, self.shape[1]), self.nodata, dtype=np.float32),
+                                       np.zeros(height, dtype=np.int64))
+            block, filled = self._block_rows[b]
+            r0, r1 = max(yoff, top), min(yoff + rows, top + len(block))
+            block[r0 - top:r1 - top, xoff:xoff + cols] = data[r0 - yoff:r1 - yoff]
+            filled[r0 - top:r1 - top] += cols
+        self._write_block_rows()
+        self._update_stats(data)
+
+    def _write_block_rows(self, complete=True):
+        """
+        Write the buffered rows of tiles, in order, that are complete, or all
+        of them if 'complete' is False
+        """
+        while self._next_block_row in self._block_rows:
+            block, filled = self._block_rows[self._next_block_row]
+            if complete and np.any(filled < self.shape[1]):
+                break
+            self.band.WriteArray(block, 0, self._next_block_row * OUTPUT_BLOCK_SIZE)
+            del self._block_rows[self._next_block_row]
+            self._next_block_row += 1
+        if not complete:
+            for b, (block, _) in sorted(self._block_rows.items()):
+                self.band.WriteArray(block, 0, b * OUTPUT_BLOCK_SIZE)
+            self._block_rows.clear()
+
+    def _update_stats(self, data):
+        """
+        Combine the mean and sum of squared deviations of the valid values of
+        a window with those of the windows written before
+        """
+        valid = np.asarray(data, dtype=np.float64)
+        valid = valid[~isnan(valid)] if isnan(self.nodata) else valid[valid != self.nodata]
+        n = valid.size
+        if n == 0:
+            return
+        mean = valid.mean()
+        m2 = np.square(valid - mean).sum()
+        total = self.count + n
+        delta = mean - self.mean
+        self.mean += delta * n / total
+        self.m2 += m2 + delta ** 2 * self.count * n / total
+        self.count = total
+        self.minimum = min(self.minimum, valid.min())
+        self.maximum = max(self.maximum, valid.max())
+
+    def statistics(self):
+        """
+        Returns the statistics of the valid values written so far
+
+        :return: minimum, maximum, mean and standard deviation; None if no
+            valid values have been written
+        :rtype: tuple
+        """
+        if self.count == 0:
+            return None
+        return float(self.minimum), float(self.maximum), float(self.mean), float(np.sqrt(self.m2 / self.count))
+
+    def close(self):
+        """
+        Save the band statistics and close the file
+
+        :return: None, file saved to disk
+        """
+        if self.ds is None:
+            return
+        self._write_block_rows(complete=False)
+        stats = self.statistics()
+        if stats is not None:
+            self.band.SetStatistics(*stats)
+        self.band = None
+        self.ds = None  # manual close
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
 
 
 def write_geotiff(data, outds, nodata):
@@ -994,11 +1205,10 @@ class GeotiffException(Exception):
 def create_tiles(shape, nrows=2, ncols=2):
     """
     Return a list of tiles containing nrows x ncols with each tile preserving
-    the physical layout of original array. The number of rows can be changed
-    (increased) such that the resulting tiles with float32's do not exceed
-    500MB in memory. When the array shape (rows, columns) are not divisible
-    by (nrows, ncols) then some of the array dimensions can change according
-    to numpy.array_split.
+    the physical layout of original array. Use 'plan_tiles' to choose nrows
+    and ncols such that the tiles fit a memory budget. When the array shape
+    (rows, columns) are not divisible by (nrows, ncols) then some of the
+    array dimensions can change according to numpy.array_split.
 
     :param tuple shape: Shape tuple (2-element) of interferogram.
     :param int nrows: Number of rows of tiles
@@ -1020,6 +1230,88 @@ def create_tiles(shape, nrows=2, ncols=2):
     return [Tile(i, (r[0], c[0]), (r[-1]+1, c[-1]+1)) for i, (r, c) in enumerate(product(row_arr, col_arr))]
 
 
+def tile_memory_per_pixel(nifgs, nepochs):
+    """
+    Returns the peak memory in bytes used per pixel of a tile by the tile
+    based steps, from the arrays each step holds for a tile:
+
+    - mst: the boolean nan mask and the boolean MST cube
+    - timeseries, the largest of its stages:
+
+      - the SVD solve: the boolean 'mst' cube, the float32 'ifg_data' cube
+        and 'tsvel_matrix', the packed observation patterns and their int64
+        pixel indices, and the observations of a pattern gathered as float32
+        then float64 with their float64 solution
+      - the end of 'time_series': the cubes above less the pattern arrays,
+        the boolean zero mask and the float64 incremental and cumulative
+        time series
+      - the zero epoch insert: the boolean 'mst' cube and the float64
+        cumulative time series before and after the insert
+      - the linear regression: the boolean 'mst' cube, the float64 input
+        and its nan mask, the float64 centred times and displacements, and
+        the float64 sums and float32 outputs per pixel
+
+    - stack: the float32 'obs' cube, the boolean 'mst' cube, the float64
+      residuals of each pixel group, and the float32 rate, error and
+      samples arrays
+
+    The largest of these is scaled by 'TILE_MEMORY_SAFETY', so the model
+    stays an upper bound of the measured peak.
+
+    :param int nifgs: Number of interferograms
+    :param int nepochs: Number of epochs
+
+    :return: peak bytes per pixel over the tile based steps
+    :rtype: int
+    """
+    nvel = max(nepochs - 1, 1)
+    mst = 2 * nifgs
+    svd = 5 * nifgs + 4 * nvel + 2 * (nifgs // 8 + 1) + 4 * 8 + 12 * nifgs + 8 * nvel
+    increments = 5 * nifgs + 4 * nvel + nvel + 2 * 8 * nvel
+    insert = nifgs + 8 * nvel + 8 * nepochs
+    regression = nifgs + 8 * nepochs + nepochs + 2 * 8 * nepochs + 12 * 8 + 5 * 4
+    timeseries = max(svd, increments, insert, regression)
+    stack = 5 * nifgs + 8 * nifgs + 3 * 4
+    return int(np.ceil(TILE_MEMORY_SAFETY * max(mst, timeseries, stack)))
+
+
+def plan_tiles(shape, nifgs, nepochs, budget, min_tiles=1, overhead=WORKER_MEMORY_OVERHEAD):
+    """
+    Choose the number of rows and columns of tiles such that the tile based
+    steps do not use more than a memory budget per worker, and there are at
+    least a minimum number of tiles. The fixed memory of a worker is reserved
+    from the budget before it is divided among the pixels of a tile. Tiles
+    are split along their longer side so they stay close to square.
+
+    :param tuple shape: Shape tuple (2-element) of interferogram
+    :param int nifgs: Number of interferograms
+    :param int nepochs: Number of epochs
+    :param float budget: Memory budget in bytes per worker
+    :param int min_tiles: Minimum number of tiles (optional)
+    :param float overhead: Fixed memory in bytes of a worker (optional)
+
+    :return: rows: Number of rows of tiles
+    :rtype: int
+    :return: cols: Number of columns of tiles
+    :rtype: int
+    """
+    no_y, no_x = shape
+    if budget <= overhead:
+        log.warning('Memory budget of {:.0f} MB does not cover the {:.0f} MB used by a worker before it reads a tile; '
+                    'using the smallest tiles'.format(budget / 2 ** 20, overhead / 2 ** 20))
+    max_pixels = max(int((budget - overhead) // tile_memory_per_pixel(nifgs, nepochs)), 1)
+    rows, cols = 1, 1
+    while rows < no_y or cols < no_x:
+        tile_y, tile_x = -(-no_y // rows), -(-no_x // cols)
+        if tile_y * tile_x <= max_pixels and rows * cols >= min_tiles:
+            break
+        if cols == no_x or (tile_y >= tile_x and rows < no_y):
+            rows += 1
+        else:
+            cols += 1
+    return rows, cols
+
+
 class Tile():
     """
     Tile class for containing a sub-part of an interferogram
@@ -1162,10 +1454,14 @@ def _prep_ifg(ifg_path, params):
 
 def save_numpy_phase(ifg_paths, params):
     """
-    Save interferogram phase data as numpy array file on disk.
+    Save interferogram phase data to disk as one phase cube per tile. Each
+    cube is a float32 numpy array file of shape (nifgs, rows, cols) holding
+    all interferograms of the tile, in the order of 'ifg_paths', so that a
+    tile can be memory-mapped in a single sequential read. The interferogram
+    order is saved once in a small index file. Pending correction layers are
+    applied to the phase data as it is read.
 
     :param list ifg_paths: List of strings for interferogram paths
-    :param list tiles: List of pyrate.shared.Tile instances
     :param dict params: Dictionary of configuration parameters
 
     :return: None, file saved to disk
@@ -1174,21 +1470,315 @@ def save_numpy_phase(ifg_paths, params):
     outdir = params[cf.TMPDIR]
     if not os.path.exists(outdir):
         mkdir_p(outdir)
-    for ifg_path in mpiops.array_split(ifg_paths):
-        ifg = Ifg(ifg_path)
+
+    def _create_phase_cubes():
+        with open(phase_cube_index_path(params), 'w') as f:
+            f.write('\n'.join(basename(p).split('.')[0] for p in ifg_paths) + '\n')
+        offsets = {}
+        for t in tiles:
+            cube = np.lib.format.open_memmap(phase_cube_path(params, t.index), mode='w+', dtype=np.float32,
+                                             shape=(len(ifg_paths), int(t.bottom_right_y - t.top_left_y),
+                                                    int(t.bottom_right_x - t.top_left_x)))
+            offsets[t.index] = cube.offset
+            del cube
+        return offsets
+
+    offsets = mpiops.run_once(_create_phase_cubes)
+
+    # each process writes the disjoint byte ranges of its own ifgs
+    cube_files = {t.index: open(phase_cube_path(params, t.index), 'r+b') for t in tiles}
+    valid_obs = np.zeros(len(tiles), dtype=np.int64)
+    for k in mpiops.array_split(range(len(ifg_paths))):
+        ifg = Ifg(ifg_paths[k])
         ifg.open()
+        apply_correction_layers(ifg, params)
         phase_data = ifg.phase_data
-        bname = basename(ifg_path).split('.')[0]
-        for t in tiles:
-            p_data = phase_data[t.top_left_y:t.bottom_right_y,
-                                t.top_left_x:t.bottom_right_x]
-            phase_file = 'phase_data_{}_{}.npy'.format(bname, t.index)
-            np.save(file=join(outdir, phase_file),
-                    arr=p_data)
+        for n, t in enumerate(tiles):
+            p_data = np.ascontiguousarray(phase_data[t.top_left_y:t.bottom_right_y,
+                                                     t.top_left_x:t.bottom_right_x], dtype=np.float32)
+            valid_obs[n] += np.count_nonzero(~np.isnan(p_data))
+            f = cube_files[t.index]
+            f.seek(offsets[t.index] + int(k) * p_data.nbytes)
+            f.write(p_data.tobytes())
         ifg.close()
+    for f in cube_files.values():
+        f.close()
+    # the number of valid observations in each tile is used to schedule tile jobs
+    valid_obs = mpiops.comm.allreduce(valid_obs)
+    mpiops.run_once(np.save, tile_costs_path(params), valid_obs)
     mpiops.comm.barrier()
 
 
+def uses_correction_layers(params):
+    """
+    Returns True if corrections are recorded as correction layers rather than
+    written to the interferograms by each 'correct' step. Layers are used
+    when the 'correct' workflow initialises the list of correction layers.
+
+    :param dict params: Dictionary of configuration parameters
+
+    :return: True if correction layers are used
+    :rtype: bool
+    """
+    return params.get(cf.CORRECTION_LAYERS) is not None
+
+
+def record_correction_layer(params, layer):
+    """
+    Record a correction layer to be composed onto the interferogram phase
+    data when interferograms or tiles are next read.
+
+    :param dict params: Dictionary of configuration parameters
+    :param function layer: Function with signature layer(ifg, params) that
+        applies the correction in place to the phase data of an open Ifg
+
+    :return: None
+    """
+    params[cf.CORRECTION_LAYERS].append(layer)
+
+
+def apply_correction_layers(ifg, params):
+    """
+    Compose the pending correction layers onto the phase data of an open
+    interferogram, in the order the corrections were estimated. The phase
+    data are the same as if each correction had been written to disk.
+
+    :param Ifg ifg: Open interferogram class instance
+    :param dict params: Dictionary of configuration parameters
+
+    :return: None, phase data modified in place
+    """
+    for layer in params.get(cf.CORRECTION_LAYERS) or []:
+        layer(ifg, params)
+
+
+def update_phase_cubes(ifg_paths, params):
+    """
+    Save the phase cubes of all tiles unless the cubes on disk already
+    include the pending correction layers.
+
+    :param list ifg_paths: List of strings for interferogram paths
+    :param dict params: Dictionary of configuration parameters
+
+    :return: None, files saved to disk if required
+    """
+    state = tuple(layer.__name__ for layer in params.get(cf.CORRECTION_LAYERS) or [])
+    if params.get(cf.PHASE_CUBE_LAYERS) != state:
+        save_numpy_phase(ifg_paths, params)
+        params[cf.PHASE_CUBE_LAYERS] = state
+
+
+def write_correction_layers(ifg_paths, params):
+    """
+    Apply the pending correction layers to the interferograms and write the
+    corrected phase and metadata to disk in a single pass. The phase cubes
+    are updated to match.
+
+    :param list ifg_paths: List of strings for interferogram paths
+    :param dict params: Dictionary of configuration parameters
+
+    :return: None, files saved to disk
+    """
+    layers = params.get(cf.CORRECTION_LAYERS)
+    if not layers:
+        return
+    log.info('Writing {} correction layers to interferograms'.format(len(layers)))
+    for p in mpiops.array_split(ifg_paths):
+        ifg = Ifg(p)
+        ifg.open(readonly=False)
+        apply_correction_layers(ifg, params)
+        ifg.write_modified_phase()
+        ifg.close()
+    mpiops.comm.barrier()
+    cubes_current = params.get(cf.PHASE_CUBE_LAYERS) == tuple(layer.__name__ for layer in layers)
+    params[cf.CORRECTION_LAYERS] = []
+    if cubes_current:
+        params[cf.PHASE_CUBE_LAYERS] = ()
+    update_phase_cubes(ifg_paths, params)
+
+
+def phase_cube_path(params, index):
+    """
+    Returns the path of the phase cube file of a tile
+
+    :param dict params: Dictionary of configuration parameters
+    :param int index: Tile index
+
+    :return: path of the phase cube file
+    :rtype: Path
+    """
+    return Path(params[cf.TMPDIR], 'phase_cube_{}.npy'.format(index))
+
+
+def phase_cube_index_path(params):
+    """
+    Returns the path of the file listing the interferogram order of the
+    phase cubes
+
+    :param dict params: Dictionary of configuration parameters
+
+    :return: path of the phase cube index file
+    :rtype: Path
+    """
+    return Path(params[cf.TMPDIR], 'phase_cube_ifgs.txt')
+
+
+def tile_costs_path(params):
+    """
+    Returns the path of the file holding the number of valid observations
+    in each tile, saved with the phase cubes
+
+    :param dict params: Dictionary of configuration parameters
+
+    :return: path of the tile costs file
+    :rtype: Path
+    """
+    return Path(params[cf.TMPDIR], 'tile_costs.npy')
+
+
+def tile_costs(params):
+    """
+    Returns an estimate of the cost of processing each tile. This is the
+    number of valid observations in the tile, counted when the phase cubes
+    were saved. If these counts are not available the cost is estimated as
+    the tile size times the number of valid observations per pixel in the
+    pre-read interferograms.
+
+    :param dict params: Dictionary of configuration parameters
+
+    :return: costs: estimated cost of each tile in params[cf.TILES]
+    :rtype: ndarray
+    """
+    tiles = params[cf.TILES]
+    path = tile_costs_path(params)
+    if path.exists():
+        costs = np.load(path)
+        if len(costs) == len(tiles):
+            return costs.astype(np.float64)
+    preread_ifgs = params.get(cf.PREREAD_IFGS) or {}
+    valid = sum(1 - p.nan_fraction for p in preread_ifgs.values() if isinstance(p, PrereadIfg))
+    sizes = np.array([(t.bottom_right_y - t.top_left_y) * (t.bottom_right_x - t.top_left_x) for t in tiles],
+                     dtype=np.float64)
+    return sizes * (valid if valid else 1)
+
+
+# phase cubes opened by this process, keyed by file path
+_phase_cubes = {}
+
+
+def load_phase_cube(params, tile):
+    """
+    Memory-maps the phase cube of a tile saved by 'save_numpy_phase'. The
+    map is read-only, so slices are zero-copy views that must be copied
+    before they are modified. Maps are reused until the file is rewritten.
+
+    :param dict params: Dictionary of configuration parameters
+    :param Tile tile: Tile instance
+
+    :return: cube: (nifgs, rows, cols) memory-mapped phase data
+    :rtype: ndarray
+    :return: ifg_index: dict of interferogram base name to cube position
+    :rtype: dict
+    """
+    path = phase_cube_path(params, tile.index)
+    stat = os.stat(path)
+    stamp = (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+    if path not in _phase_cubes or _phase_cubes[path][0] != stamp:
+        with open(phase_cube_index_path(params)) as f:
+            ifg_index = {name: k for k, name in enumerate(f.read().split())}
+        _phase_cubes[path] = stamp, np.load(path, mmap_mode='r'), ifg_index
+    return _phase_cubes[path][1:]
+
+
+# parameters published by 'SharedParams' and loaded by this process, keyed by token
+_shared_params = {}
+
+
+class _SharedArrayRef:
+    """
+    Placeholder for an array of a parameters dictionary saved to disc by
+    'SharedParams'
+    """
+    def __init__(self, path):
+        self.path = path
+
+
+class SharedParams:
+    """
+    Context manager publishing a parameters dictionary once for the joblib
+    workers of this process, instead of pickling it with every task. Array
+    values, such as the VCMT, are saved as .npy files in the temp directory
+    and memory-mapped by the workers, so all workers share the pages of one
+    copy. The rest of the dictionary, including the preread ifgs and tiles,
+    is pickled to a single file. Only the small handle is sent with each
+    task; each worker loads the parameters on its first task and reuses
+    them for later tasks. Each publication has a random token, which names
+    its files and identifies it in the worker cache. The files are removed
+    on exit.
+    """
+    def __init__(self, params: dict):
+        self.params = params
+        self.path = None
+        self.token = None
+        self._files = []
+
+    def __enter__(self):
+        self.token = uuid.uuid4().hex
+        prefix = os.path.join(self.params[cf.TMPDIR], 'shared_params_{}_{}'.format(mpiops.rank, self.token))
+        published = {}
+        for k, v in self.params.items():
+            if isinstance(v, np.ndarray) and not v.dtype.hasobject:
+                self._files.append('{}_{}.npy'.format(prefix, len(self._files)))
+                np.save(self._files[-1], v)
+                v = _SharedArrayRef(self._files[-1])
+            published[k] = v
+        self.path = prefix + '.pkl'
+        self._files.append(self.path)
+        with open(self.path, 'wb') as f:
+            pickle.dump(published, f, protocol=pickle.HIGHEST_PROTOCOL)
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        for f in self._files:
+            if os.path.exists(f):
+                os.remove(f)
+        self._files = []
+
+    def __getstate__(self):
+        # workers only need the handle, not the parameters
+        return {'path': self.path, 'token': self.token}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state, params=None, _files=[])
+
+    def load(self) -> dict:
+        """
+        Returns the published parameters, loading them if this process has
+        not already. Arrays are copy-on-write memory maps.
+
+        :return: params: Dictionary of configuration parameters
+        :rtype: dict
+        """
+        if self.params is not None:
+            return self.params
+        if self.token not in _shared_params:
+            _shared_params.clear()  # parameters of earlier calls are no longer needed
+            with open(self.path, 'rb') as f:
+                params = pickle.load(f)
+            for k, v in params.items():
+                if isinstance(v, _SharedArrayRef):
+                    params[k] = np.load(v.path, mmap_mode='c')
+            _shared_params[self.token] = params
+        return _shared_params[self.token]
+
+
+def _run_shared_tile(func, tile, shared_params, *args, **kwargs):
+    """
+    Run a tile function in a joblib worker with the published parameters
+    """
+    return metrics.run_tile(func, tile, shared_params.load(), *args, **kwargs)
+
+
 def get_geotiff_header_info(ifg_path):
     """
     Return information from a geotiff interferogram header using GDAL methods.
@@ -1323,17 +1913,60 @@ def join_dicts(dicts: List[dict]) -> dict:
 
 
 def tiles_split(func, params, *args, **kwargs):
+    """
+    Run a function on every tile, distributing the tiles over the MPI
+    processes and, if 'parallel' is set, over the workers of each process.
+    With the dynamic tile schedule, tiles are handed out on demand from a
+    counter shared by all processes, most costly tiles first, so processes
+    given cheap tiles take on more of them. Otherwise each process runs an
+    equal number of tiles. Workers are sent a 'SharedParams' handle rather
+    than the parameters. The metrics of each tile are recorded.
+
+    :param function func: Function with signature func(tile, params, *args, **kwargs)
+    :param dict params: Dictionary of configuration parameters
+    :param list args: Other positional arguments to pass on to func (optional)
+    :param dict kwargs: Other named arguments to pass on to func (optional)
+
+    :return: None
+    """
     tiles = params[cf.TILES]
-    process_tiles = mpiops.array_split(tiles)
-    if params[cf.PARALLEL]:
-        Parallel(n_jobs=params[cf.PROCESSES], verbose=joblib_log_level(cf.LOG_LEVEL))(
-            delayed(func)(t, params, *args, **kwargs) for t in process_tiles)
-    else:
-        for t in process_tiles:
-            func(t, params, *args, **kwargs)
+    batch_size = params[cf.PROCESSES] if params[cf.PARALLEL] else 1
+    dynamic = params.get(cf.TILE_SCHEDULE, cf.DYNAMIC_TILES) == cf.DYNAMIC_TILES
+    # the counter must be freed by every process, even if a tile fails
+    with ExitStack() as stack:
+        counter = stack.enter_context(mpiops.SharedCounter()) if dynamic and mpiops.size > 1 else None
+        if dynamic:
+            batches = _dynamic_tile_batches(tiles, tile_costs(params), batch_size, counter)
+        else:
+            batches = [mpiops.array_split(tiles)]
+        if params[cf.PARALLEL]:
+            with SharedParams(params) as shared_params, worker_pool(params) as parallel:
+                for batch in batches:
+                    metrics.add_records(parallel(
+                        delayed(_run_shared_tile)(func, t, shared_params, *args, **kwargs) for t in batch))
+        else:
+            for batch in batches:
+                metrics.add_records([metrics.run_tile(func, t, params, *args, **kwargs) for t in batch],
+                                    worker=False)
     mpiops.comm.barrier()
 
 
+def _dynamic_tile_batches(tiles, costs, batch_size, counter=None):
+    """
+    Generator of batches of tiles for this process, taken in order of
+    decreasing cost from a 'mpiops.SharedCounter' shared by all MPI
+    processes. Without a counter, all tiles form one batch.
+    """
+    order = [tiles[i] for i in np.argsort(-np.asarray(costs), kind='stable')]
+    if counter is None:
+        yield order
+        return
+    start = counter.fetch_and_add(batch_size)
+    while start < len(order):
+        yield order[start:start + batch_size]
+        start = counter.fetch_and_add(batch_size)
+
+
 def output_tiff_filename(inpath, outpath):
     """
     Output geotiff filename for a given input filename.
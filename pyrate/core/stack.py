@@ -19,12 +19,13 @@ This Python module implements pixel-by-pixel rate
 stacking method.
 """
 import os
-import pickle as cp
-from scipy.linalg import solve, cholesky, qr, inv
+from scipy.linalg import solve, solve_triangular, qr, inv
 from numpy import nan, isnan, sqrt, diag, delete, array, float32, size
 import numpy as np
 from pyrate.core import config as cf, shared
 from pyrate.core.shared import tiles_split
+from pyrate.core.algorithm import unique_observation_patterns
+from pyrate.core.covariance import VcmFactorCache
 from pyrate.core.logger import pyratelogger as log
 from pyrate.configuration import Configuration
 
@@ -48,16 +49,101 @@ def stack_rate_array(ifgs, params, vcmt, mst=None):
     :rtype: ndarray
     """
     nsig, pthresh, cols, error, mst, obs, rate, rows, samples, span = _stack_setup(ifgs, mst, params)
+    cache = VcmFactorCache(vcmt)
 
     # pixel-by-pixel calculation.
     # nested loops to loop over the 2 image dimensions
     for i in range(rows):
         for j in range(cols):
-            rate[i, j], error[i, j], samples[i, j] = stack_rate_pixel(obs[:, i, j], mst[:, i, j], vcmt, span, nsig, pthresh)
+            rate[i, j], error[i, j], samples[i, j] = stack_rate_pixel(obs[:, i, j], mst[:, i, j], vcmt, span,
+                                                                      nsig, pthresh, cache)
 
+    log.debug(f'Stacking VCM factor cache: {cache.stats()}')
     return rate, error, samples
 
 
+def stack_rate_batch(ifgs, params, vcmt, mst=None):
+    """
+    Batched equivalent of 'pyrate.core.stack.stack_rate_array'. Pixels are
+    grouped by their set of observations so that the VCM subset of each group
+    is inverted and factored once. Since stacking estimates a single rate
+    parameter, the first weighted least-squares pass is evaluated in closed
+    form for all pixels of a group together. Only pixels where an observation
+    is rejected by the 'nsig' test are passed on to the iterative
+    'pyrate.core.stack.stack_rate_pixel' algorithm.
+
+    :param Ifg.object ifgs: Sequence of objects containing the interferometric observations
+    :param dict params: Configuration parameters
+    :param ndarray vcmt: Derived positive definite temporal variance covariance matrix
+    :param ndarray mst: Pixel-wise matrix describing the minimum spanning tree network
+
+    :return: rate: Rate (velocity) map
+    :rtype: ndarray
+    :return: error: Standard deviation of the rate map
+    :rtype: ndarray
+    :return: samples: Number of observations used in rate calculation for each pixel
+    :rtype: ndarray
+    """
+    nsig, pthresh, cols, error, mst, obs, rate, rows, samples, span = _stack_setup(ifgs, mst, params)
+    cache = VcmFactorCache(vcmt)
+    obs_flat = obs.reshape(obs.shape[0], -1)
+    rate_flat, error_flat, samples_flat = rate.reshape(-1), error.reshape(-1), samples.reshape(-1)
+    nreject = 0
+
+    for ind, pixels in unique_observation_patterns(mst):
+        samples_flat[pixels] = len(ind)
+        if len(ind) < pthresh:
+            rate_flat[pixels] = nan
+            error_flat[pixels] = nan
+            continue
+        v, err, max_val, outlier = _stack_rate_group(obs_flat[np.ix_(ind, pixels)], span[0, ind], cache(ind))
+        accept = ~(max_val > nsig)
+        rate_flat[pixels[accept]] = v[accept]
+        error_flat[pixels[accept]] = err
+        # pixels with an outlier continue with the iterative pixel algorithm
+        for p, o in zip(pixels[~accept], outlier[~accept]):
+            i, j = divmod(int(p), cols)
+            mst_pixel = mst[:, i, j].astype(bool)
+            mst_pixel[ind[o]] = False
+            rate[i, j], error[i, j], _samples = stack_rate_pixel(obs[:, i, j], mst_pixel, vcmt, span,
+                                                                 nsig, pthresh, cache)
+            if not isnan(rate[i, j]):
+                samples[i, j] = _samples
+        nreject += np.count_nonzero(~accept)
+
+    log.debug(f'Stacking: {nreject} of {rows * cols} pixels required outlier rejection; '
+              f'VCM factor cache: {cache.stats()}')
+    return rate, error, samples
+
+
+def _stack_rate_group(ifgv, span, factors):
+    """
+    First pass of the weighted least-squares rate estimate for a group of
+    pixels sharing the same observations.
+
+    :param ndarray ifgv: 2D array of observations (nobs, npixels)
+    :param ndarray span: Vector of interferometric time spans of the observations
+    :param VcmFactors factors: Factorisations of the VCM subset for the observations
+
+    :return: v: Estimated rate (velocity) of each pixel
+    :rtype: ndarray
+    :return: err: Standard deviation of the rate, common to all pixels
+    :rtype: float64
+    :return: max_val: Maximum ratio of residual to a-priori standard deviation for each pixel
+    :rtype: ndarray
+    :return: outlier: Observation index of the maximum ratio for each pixel
+    :rtype: ndarray
+    """
+    weighted_span = factors.inv.dot(span)
+    normal = span.dot(weighted_span)
+    v = weighted_span.dot(ifgv) / normal
+    err = sqrt(1 / normal)
+    # residuals (model minus observations) relative to a-priori variances
+    r = np.outer(span, v) - ifgv
+    wr = abs(factors.weight.dot(r))
+    return v, err, wr.max(axis=0), wr.argmax(axis=0)
+
+
 def mask_rate(rate, error, maxsig):
     """
     Function to mask pixels in the rate and error arrays when the error
@@ -73,6 +159,29 @@ def mask_rate(rate, error, maxsig):
     :rtype: ndarray
     """
     log.info('Masking stack rate and error maps where sigma is greater than {} millimetres'.format(maxsig))
+    masked, orig = mask_rate_counts(rate, error, maxsig)
+    # calculate percentage of masked pixels
+    nummasked = int(masked/orig*100)
+    log.info('Percentage of pixels masked = {}%'.format(nummasked))
+
+    return rate, error
+
+
+def mask_rate_counts(rate, error, maxsig):
+    """
+    Function to mask pixels in place in the rate and error arrays when the
+    error is greater than the error threshold 'maxsig', without logging, so
+    a map can be masked a tile at a time.
+
+    :param ndarray rate: array of pixel rates derived by stacking
+    :param ndarray error: array of errors for the pixel rates
+    :param int maxsig: error threshold for masking (in millimetres).
+
+    :return: masked: number of pixels masked
+    :rtype: int
+    :return: orig: number of pixels with an error before masking
+    :rtype: int
+    """
     # initialise mask array with existing NaNs
     mask = ~isnan(error)
     # original Nan count
@@ -82,14 +191,10 @@ def mask_rate(rate, error, maxsig):
     # replace values with NaNs
     rate[mask] = nan
     error[mask] = nan
-    # calculate percentage of masked pixels
-    nummasked = int(np.count_nonzero(mask)/orig*100)
-    log.info('Percentage of pixels masked = {}%'.format(nummasked))
-
-    return rate, error
+    return np.count_nonzero(mask), orig
 
 
-def stack_rate_pixel(obs, mst, vcmt, span, nsig, pthresh):
+def stack_rate_pixel(obs, mst, vcmt, span, nsig, pthresh, cache=None):
     """
     Algorithm to estimate the rate (velocity) for a single pixel using iterative
     weighted least-squares stacking method.
@@ -100,6 +205,7 @@ def stack_rate_pixel(obs, mst, vcmt, span, nsig, pthresh):
     :param ndarray span: Vector of interferometric time spans
     :param int nsig: Threshold for iterative removal of interferometric observations
     :param int pthresh: Threshold for minimum number of observations for the pixel
+    :param VcmFactorCache cache: [optional] Cache of VCM subset factorisations shared between pixels
 
     :return: rate: Estimated rate (velocity) for the pixel
     :rtype: float64
@@ -109,6 +215,8 @@ def stack_rate_pixel(obs, mst, vcmt, span, nsig, pthresh):
     :rtype: int
     """
 
+    if cache is None:
+        cache = VcmFactorCache(vcmt)
     # find the indices of independent ifgs from MST
     ind = np.nonzero(mst)[0]  # only True's in mst are chosen
     # iterative loop to calculate 'robust' velocity for pixel
@@ -121,17 +229,17 @@ def stack_rate_pixel(obs, mst, vcmt, span, nsig, pthresh):
         # form design matrix from appropriate ifg time spans
         B = span[:, ind]
 
-        # Subset of full VCM matrix for selected observations
-        vcm_temp = vcmt[ind, np.vstack(ind)]
+        # Factorisations of the VCM subset for selected observations
+        factors = cache(ind)
 
         # Get the lower triangle cholesky decomposition.
         # V must be positive definite (symmetrical and square)
-        T = cholesky(vcm_temp, 1)
+        T = factors.chol
 
         # Incorporate inverse of VCM into the design matrix
         # and observations vector
-        A = solve(T, B.transpose())
-        b = solve(T, ifgv.transpose())
+        A = solve_triangular(T, B.transpose(), lower=True)
+        b = solve_triangular(T, ifgv.transpose(), lower=True)
 
         # Factor the design matrix, incorporate covariances or weights into the
         # system of equations, and transform the response vector.
@@ -142,7 +250,7 @@ def stack_rate_pixel(obs, mst, vcmt, span, nsig, pthresh):
         v = solve(R, z)
 
         # Compute the model errors
-        err1 = inv(vcm_temp).dot(B.conj().transpose())
+        err1 = factors.inv.dot(B.conj().transpose())
         err2 = B.dot(err1)
         err = sqrt(diag(inv(err2)))
 
@@ -150,7 +258,7 @@ def stack_rate_pixel(obs, mst, vcmt, span, nsig, pthresh):
         r = (B * v) - ifgv
 
         # determine the ratio of residuals and apriori variances
-        w = cholesky(inv(vcm_temp))
+        w = factors.weight
         wr = abs(np.dot(w, r.transpose()))
 
         # test if maximum ratio is greater than user threshold.
@@ -198,9 +306,12 @@ def stack_calc_wrapper(params):
     log.info('Calculating rate map via stacking')
     if not Configuration.vcmt_path(params).exists():
         raise FileNotFoundError("VCMT is not found on disc. Have you run the 'correct' step?")
-    params[cf.PREREAD_IFGS] = cp.load(open(Configuration.preread_ifgs(params), 'rb'))
-    params[cf.VCMT] = np.load(Configuration.vcmt_path(params))
-    params[cf.TILES] = Configuration.get_tiles(params)
+    params[cf.PREREAD_IFGS] = Configuration.load_preread_ifgs(params)
+    # the VCMT and tiles are kept in params by a workflow session
+    if cf.VCMT not in params:
+        params[cf.VCMT] = np.load(Configuration.vcmt_path(params))
+    if cf.TILES not in params:
+        params[cf.TILES] = Configuration.get_tiles(params)
     tiles_split(_stacking_for_tile, params)
     log.debug("Finished stacking calc!")
 
@@ -216,7 +327,7 @@ def _stacking_for_tile(tile, params):
     log.debug(f"Stacking of tile {tile.index}")
     ifg_parts = [shared.IfgPart(p, tile, preread_ifgs, params) for p in ifg_paths]
     mst_tile = np.load(Configuration.mst_path(params, tile.index))
-    rate, error, samples = stack_rate_array(ifg_parts, params, vcmt, mst_tile)
+    rate, error, samples = stack_rate_batch(ifg_parts, params, vcmt, mst_tile)
     np.save(file=os.path.join(output_dir, 'stack_rate_{}.npy'.format(tile.index)), arr=rate)
     np.save(file=os.path.join(output_dir, 'stack_error_{}.npy'.format(tile.index)), arr=error)
     np.save(file=os.path.join(output_dir, 'stack_samples_{}.npy'.format(tile.index)), arr=samples)
@@ -0,0 +1,263 @@
+#   This Python module is part of the PyRate software package.
+#
+#   Copyright 2020 Geoscience Australia
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+"""
+This Python module implements a cache of PyRate step outputs. The outputs of
+a step are recorded in a manifest file with a key hashed from fingerprints of
+the step input data and the values of the parameters the step depends on.
+Outputs are reused only if the key is unchanged and the output files have not
+been modified since they were recorded; otherwise they are deleted so the
+step recomputes them.
+"""
+import os
+import json
+import hashlib
+from pathlib import Path
+from typing import List, Union
+
+from pyrate.core import config as cf, mpiops
+from pyrate.core.logger import pyratelogger as log
+
+MANIFEST_FILE = 'step_cache.json'
+
+# bytes read at a time when hashing file contents
+HASH_BLOCK_BYTES = 2 ** 24
+
+# parameters on which the outputs of each step depend, besides the step inputs
+STEP_PARAMS = {
+    'conv2tif': [cf.PROCESSOR, cf.NO_DATA_VALUE],
+    'refpixel': [cf.REFX, cf.REFY, cf.REFNX, cf.REFNY, cf.REF_CHIP_SIZE, cf.REF_MIN_FRAC],
+    'orbfit': [cf.ORBITAL_FIT, cf.ORBITAL_FIT_METHOD, cf.ORBITAL_FIT_DEGREE, cf.ORBITAL_FIT_LOOKS_X,
+               cf.ORBITAL_FIT_LOOKS_Y, cf.ORBFIT_OFFSET, cf.NO_DATA_AVERAGING_THRESHOLD],
+    'refphase': [cf.REF_EST_METHOD, cf.REF_CHIP_SIZE, cf.REF_MIN_FRAC, cf.REFX_FOUND, cf.REFY_FOUND],
+    'mst': [],
+    'apscorrect': [cf.APSEST, cf.SLPF_METHOD, cf.SLPF_CUTOFF, cf.SLPF_ORDER, cf.SLPF_NANFILL,
+                   cf.SLPF_NANFILL_METHOD, cf.TLPF_METHOD, cf.TLPF_CUTOFF, cf.TLPF_PTHR],
+    'maxvar': [],
+}
+
+
+def manifest_path(params: dict) -> Path:
+    """
+    Returns the path of the step cache manifest file
+
+    :param dict params: Dictionary of configuration parameters
+
+    :return: path of the manifest file
+    :rtype: Path
+    """
+    return Path(params[cf.OUT_DIR], MANIFEST_FILE)
+
+
+def load_manifest(params: dict) -> dict:
+    """
+    Load the step cache manifest. The manifest holds the key and output
+    file stamps of each recorded step, and the content hashes of the input
+    files seen so far.
+
+    :param dict params: Dictionary of configuration parameters
+
+    :return: manifest: dictionary with 'steps' and 'files' entries
+    :rtype: dict
+    """
+    path = manifest_path(params)
+    if path.exists():
+        try:
+            with open(path) as f:
+                manifest = json.load(f)
+            if isinstance(manifest.get('steps'), dict) and isinstance(manifest.get('files'), dict):
+                return manifest
+        except ValueError:
+            pass
+        log.warning(f'Ignoring unreadable step cache manifest {path}')
+    return {'steps': {}, 'files': {}}
+
+
+def save_manifest(params: dict, manifest: dict) -> None:
+    """
+    Atomically save the step cache manifest
+
+    :param dict params: Dictionary of configuration parameters
+    :param dict manifest: manifest dictionary as returned by load_manifest
+
+    :return: None, file saved to disk
+    """
+    path = manifest_path(params)
+    tmp_path = path.with_suffix('.tmp')
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+def _stamp(path: Union[str, Path]) -> List[int]:
+    """
+    Returns the size and modification time of a file
+    """
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def file_fingerprint(path: Union[str, Path], manifest: dict) -> str:
+    """
+    Returns a hash of the contents of a file. Hashes are kept in the
+    manifest and only recomputed if the file size or modification time
+    change.
+
+    :param str path: path of the file
+    :param dict manifest: manifest dictionary as returned by load_manifest
+
+    :return: hex digest of the file contents, or None if the file does not exist
+    :rtype: str
+    """
+    path = str(path)
+    if not os.path.exists(path):
+        return None
+    stamp = _stamp(path)
+    known = manifest['files'].get(path)
+    if known is not None and known[:2] == stamp:
+        return known[2]
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_BYTES), b''):
+            digest.update(block)
+    manifest['files'][path] = stamp + [digest.hexdigest()]
+    return digest.hexdigest()
+
+
+def hash_key(*parts) -> str:
+    """
+    Returns a hash of the json representation of the given parts
+
+    :param list parts: json serialisable objects; other objects are hashed
+        by their string representation
+
+    :return: hex digest
+    :rtype: str
+    """
+    return hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def input_key(params: dict) -> str:
+    """
+    Returns a key of the multi-looked interferograms used as input to the
+    'correct' steps, from the contents of the files and the nan conversion
+    parameters.
+
+    :param dict params: Dictionary of configuration parameters
+
+    :return: hex digest
+    :rtype: str
+    """
+    manifest = load_manifest(params)
+    fingerprints = [file_fingerprint(p.sampled_path, manifest) for p in params[cf.INTERFEROGRAM_FILES]]
+    save_manifest(params, manifest)
+    return hash_key('inputs', fingerprints, params.get(cf.NAN_CONVERSION), params.get(cf.NO_DATA_VALUE))
+
+
+def step_key(params: dict, step: str, *extra) -> str:
+    """
+    Returns the key of the outputs of a 'correct' step, from the key of the
+    state of the interferograms the step starts from and the parameters the
+    step depends on. The state is params[cf.STEP_STATE] when running the
+    'correct' workflow, or the key of the input interferograms otherwise.
+
+    :param dict params: Dictionary of configuration parameters
+    :param str step: name of the step
+    :param list extra: further values the outputs depend on (optional)
+
+    :return: hex digest
+    :rtype: str
+    """
+    state = params.get(cf.STEP_STATE)
+    if state is None:
+        state = mpiops.run_once(input_key, params)
+    return hash_key(step, state, [params.get(p) for p in STEP_PARAMS[step]], list(extra))
+
+
+def is_current(params: dict, name: str, key: str, outputs: List[Union[str, Path]],
+               manifest: dict = None) -> bool:
+    """
+    Returns True if the outputs recorded under a name were computed with the
+    same key and are unchanged on disk.
+
+    :param dict params: Dictionary of configuration parameters
+    :param str name: name of the cache entry
+    :param str key: key of the outputs
+    :param list outputs: output file paths
+    :param dict manifest: manifest dictionary (optional, loaded if not given)
+
+    :return: True if the outputs can be reused
+    :rtype: bool
+    """
+    manifest = load_manifest(params) if manifest is None else manifest
+    entry = manifest['steps'].get(name)
+    if entry is None or entry['key'] != key:
+        return False
+    recorded = entry['outputs']
+    for p in map(str, outputs):
+        if p not in recorded or not os.path.exists(p) or _stamp(p) != recorded[p]:
+            return False
+    return True
+
+
+def invalidate_stale(params: dict, name: str, key: str, outputs: List[Union[str, Path]]) -> bool:
+    """
+    Delete the outputs of a cache entry unless they are current, so the step
+    computing them runs again. Only the main process deletes files.
+
+    :param dict params: Dictionary of configuration parameters
+    :param str name: name of the cache entry
+    :param str key: key of the outputs
+    :param list outputs: output file paths
+
+    :return: True if the outputs are current and can be reused
+    :rtype: bool
+    """
+    def _invalidate():
+        if is_current(params, name, key, outputs):
+            return True
+        stale = [p for p in map(str, outputs) if os.path.exists(p)]
+        if stale:
+            log.info(f"Recomputing '{name}': {len(stale)} outputs on disk are out of date")
+        for p in stale:
+            os.remove(p)
+        return False
+    current = mpiops.run_once(_invalidate)
+    mpiops.comm.barrier()
+    return current
+
+
+def record(params: dict, entries: List[tuple], files: dict = None) -> None:
+    """
+    Record the outputs of cache entries in the manifest. Only the main
+    process writes the manifest; outputs must be on disk.
+
+    :param dict params: Dictionary of configuration parameters
+    :param list entries: list of (name, key, outputs) tuples
+    :param dict files: file content hashes from the 'files' entry of a
+        manifest, to be kept for later runs (optional)
+
+    :return: None, manifest saved to disk
+    """
+    def _record():
+        manifest = load_manifest(params)
+        manifest['files'].update(files or {})
+        for name, key, outputs in entries:
+            manifest['steps'][name] = {
+                'key': key,
+                'outputs': {str(p): _stamp(p) for p in outputs if os.path.exists(p)}
+            }
+        save_manifest(params, manifest)
+    mpiops.run_once(_record)
@@ -21,16 +21,16 @@ inversion in PyRate.
 # pylint: disable=too-many-arguments
 import os
 
-import pickle as cp
 from numpy import (where, isnan, nan, diff, zeros,
                    float32, cumsum, dot, delete, asarray)
-from numpy.linalg import matrix_rank, pinv, cholesky
+from numpy.linalg import matrix_rank, pinv
 import numpy as np
 from scipy.linalg import qr
 from scipy.stats import linregress
 from pyrate.core.shared import tiles_split
-from pyrate.core.algorithm import first_second_ids, get_epochs
+from pyrate.core.algorithm import first_second_ids, get_epochs, unique_observation_patterns
 from pyrate.core import config as cf, mst as mst_module, shared
+from pyrate.core.covariance import VcmFactorCache
 from pyrate.core.config import ConfigException
 from pyrate.core.logger import pyratelogger as log
 from pyrate.configuration import Configuration
@@ -137,15 +137,24 @@ def time_series(ifgs, params, vcmt=None, mst=None):
         ncols, nrows, nvelpar, span, tsvel_matrix = \
         _time_series_setup(ifgs, params, mst)
 
-    # pixel-by-pixel calculation.
-    # nested loops to loop over the 2 image dimensions
-    for row in range(nrows):
-        for col in range(ncols):
-            tsvel_matrix[row, col] = _time_series_pixel(
-                row, col, b0_mat, sm_factor, sm_order, ifg_data, mst,
-                nvelpar, p_thresh, interp, vcmt, ts_method)
-
-    tsvel_matrix = where(tsvel_matrix == 0, nan, tsvel_matrix)
+    if ts_method == 2:
+        # SVD method: the solution operator only depends on the pixel's
+        # observation pattern, so solve once per unique MST pattern
+        _time_series_svd_by_pattern(b0_mat, ifg_data, mst, nvelpar, p_thresh,
+                                    interp, tsvel_matrix)
+    else:
+        # VCM subset factorisations are shared by the pixels of the tile
+        cache = VcmFactorCache(vcmt)
+        # pixel-by-pixel calculation.
+        # nested loops to loop over the 2 image dimensions
+        for row in range(nrows):
+            for col in range(ncols):
+                tsvel_matrix[row, col] = _time_series_pixel(
+                    row, col, b0_mat, sm_factor, sm_order, ifg_data, mst,
+                    nvelpar, p_thresh, interp, vcmt, ts_method, cache)
+        log.debug(f'Time series VCM factor cache: {cache.stats()}')
+
+    tsvel_matrix[tsvel_matrix == 0] = nan
     # SB: do the span multiplication as a numpy linalg operation, MUCH faster
     #  not even this is necessary here, perform late for performance
     tsincr = tsvel_matrix * span
@@ -156,7 +165,7 @@ def time_series(ifgs, params, vcmt=None, mst=None):
     return tsincr, tscuml, tsvel_matrix
 
 
-def _remove_rank_def_rows(b_mat, nvelpar, ifgv, sel):
+def _remove_rank_def_rows(b_mat, nvelpar, sel):
     """
     Remove rank deficient rows of design matrix
     """
@@ -164,43 +173,58 @@ def _remove_rank_def_rows(b_mat, nvelpar, ifgv, sel):
     licols = e_var[matrix_rank(b_mat):nvelpar]
     [rmrow, _] = where(b_mat[:, licols] != 0)
     b_mat = delete(b_mat, rmrow, axis=0)
-    ifgv = delete(ifgv, rmrow)
     sel = delete(sel, rmrow)
-    return b_mat, ifgv, sel, rmrow
+    return b_mat, sel, rmrow
+
+
+def _reduce_design_matrix(b0_mat, sel, nvelpar, interp):
+    """
+    Form the design matrix for the selected observations. If the network is
+    a single tree (interp == 0), rank deficient rows are removed along with
+    the columns of epochs that are no longer constrained.
+
+    :return: b_mat: reduced design matrix, or None if one or fewer
+        observations remain
+    :return: sel: indices of the observations retained in the design matrix
+    :return: velflag: vector that is zero for epochs not being estimated
+    """
+    b_mat = b0_mat[sel, :]
+    if interp == 0:
+        # remove rank deficient rows
+        rmrow = asarray([0])  # dummy
+
+        while len(rmrow) > 0:
+            # if b_mat.shape[0] <=1 then we return nans
+            if b_mat.shape[0] > 1:
+                b_mat, sel, rmrow = _remove_rank_def_rows(b_mat, nvelpar, sel)
+            else:
+                return None, sel, None
+
+        # Some epochs have been deleted; get valid epoch indices
+        velflag = sum(abs(b_mat), 0)
+        # remove corresponding columns in design matrix
+        b_mat = b_mat[:, ~np.isclose(velflag, 0.0)]
+    else:
+        velflag = np.ones(nvelpar)
+    return b_mat, sel, velflag
 
 
 def _time_series_pixel(row, col, b0_mat, sm_factor, sm_order, ifg_data, mst,
-                          nvelpar, p_thresh, interp, vcmt, method):
+                          nvelpar, p_thresh, interp, vcmt, method, cache=None):
     """
     Wrapper function to compute time series for single pixel.
     """
     # check pixel for non-redundant ifgs
     sel = np.nonzero(mst[:, row, col])[0]  # trues in mst are chosen
     if len(sel) >= p_thresh:
-        ifgv = ifg_data[sel, row, col]
         # make design matrix, b_mat
-        b_mat = b0_mat[sel, :]
-        if interp == 0:
-            # remove rank deficient rows
-            rmrow = asarray([0])  # dummy
-
-            while len(rmrow) > 0:
-                # if b_mat.shape[0] <=1 then we return nans
-                if b_mat.shape[0] > 1:
-                    b_mat, ifgv, sel, rmrow = _remove_rank_def_rows(
-                        b_mat, nvelpar, ifgv, sel)
-                else:
-                    return np.empty(nvelpar) * np.nan
-
-            # Some epochs have been deleted; get valid epoch indices
-            velflag = sum(abs(b_mat), 0)
-            # remove corresponding columns in design matrix
-            b_mat = b_mat[:, ~np.isclose(velflag, 0.0)]
-        else:
-            velflag = np.ones(nvelpar)
+        b_mat, sel, velflag = _reduce_design_matrix(b0_mat, sel, nvelpar, interp)
+        if b_mat is None:
+            return np.empty(nvelpar) * np.nan
+        ifgv = ifg_data[sel, row, col]
         if method == 1: # Use Laplacian smoothing method
             tsvel = _solve_ts_lap(nvelpar, velflag, ifgv, b_mat,
-                                  sm_order, sm_factor, sel, vcmt)
+                                  sm_order, sm_factor, sel, vcmt, cache)
         elif method == 2: # Use SVD method
             tsvel = _solve_ts_svd(nvelpar, velflag, ifgv, b_mat)
         else:
@@ -210,6 +234,29 @@ def _time_series_pixel(row, col, b0_mat, sm_factor, sm_order, ifg_data, mst,
         return np.empty(nvelpar) * np.nan
 
 
+def _time_series_svd_by_pattern(b0_mat, ifg_data, mst, nvelpar, p_thresh,
+                                interp, tsvel_matrix):
+    """
+    Solve the SVD time series for all pixels of a tile. The reduced design
+    matrix and its pseudo-inverse are computed once for each unique MST
+    observation pattern and applied to every pixel sharing that pattern
+    as a single matrix product. Results are written into tsvel_matrix.
+    """
+    nifgs, nrows, ncols = ifg_data.shape
+    obs = ifg_data.reshape(nifgs, nrows * ncols)
+    tsvel = tsvel_matrix.reshape(nrows * ncols, nvelpar)
+    tsvel[:] = nan
+    for sel, pixels in unique_observation_patterns(mst):
+        if len(sel) < p_thresh:
+            continue
+        b_mat, sel, velflag = _reduce_design_matrix(b0_mat, sel, nvelpar, interp)
+        if b_mat is None:
+            continue
+        # solve least squares equations using Moore-Penrose pseudoinverse
+        tsvel[np.ix_(pixels, velflag != 0)] = dot(pinv(b_mat), obs[np.ix_(sel, pixels)]).T
+    return tsvel_matrix
+
+
 def _solve_ts_svd(nvelpar, velflag, ifgv, b_mat):
     """
     Solve the linear least squares system using the SVD method.
@@ -221,10 +268,11 @@ def _solve_ts_svd(nvelpar, velflag, ifgv, b_mat):
     return tsvel
 
 
-def _solve_ts_lap(nvelpar, velflag, ifgv, mat_b, smorder, smfactor, sel, vcmt):
+def _solve_ts_lap(nvelpar, velflag, ifgv, mat_b, smorder, smfactor, sel, vcmt, cache=None):
     """
     Solve the linear least squares system using the Finite Difference
-    method using a Laplacian Smoothing operator.
+    method using a Laplacian Smoothing operator. Factorisations of the
+    VCM subset are taken from cache when given.
     """
     # pylint: disable=invalid-name
     # Laplacian observations number
@@ -258,26 +306,20 @@ def _solve_ts_lap(nvelpar, velflag, ifgv, mat_b, smorder, smfactor, sel, vcmt):
 
     nlap += 2
 
-    # add laplacian design matrix to existing design matrix
-    mat_b = np.concatenate((mat_b, b_lap), axis=0)
+    # the variance-covariance matrix of the ifg and Laplacian observations is
+    # block diagonal with an identity block for the Laplacian equations, so
+    # only the ifg block needs to be whitened using the factorised VCM subset
+    if cache is None:
+        cache = VcmFactorCache(vcmt)
+    w = cache(sel).weight
 
-    # combine ifg and Laplacian smooth vector
-    v_lap = np.zeros(nlap)
-    obsv = np.concatenate((ifgv, v_lap), axis=0)
-
-    # make variance-covariance matrix
-    # new covariance matrix, adding the laplacian equations
-    m = len(sel)
-    nobs = m + nlap
-    vcm_tmp = np.eye(nobs)
-    vcm_tmp[:m, :m] = vcmt[sel, np.vstack(sel)]
+    # add whitened laplacian design matrix to existing design matrix
+    wb = np.concatenate((dot(w, mat_b), b_lap), axis=0)
+    # combine whitened ifg and Laplacian smooth vector
+    wl = np.concatenate((dot(w, ifgv), np.zeros(nlap)), axis=0)
 
     # solve the equation by least-squares
     # calculate velocities
-    # we get the lower triangle in numpy
-    w = cholesky(pinv(vcm_tmp)).T
-    wb = dot(w, mat_b)
-    wl = dot(w, obsv)
     x = dot(pinv(wb, rcond=1e-8), wl)
 
     # TODO: implement residuals and roughness calculations
@@ -330,9 +372,11 @@ def linear_rate_pixel(y, t):
 
 def linear_rate_array(tscuml, ifgs, params):
     """
-    This function loops over all pixels in a 3-dimensional cumulative
-    time series array and calculates the linear rate (line of best fit)
-    for each pixel using linear regression.
+    This function calculates the linear rate (line of best fit) for every
+    pixel in a 3-dimensional cumulative time series array using linear
+    regression. The regression is evaluated for all pixels at once from
+    NaN-masked sums over the epoch axis; results are identical to
+    applying 'linear_rate_pixel' to each pixel.
 
     :param ndarray tscuml: 3-dimensional cumulative time series array
     :param list ifgs: list of interferogram class objects.
@@ -349,10 +393,6 @@ def linear_rate_array(tscuml, ifgs, params):
     :return: samples: Number of observations used in linear regression for each pixel
     :rtype: ndarray
     """
-    b0_mat, interp, p_thresh, sm_factor, sm_order, ts_method, ifg_data, mst, \
-        ncols, nrows, nvelpar, span, tsvel_matrix = \
-        _time_series_setup(ifgs, params)
-
     epochlist = get_epochs(ifgs)[0]
     # get cumulative time per epoch
     t = asarray(epochlist.spans)
@@ -361,21 +401,51 @@ def linear_rate_array(tscuml, ifgs, params):
     if tscuml.shape[2] != len(t):
         raise TimeSeriesError("linear_rate_array: tscuml and nepochs are not equal length")
 
-    # preallocate empty arrays for results
-    linrate = np.empty([nrows, ncols], dtype=float32)
-    rsquared = np.empty([nrows, ncols], dtype=float32)
-    error = np.empty([nrows, ncols], dtype=float32)
-    intercept = np.empty([nrows, ncols], dtype=np.float32)
-    samples = np.empty([nrows, ncols], dtype=np.float32)
+    return _linear_rate_vectorised(tscuml, t)
 
-    # pixel-by-pixel calculation.
-    # nested loops to loop over the 2 image dimensions
-    for i in range(nrows):
-        for j in range(ncols):
-            linrate[i, j], intercept[i, j], rsquared[i, j], error[i, j], samples[i, j] = \
-                linear_rate_pixel(tscuml[i, j, :], t)
 
-    return linrate, intercept, rsquared, error, samples
+def _linear_rate_vectorised(tscuml, t):
+    """
+    Ordinary least squares line fit of tscuml against t along the third
+    axis, with the same definitions (and special cases) as
+    scipy.stats.linregress.
+    """
+    # Mask to exclude nan elements
+    mask = ~isnan(tscuml)
+    nsamp = np.count_nonzero(mask, axis=2)
+    # the centred series are formed in place, so only two float64 cubes
+    # are held besides the input
+    dy = where(mask, tscuml, 0).astype(np.float64, copy=False)
+    dt = where(mask, asarray(t, dtype=np.float64), 0.0)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # masked means, then masked sums of centred squares and products
+        tmean = np.sum(dt, axis=2) / nsamp
+        ymean = np.sum(dy, axis=2) / nsamp
+        dt -= tmean[:, :, np.newaxis]
+        dt *= mask
+        dy -= ymean[:, :, np.newaxis]
+        dy *= mask
+        sstt = np.einsum('ijk,ijk->ij', dt, dt)
+        ssyy = np.einsum('ijk,ijk->ij', dy, dy)
+        ssty = np.einsum('ijk,ijk->ij', dt, dy)
+
+        # r is zero for a constant series, as in linregress
+        r_den = np.sqrt(sstt * ssyy)
+        r_value = np.clip(where(r_den == 0.0, 0.0, ssty / r_den), -1.0, 1.0)
+        linrate = ssty / sstt
+        intercept = ymean - linrate * tmean
+        # standard error is zero when only two points are fitted
+        error = where(nsamp == 2, 0.0, np.sqrt((1 - r_value**2) * ssyy / sstt / (nsamp - 2)))
+
+    # not enough time series obs for line fitting
+    invalid = nsamp < 2
+    outputs = []
+    for out in (linrate, intercept, r_value**2, error, nsamp):
+        out = out.astype(float32)
+        out[invalid] = nan
+        outputs.append(out)
+    return tuple(outputs)
 
 
 def _missing_option_error(option):
@@ -402,9 +472,12 @@ def timeseries_calc_wrapper(params):
         log.info('Calculating time series using SVD method')
     if not Configuration.vcmt_path(params).exists():
         raise FileNotFoundError("VCMT is not found on disc. Have you run the 'correct' step?")
-    params[cf.PREREAD_IFGS] = cp.load(open(Configuration.preread_ifgs(params), 'rb'))
-    params[cf.VCMT] = np.load(Configuration.vcmt_path(params))
-    params[cf.TILES] = Configuration.get_tiles(params)
+    params[cf.PREREAD_IFGS] = Configuration.load_preread_ifgs(params)
+    # the VCMT and tiles are kept in params by a workflow session
+    if cf.VCMT not in params:
+        params[cf.VCMT] = np.load(Configuration.vcmt_path(params))
+    if cf.TILES not in params:
+        params[cf.TILES] = Configuration.get_tiles(params)
     tiles_split(__calc_time_series_for_tile, params)
     log.debug("Finished timeseries calc!")
 
@@ -420,11 +493,13 @@ def __calc_time_series_for_tile(tile, params):
     log.debug(f"Calculating time series for tile {tile.index}")
     ifg_parts = [shared.IfgPart(p, tile, preread_ifgs, params) for p in ifg_paths]
     mst_tile = np.load(Configuration.mst_path(params, tile.index))
-    tsincr, tscuml, _ = time_series(ifg_parts, params, vcmt, mst_tile)
-    np.save(file=os.path.join(output_dir, 'tscuml_{}.npy'.format(tile.index)), arr=tscuml)
+    tsincr, tscuml = time_series(ifg_parts, params, vcmt, mst_tile)[:2]
+    # time series tiles are saved epoch-major so merge can read one epoch at a time
+    np.save(file=os.path.join(output_dir, 'tscuml_{}.npy'.format(tile.index)), arr=np.moveaxis(tscuml, 2, 0))
     # optional save of tsincr npy tiles
     if params["savetsincr"] == 1:
-        np.save(file=os.path.join(output_dir, 'tsincr_{}.npy'.format(tile.index)), arr=tsincr)
+        np.save(file=os.path.join(output_dir, 'tsincr_{}.npy'.format(tile.index)), arr=np.moveaxis(tsincr, 2, 0))
+    del tsincr
     tscuml = np.insert(tscuml, 0, 0, axis=2)  # add zero epoch to tscuml 3D array
     log.info('Calculating linear regression of cumulative time series')
     linrate, intercept, r_squared, std_err, samples = linear_rate_array(tscuml, ifg_parts, params)
@@ -21,7 +21,7 @@ import shutil
 import os
 from pathlib import Path
 import pickle as cp
-from pyrate.core import (shared, algorithm, mpiops, config as cf)
+from pyrate.core import (shared, algorithm, mpiops, config as cf, stepcache, metrics)
 from pyrate.core.config import ConfigException
 from pyrate.core.aps import wrap_spatio_temporal_filter
 from pyrate.core.covariance import maxvar_vcm_calc_wrapper
@@ -132,7 +132,9 @@ def main(params):
 
 def _update_params_with_tiles(params: dict) -> None:
     ifg_path = params[cf.INTERFEROGRAM_FILES][0].sampled_path
-    rows, cols = params["rows"], params["cols"]
+    rows, cols = mpiops.run_once(Configuration.tile_rows_cols, params)
+    if params.get(cf.MEMORY_BUDGET):
+        log.info(f"Using {rows} x {cols} tiles to fit a memory budget of {params[cf.MEMORY_BUDGET]} MB per worker")
     tiles = mpiops.run_once(get_tiles, ifg_path, rows, cols)
     # add tiles to params
     params[cf.TILES] = tiles
@@ -166,11 +168,25 @@ def correct_ifgs(params: dict) -> None:
     # house keeping
     _update_params_with_tiles(params)
     _create_ifg_dict(params)
-    params[cf.REFX_FOUND], params[cf.REFY_FOUND] = ref_pixel_calc_wrapper(params)
+    # each step cache key depends on the state the interferograms were left in by the steps before
+    params[cf.STEP_STATE] = mpiops.run_once(stepcache.input_key, params)
+    with metrics.measure('step', 'refpixel'):
+        params[cf.REFX_FOUND], params[cf.REFY_FOUND] = ref_pixel_calc_wrapper(params)
+
+    # corrections are recorded as layers and written to the ifgs once
+    params[cf.CORRECTION_LAYERS] = []
+    params.pop(cf.PHASE_CUBE_LAYERS, None)
 
     # run through the correct steps in user specified sequence
     for step in params['correct']:
-        correct_steps[step](params)
+        with metrics.measure('step', step):
+            correct_steps[step](params)
+        params[cf.STEP_STATE] = stepcache.step_key(params, step)
+
+    ifg_paths = [p.tmp_sampled_path for p in params[cf.INTERFEROGRAM_FILES]]
+    with metrics.measure('step', 'write_corrections'):
+        shared.write_correction_layers(ifg_paths, params)
+        shared.update_phase_cubes(ifg_paths, params)
     log.info("Finished 'correct' step")
 
 
@@ -124,6 +124,22 @@ PYRATE_DEFAULT_CONFIGURATION = {
         "PossibleValues": None,
         "Required": False
     },
+    "tileschedule": {
+        "DataType": int,
+        "DefaultValue": 1,
+        "MinValue": None,
+        "MaxValue": None,
+        "PossibleValues": [0, 1],
+        "Required": False
+    },
+    "memorybudget": {
+        "DataType": float,
+        "DefaultValue": 0.0,
+        "MinValue": 0,
+        "MaxValue": None,
+        "PossibleValues": None,
+        "Required": False
+    },
     "cohmask": {
         "DataType": int,
         "DefaultValue": 0,
@@ -341,6 +357,14 @@ PYRATE_DEFAULT_CONFIGURATION = {
         "PossibleValues": ["linear", "nearest", "cubic"],
         "Required": False
     },
+    "apsoutofcore": {
+        "DataType": int,
+        "DefaultValue": 0,
+        "MinValue": None,
+        "MaxValue": None,
+        "PossibleValues": [0, 1],
+        "Required": False
+    },
     "tlpfmethod": {
         "DataType": int,
         "DefaultValue": 1,
@@ -421,6 +445,14 @@ PYRATE_DEFAULT_CONFIGURATION = {
         "PossibleValues": None,
         "Required": False
     },
+    "alphafitmethod": {
+        "DataType": int,
+        "DefaultValue": 1,
+        "MinValue": 1,
+        "MaxValue": 2,
+        "PossibleValues": [1, 2],
+        "Required": False
+    },
     "savenpy": {
         "DataType": int,
         "DefaultValue": 0,
@@ -28,9 +28,9 @@ from pyrate.constants import CLI_DESCRIPTION
 from pyrate import conv2tif, prepifg, correct, merge
 from pyrate.core.logger import pyratelogger as log, configure_stage_log
 from pyrate.core import config as cf
-from pyrate.core import mpiops
+from pyrate.core import mpiops, metrics
 from pyrate.configuration import Configuration
-from pyrate.core.shared import mpi_vs_multiprocess_logging
+from pyrate.core.shared import mpi_vs_multiprocess_logging, worker_pool
 from pyrate.core.stack import stack_calc_wrapper
 from pyrate.core.timeseries import timeseries_calc_wrapper
 
@@ -41,6 +41,56 @@ def _params_from_conf(config_file):
     return config.__dict__
 
 
+class WorkflowSession:
+    """
+    State of the 'workflow' command kept in memory from one step to the
+    next. The configuration file is parsed and validated once. Each step is
+    given its own copy of the parameters, with fresh copies of the file
+    lists that 'conv2tif' and 'prepifg' extend in place, so the changes a
+    step makes to its parameters do not reach later steps. Only the tiles,
+    preread ifgs and VCMT produced by 'correct' are passed on, instead of
+    later steps reading them back from disc and re-planning the tiles.
+    """
+    # parameters extended in place by steps
+    MUTATED = [cf.INTERFEROGRAM_FILES, cf.COHERENCE_FILE_PATHS, cf.HEADER_FILE_PATHS]
+
+    def __init__(self, config: dict):
+        """
+        :param dict config: Dictionary of parameters parsed from the configuration file
+        """
+        self.config = config
+        self.state = {}
+
+    def params(self) -> dict:
+        """
+        Returns the parameters for the next step
+
+        :return: params: Dictionary of configuration parameters
+        :rtype: dict
+        """
+        params = dict(self.config)
+        for k in self.MUTATED:
+            if params.get(k) is not None:
+                params[k] = list(params[k])
+        params.update(self.state)
+        return params
+
+    def update(self, command: str, params: dict) -> None:
+        """
+        Keep the parameters produced by a step that later steps reuse
+
+        :param str command: name of the step
+        :param dict params: Dictionary of configuration parameters of the step
+
+        :return: None
+        """
+        if command == 'correct':
+            self.state[cf.TILES] = params[cf.TILES]
+            self.state[cf.PREREAD_IFGS] = mpiops.run_once(Configuration.load_preread_ifgs, params)
+            if cf.VCMT in params:
+                self.state[cf.VCMT] = params[cf.VCMT]
+
+
 def main():
 
     start_time = time.time()
@@ -108,50 +158,50 @@ def main():
         log.setLevel(args.verbosity)
         log.info("Verbosity set to " + str(args.verbosity) + ".")
 
+    # MPI jobs disable joblib parallel processing in every step, so apply the
+    # override before any pool of workers is opened
+    if mpiops.size > 1:
+        params[cf.PARALLEL] = 0
+
     if args.command == "conv2tif":
-        conv2tif.main(params)
+        _run_command("conv2tif", conv2tif.main, params)
 
     if args.command == "prepifg":
-        prepifg.main(params)
+        _run_command("prepifg", prepifg.main, params)
 
     if args.command == "correct":
-        correct.main(params)
+        _run_command("correct", correct.main, params)
 
     if args.command == "timeseries":
-        timeseries(params)
+        _run_command("timeseries", timeseries, params)
 
     if args.command == "stack":
-        stack(params)
+        _run_command("stack", stack, params)
 
     if args.command == "merge":
-        merge.main(params)
+        _run_command("merge", merge.main, params)
 
     if args.command == "workflow":
-        log.info("***********CONV2TIF**************")
-        conv2tif.main(params)
-
-        log.info("***********PREPIFG**************")
-        params = mpiops.run_once(_params_from_conf, args.config_file)
-        prepifg.main(params)
-
-        log.info("***********CORRECT**************")
-        # reset params as prepifg modifies params
-        params = mpiops.run_once(_params_from_conf, args.config_file)
-        correct.main(params)
+        session = WorkflowSession(params)
+        # one pool of workers for all the steps
+        with worker_pool(params):
+            for command, func in WORKFLOW:
+                log.info("***********{}**************".format(command.upper()))
+                params = session.params()
+                _run_command(command, func, params)
+                session.update(command, params)
 
-        log.info("***********TIMESERIES**************")
-        params = mpiops.run_once(_params_from_conf, args.config_file)
-        timeseries(params)
-
-        log.info("***********STACK**************")
-        params = mpiops.run_once(_params_from_conf, args.config_file)
-        stack(params)
+    log.info("--- Runtime = %s seconds ---" % (time.time() - start_time))
 
-        log.info("***********MERGE**************")
-        params = mpiops.run_once(_params_from_conf, args.config_file)
-        merge.main(params)
 
-    log.info("--- Runtime = %s seconds ---" % (time.time() - start_time))
+def _run_command(command: str, func, params: dict) -> None:
+    """
+    Run a PyRate command, with one pool of workers for all its parallel
+    calls, and write its performance metrics to the output directory
+    """
+    with metrics.measure('step', command), worker_pool(params):
+        func(params)
+    metrics.write_metrics(params, command)
 
 
 def timeseries(params: dict) -> None:
@@ -164,6 +214,17 @@ def stack(params: dict) -> None:
     stack_calc_wrapper(params)
 
 
+# steps of the 'workflow' command, in order
+WORKFLOW = [
+    ("conv2tif", conv2tif.main),
+    ("prepifg", prepifg.main),
+    ("correct", correct.main),
+    ("timeseries", timeseries),
+    ("stack", stack),
+    ("merge", merge.main),
+]
+
+
 if __name__ == "__main__":
     main()
 
@@ -18,7 +18,6 @@ This Python module does post-processing steps to assemble the
 stack rate and time series outputs and save as geotiff files
 """
 from os.path import join, isfile, exists
-import pickle
 import numpy as np
 from osgeo import gdal
 import subprocess
@@ -40,7 +39,7 @@ def main(params: dict) -> None:
     stfile = join(params[cf.TMPDIR], 'stack_rate_0.npy')
     if exists(stfile):
         # setup paths
-        mpiops.run_once(_merge_stack, params)
+        _merge_stack(params)
         out_types += ['stack_rate', 'stack_error']
     else:
         log.warning('Not merging stack products; {} does not exist'.format(stfile))
@@ -71,24 +70,39 @@ def _merge_stack(params: dict) -> None:
     """
     Merge stacking outputs
     """
-    shape, tiles, ifgs_dict = _merge_setup(params)
+    shape, tiles, ifgs_dict = mpiops.run_once(_merge_setup, params)
 
     log.info('Merging and writing Stack Rate product geotiffs')
-
-    # read and assemble tile outputs
-    rate = assemble_tiles(shape, params[cf.TMPDIR], tiles, out_type='stack_rate')
-    error = assemble_tiles(shape, params[cf.TMPDIR], tiles, out_type='stack_error')
-    samples = assemble_tiles(shape, params[cf.TMPDIR], tiles, out_type='stack_samples')
-
-    # mask pixels according to threshold
-    if params[cf.LR_MAXSIG] > 0:
-        rate, error = stack.mask_rate(rate, error, params[cf.LR_MAXSIG])
+    maxsig = params[cf.LR_MAXSIG]
+    if maxsig > 0:
+        log.info('Masking stack rate and error maps where sigma is greater than {} millimetres'.format(maxsig))
     else:
         log.info('Skipping stack product masking (maxsig = 0)')
-
-    # save geotiff and numpy array files
-    for out, ot in zip([rate, error, samples], ['stack_rate', 'stack_error', 'stack_samples']):
-        _save_merged_files(ifgs_dict, params[cf.OUT_DIR], out, ot, savenpy=params["savenpy"])
+    counts = np.zeros(2, dtype=np.int64)
+
+    # read tile outputs and write each product a tile at a time
+    process_out_types = mpiops.array_split(['stack_rate', 'stack_error', 'stack_samples'])
+    # rate and error are masked together
+    load_types = set(process_out_types)
+    if load_types & {'stack_rate', 'stack_error'}:
+        load_types |= {'stack_rate', 'stack_error'}
+
+    def _load(t):
+        out = {ot: load_tile(params[cf.TMPDIR], t, ot) for ot in load_types}
+        # mask pixels according to threshold
+        if maxsig > 0 and 'stack_rate' in out:
+            tile_counts = stack.mask_rate_counts(out['stack_rate'], out['stack_error'], maxsig)
+            # only the process writing the rate counts the masked pixels
+            if 'stack_rate' in process_out_types:
+                counts[:] += tile_counts
+        return out
+
+    _save_merged_tiles(ifgs_dict, params[cf.OUT_DIR], shape, tiles, process_out_types, _load,
+                       savenpy=params["savenpy"])
+    counts = mpiops.comm.reduce(counts, root=0)
+    if mpiops.rank == 0 and counts[1] > 0:
+        log.info('Percentage of pixels masked = {}%'.format(int(counts[0] / counts[1] * 100)))
+    mpiops.comm.barrier()
 
 
 def _merge_linrate(params: dict) -> None:
@@ -99,12 +113,13 @@ def _merge_linrate(params: dict) -> None:
 
     log.info('Merging and writing Linear Rate product geotiffs')
 
-    # read and assemble tile outputs
+    # read tile outputs and write each product a tile at a time
     out_types = ['linear_' + x for x in ['rate', 'rsquared', 'error', 'intercept', 'samples']]
     process_out_types = mpiops.array_split(out_types)
     for p_out_type in process_out_types:
-        out = assemble_tiles(shape, params[cf.TMPDIR], tiles, out_type=p_out_type)
-        _save_merged_files(ifgs_dict, params[cf.OUT_DIR], out, p_out_type, savenpy=params["savenpy"])
+        _save_merged_tiles(ifgs_dict, params[cf.OUT_DIR], shape, tiles, [p_out_type],
+                           lambda t: {p_out_type: load_tile(params[cf.TMPDIR], t, p_out_type)},
+                           savenpy=params["savenpy"])
     mpiops.comm.barrier()
 
 
@@ -115,22 +130,21 @@ def _merge_timeseries(params: dict, tstype: str) -> None:
     log.info('Merging {} time series outputs'.format(tstype))
     shape, tiles, ifgs_dict = _merge_setup(params)
 
-    # load the first time series file to determine the number of time series tifs
+    # the header of the first time series file gives the number of time series tifs
     ts_file = join(params[cf.TMPDIR], tstype + '_0.npy')
-    ts = np.load(file=ts_file)
     # pylint: disable=no-member
-    no_ts_tifs = ts.shape[2]
+    no_ts_tifs = np.load(file=ts_file, mmap_mode='r').shape[0]
     process_tifs = mpiops.array_split(range(no_ts_tifs))
-    # depending on nvelpar, this will not fit in memory
+    # depending on nvelpar, the time series will not fit in memory
     # e.g. nvelpar=100, nrows=10000, ncols=10000, 32bit floats need 40GB memory
     # 32 * 100 * 10000 * 10000 / 8 bytes = 4e10 bytes = 40 GB
-    # the double for loop helps us overcome the memory limit
+    # so each epoch is read from the tiles and written to its tif one tile at a time
     log.info('Process {} writing {} {} time series tifs of '
              'total {}'.format(mpiops.rank, len(process_tifs), tstype, no_ts_tifs))
     for i in process_tifs:
-        ts_arr = assemble_tiles(shape, params[cf.TMPDIR], tiles, out_type=tstype, index=i)
-        _save_merged_files(ifgs_dict, params[cf.OUT_DIR], ts_arr, out_type=tstype, index=i,
-                           savenpy=params["savenpy"])
+        _save_merged_tiles(ifgs_dict, params[cf.OUT_DIR], shape, tiles, [tstype],
+                           lambda t: {tstype: load_tile(params[cf.TMPDIR], t, tstype, i)},
+                           index=i, savenpy=params["savenpy"])
 
     mpiops.comm.barrier()
     log.debug('Process {} finished writing {} {} time series tifs of '
@@ -177,7 +191,7 @@ def create_png_and_kml_from_tif(output_folder_path: str, output_type: str) -> No
     with open(kml_file_path, "w") as f:
         f.write(kml_file_content)
     
-    # Get raster statistics
+    # Get raster statistics; saved with the file when merged, so not recomputed
     srcband = gtif.GetRasterBand(1)
     minimum, maximum, _, _ = srcband.GetStatistics(True, True)
     del gtif  # close geotiff (used to calculate statistics)
@@ -228,6 +242,26 @@ def create_png_and_kml_from_tif(output_folder_path: str, output_type: str) -> No
     log.debug(f'Finished creating quicklook image for {output_type}')
 
 
+def load_tile(dir, t, out_type, index=None):
+    """
+    Function to load a tile of a product from its numpy file. 3D time series
+    tiles are saved epoch-major, with shape (nepochs, rows, cols), and are
+    memory mapped so only the requested epoch is read.
+
+    :param str dir: path to directory containing numpy tile files.
+    :param Tile t: Tile instance.
+    :param str out_type: product type string, used to construct numpy tile file name.
+    :param int index: array first dimension index to extract from 3D time series array tiles.
+
+    :return: tile: 2D array of the tile.
+    :rtype: ndarray
+    """
+    tile_file = Path(join(dir, out_type + '_'+str(t.index)+'.npy'))
+    if index is None:  # 2D array
+        return np.load(file=tile_file)
+    return np.array(np.load(file=tile_file, mmap_mode='r')[index])  # 3D array
+
+
 def assemble_tiles(s, dir, tiles, out_type, index=None):
     """
     Function to reassemble tiles from numpy files in to a merged array
@@ -235,7 +269,7 @@ def assemble_tiles(s, dir, tiles, out_type, index=None):
     :param tuple s: shape for merged array.
     :param str dir: path to directory containing numpy tile files.
     :param str out_type: product type string, used to construct numpy tile file name.
-    :param int index: array third dimension index to extract from 3D time series array tiles.
+    :param int index: array first dimension index to extract from 3D time series array tiles.
 
     :return: merged_array: array assembled from all tiles.
     :rtype: ndarray
@@ -246,23 +280,50 @@ def assemble_tiles(s, dir, tiles, out_type, index=None):
 
     # loop over each tile, load and slot in to correct spot
     for t in tiles:
-        tile_file = Path(join(dir, out_type + '_'+str(t.index)+'.npy'))
-        tile = np.load(file=tile_file)
-        if index is None:  #2D array
-            merged_array[t.top_left_y:t.bottom_right_y, t.top_left_x:t.bottom_right_x] = tile
-        else:  #3D array
-            merged_array[t.top_left_y:t.bottom_right_y, t.top_left_x:t.bottom_right_x] = tile[:, :, index]
+        merged_array[t.top_left_y:t.bottom_right_y, t.top_left_x:t.bottom_right_x] = \
+            load_tile(dir, t, out_type, index)
 
     log.debug('Finished assembling tiles for {}'.format(out_type))
     return merged_array
 
 
-def _save_merged_files(ifgs_dict, outdir, array, out_type, index=None, savenpy=None):
+def _save_merged_tiles(ifgs_dict, outdir, s, tiles, out_types, load, index=None, savenpy=None):
+    """
+    Convenience function to save PyRate products to geotiff and numpy array
+    files one tile at a time, as each tile is loaded, so only a tile of each
+    product is held in memory. 'load' is a function returning a dictionary of
+    the array of each product for a tile.
+    """
+    if len(out_types) == 0:
+        return
+    log.debug('Saving PyRate outputs {}'.format(out_types))
+    writers, npys = {}, {}
+    for ot in out_types:
+        dest, npy_file, md = _merged_file_metadata(ifgs_dict, outdir, ot, index)
+        writers[ot] = shared.OutputGeotiffWriter(md, ifgs_dict['gt'], ifgs_dict['wkt'], s, dest, np.nan)
+        if savenpy:
+            npys[ot] = np.lib.format.open_memmap(npy_file, mode='w+', dtype=np.float32, shape=s)
+    for t in tiles:
+        arrays = load(t)
+        for ot in out_types:
+            writers[ot].write(arrays[ot], t.top_left_x, t.top_left_y)
+            if savenpy:
+                npys[ot][t.top_left_y:t.bottom_right_y, t.top_left_x:t.bottom_right_x] = arrays[ot]
+    for ot in out_types:
+        writers[ot].close()
+        if savenpy:
+            npys[ot].flush()
+    del npys
+
+    log.debug('Finished saving {}'.format(out_types))
+
+
+def _merged_file_metadata(ifgs_dict, outdir, out_type, index=None):
     """
-    Convenience function to save PyRate geotiff and numpy array files
+    Convenience function returning the geotiff and numpy file names and the
+    metadata of a PyRate output
     """
-    log.debug('Saving PyRate outputs {}'.format(out_type))
-    gt, md, wkt = ifgs_dict['gt'], ifgs_dict['md'], ifgs_dict['wkt']
+    md = dict(ifgs_dict['md'])  # ifgs_dict may be reused for other outputs
     epochlist = ifgs_dict['epochlist']
 
     if out_type in ('tsincr', 'tscuml'):
@@ -300,11 +361,7 @@ def _save_merged_files(ifgs_dict, outdir, array, out_type, index=None, savenpy=N
     else:
         log.warning('Output type "{}" not recognised'.format(out_type))
 
-    shared.write_output_geotiff(md, gt, wkt, array, dest, np.nan)
-    if savenpy:
-        np.save(file=npy_file, arr=array)
-
-    log.debug('Finished saving {}'.format(out_type))
+    return dest, npy_file, md
 
 
 def _merge_setup(params):
@@ -312,9 +369,8 @@ def _merge_setup(params):
     Convenience function for Merge set up steps
     """
     # load previously saved preread_ifgs dict
-    preread_ifgs_file = Configuration.preread_ifgs(params)
-    ifgs_dict = pickle.load(open(preread_ifgs_file, 'rb'))
+    ifgs_dict = Configuration.load_preread_ifgs(params)
     ifgs = [v for v in ifgs_dict.values() if isinstance(v, shared.PrereadIfg)]
     shape = ifgs[0].shape
-    tiles = Configuration.get_tiles(params)
+    tiles = params[cf.TILES] if cf.TILES in params else Configuration.get_tiles(params)
     return shape, tiles, ifgs_dict
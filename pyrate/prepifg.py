@@ -22,7 +22,7 @@ import os
 from subprocess import check_call
 from typing import List, Tuple
 from pathlib import Path
-from joblib import Parallel, delayed
+from joblib import delayed
 import numpy as np
 from osgeo import gdal
 from pyrate.core import shared, mpiops, config as cf, prepifg_helper, gamma, roipac, ifgconstants as ifc, gdal_python
@@ -96,16 +96,15 @@ def do_prepifg(multi_paths: List[MultiplePaths], exts: Tuple[float, float, float
         res_str = [xlooks * ifg.x_step, ylooks * ifg.y_step]
         res_str = ' '.join([str(e) for e in res_str])
         if parallel:
-            Parallel(n_jobs=params[cf.PROCESSES], verbose=50)(
-                delayed(__prepifg_system)(exts, gtiff_path, params, res_str) for gtiff_path in multi_paths)
+            with shared.worker_pool(params) as pool:
+                pool(delayed(__prepifg_system)(exts, gtiff_path, params, res_str) for gtiff_path in multi_paths)
         else:
             for m_path in multi_paths:
                 __prepifg_system(exts, m_path, params, res_str)
     else:
         if parallel:
-            Parallel(n_jobs=params[cf.PROCESSES], verbose=50)(
-                delayed(_prepifg_multiprocessing)(p, exts, params) for p in multi_paths
-            )
+            with shared.worker_pool(params) as pool:
+                pool(delayed(_prepifg_multiprocessing)(p, exts, params) for p in multi_paths)
         else:
             for m_path in multi_paths:
                 _prepifg_multiprocessing(m_path, exts, params)
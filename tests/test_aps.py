@@ -23,7 +23,9 @@ import numpy as np
 from pyrate import conv2tif, prepifg, correct
 from pyrate.configuration import Configuration, MultiplePaths
 import pyrate.core.config as cf
-from pyrate.core.aps import wrap_spatio_temporal_filter, _interpolate_nans
+from pyrate.core.aps import wrap_spatio_temporal_filter, _interpolate_nans, _tlpfilter, tlpf_methods
+from pyrate.core.aps import _slp_filter, slp_filter_stack, aps_store_path, _create_store, _write_store_window
+from pyrate.core.aps import _slpf_cutoff
 from pyrate.core import shared
 from tests import common
 
@@ -46,9 +48,53 @@ def test_slpfilter():
     pass
 
 
-def test_slp_filter():
-    # TODO
-    pass
+def _slp_filter_complex_fft(phase, cutoff, rows, cols, x_size, y_size, params):
+    """reference spatial filter using complex, shifted FFTs"""
+    from scipy.fftpack import fft2, ifft2, fftshift, ifftshift
+    xx, yy = np.meshgrid(range(cols), range(rows))
+    xx = (xx - np.floor(cols / 2)) * x_size
+    yy = (yy - np.floor(rows / 2)) * y_size
+    dist = np.sqrt(xx ** 2 + yy ** 2) / 1.0e3
+    if params[cf.SLPF_METHOD] == 1:
+        H = 1. / (1 + ((dist / cutoff) ** (2 * params[cf.SLPF_ORDER])))
+    else:
+        H = np.exp(-(dist ** 2) / (2 * cutoff ** 2))
+    out = np.real(ifft2(ifftshift(fftshift(fft2(phase)) * H)))
+    out[np.isnan(phase)] = np.nan
+    return out
+
+
+@pytest.mark.parametrize("shape", [(47, 72), (31, 17)])
+@pytest.mark.parametrize("slpfmethod", [1, 2])
+def test_slp_filter(shape, slpfmethod):
+    params = {cf.SLPF_METHOD: slpfmethod, cf.SLPF_ORDER: 2}
+    rows, cols = shape
+    cutoffs = [0.05, 0.5, 2.0]
+    phase = np.random.rand(len(cutoffs), rows, cols)
+    phase[1, 3:6, 4:7] = np.nan
+    # nans are filled before filtering, as in spatial_low_pass_filter
+    _interpolate_nans(np.moveaxis(phase, 0, 2), method='nearest')
+    res = slp_filter_stack(phase, cutoffs, 90.0, 89.5, params)
+    assert not np.isnan(res).any()
+    for k, cutoff in enumerate(cutoffs):
+        exp = _slp_filter_complex_fft(phase[k], cutoff, rows, cols, 90.0, 89.5, params)
+        np.testing.assert_allclose(res[k], exp, rtol=1e-9, atol=1e-12, equal_nan=False)
+        np.testing.assert_allclose(_slp_filter(phase[k], cutoff, rows, cols, 90.0, 89.5, params), exp,
+                                   rtol=1e-9, atol=1e-12, equal_nan=False)
+
+
+def test_slpf_cutoff_passes_params_to_alpha_fit(monkeypatch):
+    # the configured alpha fit method must be used for the cut-off distance
+    calls = []
+
+    def _cvd_from_phase(phase, ifg, r_dist, calc_alpha, params=None):
+        calls.append(params)
+        return 1.0, 4.0
+
+    monkeypatch.setattr('pyrate.core.aps.cvd_from_phase', _cvd_from_phase)
+    params = {cf.SLPF_CUTOFF: 0, cf.COV_ALPHA_FIT_METHOD: cf.ALPHA_BINNED_LSQ}
+    assert _slpf_cutoff(np.ones((3, 3)), None, None, params) == 0.25
+    assert calls == [params]
 
 
 def test_temporal_low_pass_filter():
@@ -56,9 +102,37 @@ def test_temporal_low_pass_filter():
     pass
 
 
-def test_tlpfilter():
-    # TODO
-    pass
+def _tlpfilter_pixel(valid, cutoff, span, threshold, ts, func):
+    """per pixel and epoch reference implementation of the temporal filter"""
+    out = np.full(ts.shape, np.nan, dtype=np.float32)
+    sel = np.nonzero(valid)[0]
+    if len(sel) >= threshold:
+        for k in sel:
+            wgt = func(len(sel), span[sel] - span[k], cutoff)
+            out[k] = np.sum(ts[sel] * wgt / np.sum(wgt))
+    return out
+
+
+@pytest.fixture(params=[1, 2, 3])
+def tlpfmethod(request):
+    return request.param
+
+
+@pytest.mark.parametrize("threshold", [1, 6])
+@pytest.mark.parametrize("cutoff", [0.1, 1.0])
+def test_tlpfilter(tlpfmethod, threshold, cutoff):
+    rows, cols, nepochs = 6, 5, 12
+    span = np.cumsum(np.random.uniform(0.02, 0.3, nepochs))
+    tsincr = np.random.rand(rows, cols, nepochs).astype(np.float32)
+    tsincr[tsincr < 0.3] = np.nan
+    tsincr[0, 0, 2:] = np.nan  # below threshold
+    nanmat = ~np.isnan(tsincr)
+    func = tlpf_methods[tlpfmethod]
+    res = _tlpfilter(nanmat, rows, cols, cutoff, span, threshold, tsincr, func)
+    exp = np.array([[_tlpfilter_pixel(nanmat[r, c], cutoff, span, threshold, tsincr[r, c], func)
+                     for c in range(cols)] for r in range(rows)])
+    assert res.dtype == np.float32
+    np.testing.assert_allclose(res, exp, rtol=1e-6, atol=1e-6)
 
 
 # APS correction using spatio-temporal filter
@@ -83,6 +157,20 @@ def test_tlpfilter():
 # tlpfpthr:     1
 
 
+@pytest.mark.parametrize("start, window", [((0, 0, 0), (5, 7, 11)), ((2, 3, 4), (3, 2, 5)), ((1, 2, 0), (4, 3, 11))])
+def test_write_store_window(tempdir, start, window):
+    shape = (5, 7, 11)
+    path = os.path.join(tempdir(), 'store.npy')
+    offset = _create_store(path, shape)
+    data = np.random.rand(*window)
+    with open(path, 'r+b') as f:
+        _write_store_window(f, offset, shape, data, start)
+    exp = np.zeros(shape, dtype=np.float32)
+    e0, y0, x0 = start
+    exp[e0:e0 + window[0], y0:y0 + window[1], x0:x0 + window[2]] = data
+    np.testing.assert_array_equal(np.load(path), exp)
+
+
 @pytest.fixture(params=[1, 2])
 def slpfmethod(request):
     return request.param
@@ -153,3 +241,22 @@ class TestAPSErrorCorrectionsOnDiscReused:
         phase_again = [i.phase_data for i in self.ifgs]
         np.testing.assert_array_equal(phase_prev, phase_now)
         np.testing.assert_array_equal(phase_prev, phase_again)
+
+    @pytest.mark.slow
+    def test_out_of_core_matches_in_memory(self):
+        self.params[cf.APS_OUT_OF_CORE] = 0
+        wrap_spatio_temporal_filter(self.params)
+        aps_errors = [np.load(MultiplePaths.aps_error_path(i, self.params)) for i in self.ifg_paths]
+        phase_in_memory = [i.phase_data for i in self.ifgs]
+
+        self.teardown_method()
+        self.setup_method()
+        self.params[cf.APS_OUT_OF_CORE] = 1
+        wrap_spatio_temporal_filter(self.params)
+        aps_errors_out_of_core = [np.load(MultiplePaths.aps_error_path(i, self.params)) for i in self.ifg_paths]
+        assert not os.path.exists(aps_store_path(self.params))
+        np.testing.assert_allclose(aps_errors_out_of_core, aps_errors, rtol=1e-5, atol=1e-5)
+        phase_out_of_core = [shared.Ifg(i) for i in self.ifg_paths]
+        for i in phase_out_of_core:
+            i.open()
+        np.testing.assert_allclose([i.phase_data for i in phase_out_of_core], phase_in_memory, rtol=1e-5, atol=1e-5)
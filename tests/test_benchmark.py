@@ -0,0 +1,87 @@
+#   This Python module is part of the PyRate software package.
+#
+#   Copyright 2020 Geoscience Australia
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+"""
+This module contains tests for the synthetic stack generator and history of
+the benchmark utilities.
+"""
+from pathlib import Path
+import networkx as nx
+import numpy as np
+import pytest
+
+from pyrate.core import config as cf
+from utils.benchmark import synthetic, run
+
+
+@pytest.mark.parametrize("nepochs, nifgs", [(5, 4), (10, 17), (6, 15)])
+def test_ifg_network_connected(nepochs, nifgs):
+    pairs = synthetic.ifg_network(nepochs, nifgs)
+    assert len(set(pairs)) == nifgs
+    assert all(i < j for i, j in pairs)
+    g = nx.Graph(pairs)
+    assert g.number_of_nodes() == nepochs and nx.is_connected(g)
+
+
+def test_ifg_network_too_few_ifgs():
+    with pytest.raises(ValueError):
+        synthetic.ifg_network(5, 3)
+
+
+@pytest.mark.parametrize("pattern", ['random', 'patches'])
+def test_nan_mask_fraction(pattern):
+    mask = synthetic.nan_mask((50, 60), 0.1, pattern, np.random.RandomState(1))
+    assert 0.1 <= mask.mean() < 0.2
+
+
+def test_generate_stack_phase_is_epoch_difference(tempdir):
+    shape, nepochs, nifgs = (20, 30), 4, 5
+    files = synthetic.generate_stack(tempdir(), shape, nepochs, nifgs, nan_fraction=0.1, seed=3)
+    ifg_paths = list(cf.parse_namelist(files['ifgfilelist']))
+    assert len(ifg_paths) == nifgs and len(list(cf.parse_namelist(files['hdrfilelist']))) == nepochs
+    dates = synthetic.epoch_dates(nepochs)
+    disp = synthetic.epoch_displacements(shape, dates, seed=3)
+    out = np.zeros((nepochs,) + shape, dtype=np.float32)
+    assert synthetic.epoch_displacements(shape, dates, seed=3, out=out) is out
+    np.testing.assert_array_equal(out, disp)
+    for path, (first, second) in zip(ifg_paths, synthetic.ifg_network(nepochs, nifgs)):
+        assert Path(path).name.startswith(f"{dates[first]:%Y%m%d}-{dates[second]:%Y%m%d}")
+        phase = np.fromfile(path, dtype='>f4').reshape(shape)
+        valid = phase != 0
+        assert 0.8 < valid.mean() < 0.95
+        np.testing.assert_allclose(phase[valid], synthetic._mm_to_radians(disp[second] - disp[first])[valid],
+                                   rtol=1e-5, atol=1e-5)
+
+
+def test_regressions_against_same_case_and_host():
+    case = {'size': 100}
+    env = {'host': 'a'}
+
+    def entry(t, **kwargs):
+        return dict({'case': case, 'env': env, 'steps': {'mst': {'wall_time': t}}}, **kwargs)
+
+    history = [entry(1.0), entry(1.2), entry(0.1, case={'size': 200}), entry(0.1, env={'host': 'b'})]
+    assert run.regressions(history, entry(1.2)) == []
+    assert run.regressions(history, entry(2.0)) == [{'step': 'mst', 'wall_time': 2.0, 'baseline': 1.1}]
+    assert run.regressions([], entry(2.0)) == []
+
+
+def test_history_round_trip(tempdir):
+    path = Path(tempdir(), run.HISTORY_FILE)
+    run.append_history(path, {'case': {'size': 1}})
+    with open(path, 'a') as f:
+        f.write('{truncated\n')
+    run.append_history(path, {'case': {'size': 2}})
+    assert [h['case']['size'] for h in run.load_history(path)] == [1, 2]
@@ -19,10 +19,13 @@
 This Python module contains tests for the config.py PyRate module.
 '''
 import os
+import pickle
 import shutil
 import tempfile
 from os.path import join
 
+import numpy as np
+
 import pyrate.configuration
 from tests.common import SML_TEST_CONF, SML_TEST_TIF
 from tests.common import TEST_CONF_ROIPAC, TEST_CONF_GAMMA
@@ -91,6 +94,7 @@ from pyrate.core.config import (
 from tests import common
 from tests.common import UnitTestAdaptation
 from pyrate.configuration import Configuration
+from pyrate.main import WorkflowSession
 DUMMY_SECTION_NAME = 'pyrate'
 
 
@@ -462,3 +466,27 @@ class TestOneIncidenceOrElevationMap(UnitTestAdaptation):
         self.assertIsNotNone(params[config.APS_ELEVATION_MAP])
         self.assertIn(config.APS_ELEVATION_EXT, params.keys())
         self.assertIn(config.APS_ELEVATION_MAP, params.keys())
+
+
+def test_workflow_session_isolates_steps_and_keeps_correct_outputs(tempdir):
+    tmpdir = tempdir()
+    preread_ifgs = {'a': 1, 'epochlist': [], 'gt': None, 'md': {}, 'wkt': ''}
+    with open(join(tmpdir, 'preread_ifgs.pk'), 'wb') as f:
+        pickle.dump(preread_ifgs, f)
+    session = WorkflowSession({config.TMPDIR: tmpdir, config.INTERFEROGRAM_FILES: ['a'],
+                               config.COHERENCE_FILE_PATHS: None, config.HEADER_FILE_PATHS: ['h']})
+
+    params = session.params()
+    params[config.INTERFEROGRAM_FILES].append('dem')
+    params[config.PARALLEL] = 0
+    assert session.params() == session.config
+
+    # correct keeps the ifg entries of the preread ifgs in params
+    params = session.params()
+    params.update({config.TILES: ['tile'], config.VCMT: np.eye(2), config.PREREAD_IFGS: {'a': 1}})
+    session.update('correct', params)
+    params = session.params()
+    assert params[config.TILES] == ['tile']
+    np.testing.assert_array_equal(params[config.VCMT], np.eye(2))
+    assert params[config.PREREAD_IFGS] == preread_ifgs
+    assert Configuration.load_preread_ifgs(params) is params[config.PREREAD_IFGS]
@@ -28,7 +28,7 @@ import pyrate.core.ref_phs_est
 import pyrate.core.refpixel
 from pyrate.core import shared, ref_phs_est as rpe, ifgconstants as ifc, config as cf
 from pyrate import correct, prepifg, conv2tif
-from pyrate.core.covariance import cvd, get_vcmt, RDist
+from pyrate.core.covariance import cvd, get_vcmt, RDist, _bin_means, VcmFactorCache
 from pyrate.configuration import Configuration, MultiplePaths
 import pyrate.core.orbital
 from pyrate.core import roipac
@@ -99,6 +99,51 @@ class TestCovariance:
         # Discrepancies observed in distance calculations.
         assert_array_almost_equal(act_alpha, exp_alpha, decimal=1)
 
+    def test_binned_alpha_fit_matches_fmin(self):
+        params = dict(self.params)
+        params[cf.COV_ALPHA_FIT_METHOD] = cf.ALPHA_BINNED_LSQ
+        for i in self.ifgs:
+            maxvar, alpha = cvd(i, self.params, self.r_dist, calc_alpha=True)
+            maxvar_b, alpha_b = cvd(i, params, self.r_dist, calc_alpha=True)
+            assert maxvar_b == maxvar
+            np.testing.assert_allclose(alpha_b, alpha, rtol=1e-3)
+
+
+def test_bin_means():
+    values = np.random.rand(500)
+    bins = np.random.randint(0, 20, 500)
+    bins[bins == 7] = 8  # an empty bin
+    exp = [np.mean(values[bins == b]) if np.any(bins == b) else np.nan for b in range(18)]
+    np.testing.assert_allclose(_bin_means(values, bins, 18), exp)
+
+
+class TestVcmFactorCache:
+
+    def setup_method(self):
+        m = np.random.rand(6, 6)
+        self.vcmt = m.dot(m.T) + np.eye(6)
+
+    def test_factors(self):
+        cache = VcmFactorCache(self.vcmt)
+        sel = np.array([0, 2, 3, 5])
+        factors = cache(sel)
+        vcm = self.vcmt[np.ix_(sel, sel)]
+        np.testing.assert_allclose(factors.chol.dot(factors.chol.T), vcm)
+        np.testing.assert_allclose(factors.inv, np.linalg.inv(vcm))
+        np.testing.assert_allclose(factors.weight.T.dot(factors.weight), factors.inv, atol=1e-10)
+        assert np.allclose(np.tril(factors.weight, -1), 0)
+
+    def test_hits_and_eviction(self):
+        # budget for two entries of four observations
+        cache = VcmFactorCache(self.vcmt, maxbytes=2 * 3 * 16 * 8)
+        first = cache(np.arange(4))
+        assert cache(np.arange(4)) is first
+        cache(np.arange(1, 5))
+        cache(np.arange(2, 6))
+        assert cache.stats() == {'hits': 1, 'misses': 3, 'entries': 2, 'hit_rate': 0.25}
+        assert cache(np.arange(4)) is not first  # least recently used entry was evicted
+        assert cache.misses == 4
+
 
 class TestVCMT:
 
@@ -118,6 +163,18 @@ class TestVCMT:
         act = get_vcmt(ifgs, maxvar)
         assert_array_almost_equal(act, exp, decimal=3)
 
+    def test_vcm_shared_epochs(self):
+        # chain of ifgs 0-1, 1-2, 0-2 and a repeated 0-1 pair
+        ifgs = small5_mock_ifgs(5, 9)[:4]
+        ifgs[1].first, ifgs[1].second = ifgs[0].second, ifgs[2].second
+        ifgs[2].first = ifgs[0].first
+        ifgs[3].first, ifgs[3].second = ifgs[0].first, ifgs[0].second
+        exp = array([[1.0, -0.5, 0.5, 1.0],
+                     [-0.5, 1.0, 0.5, -0.5],
+                     [0.5, 0.5, 1.0, 0.5],
+                     [1.0, -0.5, 0.5, 1.0]])
+        np.testing.assert_array_equal(get_vcmt(ifgs, np.ones(4)), exp)
+
     def test_vcm_17ifgs(self):
         # TODO: maxvar should be calculated by vcm.cvd
         maxvar = [2.879, 4.729, 22.891, 4.604, 3.290, 6.923, 2.519, 13.177,
@@ -21,9 +21,10 @@ import os
 from subprocess import check_call
 import itertools
 import pytest
+import numpy as np
 from pathlib import Path
-from pyrate.merge import create_png_and_kml_from_tif
-from pyrate.core import config as cf
+from pyrate.merge import create_png_and_kml_from_tif, assemble_tiles
+from pyrate.core import config as cf, shared
 from pyrate.merge import _merge_stack, _merge_linrate
 from pyrate.configuration import Configuration, write_config_file
 from tests.common import manipulate_test_conf
@@ -64,3 +65,15 @@ def test_file_creation(create_merge_output):
         output_image_path = os.path.join(params[cf.OUT_DIR], _type + ot)
         print(f"checking {output_image_path}")
         assert Path(output_image_path).exists(), f"Output {ot} file not found at {output_image_path}"
+
+
+def test_assemble_tiles_reads_one_epoch(tempdir):
+    tdir = tempdir()
+    shape = (20, 30)
+    tiles = shared.create_tiles(shape, 2, 3)
+    ts = np.random.rand(5, *shape).astype(np.float32)
+    for t in tiles:
+        np.save(os.path.join(tdir, 'tscuml_{}.npy'.format(t.index)),
+                ts[:, t.top_left_y:t.bottom_right_y, t.top_left_x:t.bottom_right_x])
+    for i in range(ts.shape[0]):
+        np.testing.assert_array_equal(assemble_tiles(shape, tdir, tiles, 'tscuml', index=i), ts[i])
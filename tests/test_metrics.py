@@ -0,0 +1,105 @@
+#   This Python module is part of the PyRate software package.
+#
+#   Copyright 2020 Geoscience Australia
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+"""
+This module contains tests for the metrics.py PyRate module.
+"""
+import os
+import json
+import numpy as np
+import pytest
+
+from pyrate.core import config as cf, metrics, shared
+
+
+@pytest.fixture(autouse=True)
+def clear_records():
+    del metrics._records[:]
+    yield
+    del metrics._records[:]
+
+
+def _save_tile(tile, params):
+    np.save(os.path.join(params[cf.TMPDIR], 'tile_{}.npy'.format(tile.index)), np.ones((100, 100)))
+
+
+def test_nested_steps_and_tiles_recorded():
+    with metrics.measure('step', 'outer'):
+        with metrics.measure('step', 'inner') as record:
+            sum(range(10 ** 5))
+    records = metrics.records()
+    assert [r['name'] for r in records] == ['inner', 'outer']
+    assert records[0] is record
+    assert records[0]['step'] == 'outer' and records[1]['step'] is None
+    for r in records:
+        assert r['wall_time'] >= 0 and r['cpu_time'] >= 0 and r['peak_rss'] > 0
+    assert records[1]['wall_time'] >= records[0]['wall_time']
+
+
+@pytest.mark.skipif(not os.path.exists('/proc/self/clear_refs'), reason='peak memory is reset on Linux only')
+def test_peak_rss_of_each_block():
+    with metrics.measure('step', 'outer') as outer:
+        with metrics.measure('step', 'large') as large:
+            np.ones(2 ** 27, dtype=np.uint8)
+        with metrics.measure('step', 'small') as small:
+            sum(range(10 ** 5))
+    assert large['peak_rss'] - small['peak_rss'] >= 2 ** 26
+    assert outer['peak_rss'] >= large['peak_rss']
+
+
+def test_run_tile_record_not_kept():
+    tile = shared.create_tiles((20, 30), 1, 1)[0]
+    record = metrics.run_tile(lambda t, p: None, tile, {})
+    assert record['kind'] == 'tile' and record['peak_rss'] > 0
+    assert metrics.records() == []
+
+
+@pytest.mark.parametrize("parallel", [0, 1])
+def test_tiles_split_records_tiles(tempdir, parallel):
+    tiles = shared.create_tiles((20, 30), 2, 3)
+    params = {cf.TMPDIR: tempdir(), cf.OUT_DIR: tempdir(), cf.TILES: tiles, cf.PREREAD_IFGS: {},
+              cf.PARALLEL: parallel, cf.PROCESSES: 2}
+    with metrics.measure('step', 'command'):
+        with metrics.measure('step', 'save'):
+            shared.tiles_split(_save_tile, params)
+    tile_records = [r for r in metrics.records() if r['kind'] == 'tile']
+    assert sorted(int(r['name']) for r in tile_records) == [t.index for t in tiles]
+    assert all(r['step'] == 'save' for r in tile_records)
+
+    metrics.write_metrics(params, 'test')
+    assert metrics.records() == []
+    with open(metrics.metrics_path(params, 'test')) as f:
+        out = json.load(f)
+    assert out['command'] == 'test'
+    for step in ['save', 'command']:
+        summary = out['steps'][step]
+        assert summary['tiles'] == len(tiles)
+        assert summary['write_bytes'] >= len(tiles) * 100 * 100 * 8
+    assert len(out['records']) == len(tiles) + 2
+
+
+def test_summarise_over_processes():
+    rec = dict(kind='step', name='a', step=None, cpu_time=1.0, read_bytes=10, write_bytes=5)
+    records = [dict(rec, rank=0, wall_time=2.0, peak_rss=100), dict(rec, rank=1, wall_time=3.0, peak_rss=50),
+               dict(rec, rank=1, wall_time=0.5, peak_rss=70),
+               dict(kind='tile', name='0', step='a', steps=['a'], rank=1),
+               dict(kind='tile', name='1', step='a', steps=['a'], rank=1, worker=True, cpu_time=2.0,
+                    peak_rss=200, read_bytes=1, write_bytes=1)]
+    summary = metrics.summarise(records)['a']
+    assert summary['wall_time'] == 3.5
+    assert summary['cpu_time'] == 5.0
+    assert summary['peak_rss'] == 200
+    assert summary['read_bytes'] == 31 and summary['write_bytes'] == 16
+    assert summary['tiles'] == 2
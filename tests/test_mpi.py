@@ -69,3 +69,42 @@ def test_vcm_legacy_vs_mpi(mpisync, tempdir, roipac_or_gamma_conf):
     np.testing.assert_array_almost_equal(maxvar, legacy_maxvar, decimal=4)
     np.testing.assert_array_almost_equal(legacy_vcm, vcmt, decimal=3)
     mpiops.run_once(shutil.rmtree, tmpdir)
+
+
+def _process_rows(r):
+    """rows of process r; odd processes have none"""
+    nrows = 0 if r % 2 else r + 1
+    return np.arange(nrows * 6, dtype=np.float32).reshape(nrows, 2, 3) + 100 * r
+
+
+def test_allgatherv_and_gatherv():
+    expected = np.concatenate([_process_rows(r) for r in range(mpiops.size)])
+    arr = _process_rows(mpiops.rank)
+    np.testing.assert_array_equal(mpiops.allgatherv(arr), expected)
+    np.testing.assert_array_equal(mpiops.allgatherv(np.moveaxis(arr, 0, 2), axis=2), np.moveaxis(expected, 0, 2))
+    gathered = mpiops.gatherv(arr)
+    if mpiops.rank == 0:
+        np.testing.assert_array_equal(gathered, expected)
+    else:
+        assert gathered is None
+    with mpiops.shared_allgatherv(arr) as shared_arr:
+        np.testing.assert_array_equal(shared_arr, expected)
+        assert not shared_arr.flags.writeable
+
+
+def test_bcast_arrays_and_objects():
+    arr = mpiops.bcast(np.arange(10.).reshape(2, 5) if mpiops.rank == 0 else None)
+    np.testing.assert_array_equal(arr, np.arange(10.).reshape(2, 5))
+    assert mpiops.bcast({'a': 1} if mpiops.rank == 0 else None) == {'a': 1}
+    assert mpiops.run_once(lambda: np.ones(3, dtype=bool)).dtype == bool
+
+
+def test_shared_counter_freed_when_block_raises():
+    counter = mpiops.SharedCounter()
+    try:
+        with counter:
+            counter.fetch_and_add(2)
+            raise ValueError
+    except ValueError:
+        pass
+    assert counter._win == mpiops.MPI.WIN_NULL
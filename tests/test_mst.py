@@ -118,6 +118,39 @@ class TestMST(UnitTestAdaptation):
         self.assertTrue(isnan(res[0][0]) and isnan(exp[0][0]))
 
 
+class TestKruskalMST(UnitTestAdaptation):
+    """Verifies the vectorised Kruskal MST against the networkx MST."""
+
+    def setup_method(self):
+        self.ifgs = small_data_setup()
+        for i in self.ifgs[3:]:
+            i.phase_data[0, 1] = 0  # partial stack of NODATA to one cell
+        for i in self.ifgs:
+            i.phase_data[5:, 2] = 0  # full stack of NODATA
+            i.convert_to_nans()
+
+    def test_kruskal_matches_networkx(self):
+        exp = mst.mst_boolean_array(self.ifgs)
+        res = mst.mst_boolean_array_kruskal(self.ifgs)
+        self.assertEqual(res.dtype, exp.dtype)
+        np.testing.assert_array_equal(res, exp)
+
+    def test_kruskal_matches_networkx_tied_weights(self):
+        # equal nan fractions must select the same tree in both engines
+        rng = np.random.RandomState(1)
+        mock_ifgs = [MockIfg(i, 8, 8) for i in self.ifgs]
+        for k, m in enumerate(mock_ifgs):
+            m.phase_data = m.phase_data.copy()
+            m.phase_data[rng.rand(8, 8) < 0.3] = nan
+            m.nan_fraction = 0.1 if k % 2 else 0.2
+        exp = mst.mst_boolean_array(mock_ifgs)
+        res = mst.mst_boolean_array_kruskal(mock_ifgs)
+        np.testing.assert_array_equal(res, exp)
+
+    def test_kruskal_all_nan_pixel_stack(self):
+        res = mst.mst_boolean_array_kruskal(self.ifgs)
+        self.assertFalse(res[:, 5:, 2].any())
+
 class TestDefaultMST(UnitTestAdaptation):
 
     def test_default_mst(self):
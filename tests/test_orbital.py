@@ -40,9 +40,10 @@ from pyrate.core.orbital import INDEPENDENT_METHOD, NETWORK_METHOD, PLANAR, \
 from pyrate.core.orbital import OrbitalError
 from pyrate.core.orbital import get_design_matrix, get_network_design_matrix, orb_fit_calc_wrapper
 from pyrate.core.orbital import _get_num_params, remove_orbital_error, network_orbital_correction
+from pyrate.core.orbital import get_network_normal_equations
 from pyrate.core.shared import Ifg, mkdir_p
 from pyrate.core.shared import nanmedian
-from pyrate.core import roipac
+from pyrate.core import roipac, shared
 from pyrate import correct, conv2tif, prepifg
 from pyrate.configuration import Configuration, MultiplePaths
 from pyrate.core.config import ORB_ERROR_DIR
@@ -430,7 +431,8 @@ def network_correction(ifgs, deg, off, ml_ifgs=None, tol=1e-6):
         dm = get_network_design_matrix(ifgs, deg, off)[~isnan(data)]
         fd = data[~isnan(data)].reshape((dm.shape[0], 1))
 
-    params = pinv(dm, tol).dot(fd)
+    # double precision reference for the normal equation solver
+    params = pinv(dm.astype(np.float64), tol).dot(fd)
     assert params.shape == (dm.shape[1], 1)
 
     # calculate forward correction
@@ -519,6 +521,17 @@ class TestNetworkCorrectionTests:
             for i in self.ifgs:
                 i.phase_data -= value
 
+    @pytest.mark.parametrize("deg", [PLANAR, QUADRATIC, PART_CUBIC])
+    @pytest.mark.parametrize("offset", [False, True])
+    def test_normal_equations_match_network_dm(self, deg, offset):
+        ncells = self.ifgs[0].num_cells
+        data = concatenate([i.phase_data.reshape(ncells) for i in self.ifgs])
+        dm = get_network_design_matrix(self.ifgs, deg, offset)[~isnan(data)].astype(np.float64)
+        exp_mat, exp_rhs = dm.T.dot(dm), dm.T.dot(data[~isnan(data)])
+        norm_mat, rhs = get_network_normal_equations(self.ifgs, deg, offset)
+        np.testing.assert_allclose(norm_mat, exp_mat, rtol=1e-6, atol=1e-9 * np.abs(exp_mat).max())
+        np.testing.assert_allclose(rhs, exp_rhs, rtol=1e-6, atol=1e-9 * np.abs(exp_rhs).max())
+
     # These functions test full size data for orbital correction. The options
     # are separated as the ifg.phase_data arrays are modified in place, allowing
     # setUp() reset phase data between tests.
@@ -987,3 +1000,31 @@ class TestOrbErrorCorrectionsReappliedDoesNotChangePhaseData:
             i.open()
         phase_now = [i.phase_data for i in ifgs]
         np.testing.assert_array_equal(phase_now, phase_prev)
+
+    def test_orb_error_layer_matches_corrected_phase_data(self, orbfit_method, orbfit_degrees):
+        self.params[cf.ORBITAL_FIT_METHOD] = orbfit_method
+        self.params[cf.ORBITAL_FIT_DEGREE] = orbfit_degrees
+        remove_orbital_error(self.ifg_paths, self.params)
+        ifgs = [Ifg(i) for i in self.ifg_paths]
+        for i in ifgs:
+            i.open()
+        phase_prev = [i.phase_data for i in ifgs]
+
+        # orbital model coefficients are saved, not full resolution corrections
+        orb_error_files = [MultiplePaths.orb_error_path(i, self.params) for i in self.ifg_paths]
+        assert all(np.load(p).ndim == 1 for p in orb_error_files)
+
+        # record the saved correction as a layer and write it once
+        correct._copy_mlooked(self.params)
+        correct._update_params_with_tiles(self.params)
+        self.params[cf.ORBITAL_FIT] = 1
+        self.params[cf.CORRECTION_LAYERS] = []
+        orb_fit_calc_wrapper(self.params)
+        assert len(self.params[cf.CORRECTION_LAYERS]) == 1
+        shared.write_correction_layers(self.ifg_paths, self.params)
+        assert self.params[cf.CORRECTION_LAYERS] == []
+        ifgs = [Ifg(i) for i in self.ifg_paths]
+        for i in ifgs:
+            i.open()
+        phase_now = [i.phase_data for i in ifgs]
+        np.testing.assert_array_almost_equal(phase_now, phase_prev, decimal=4)
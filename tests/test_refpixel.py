@@ -31,6 +31,7 @@ import pyrate.core.refpixel
 from pyrate.core import config as cf
 from pyrate.core.refpixel import ref_pixel, _step, RefPixelError, ref_pixel_calc_wrapper, \
     convert_geographic_coordinate_to_pixel_value, convert_pixel_value_to_geographic_coordinate
+from pyrate.core.refpixel import ref_pixel_setup, find_min_mean, _ref_pixel_multi, _chip_sds
 from pyrate.core import shared, ifgconstants as ifc
 from pyrate import correct, conv2tif, prepifg
 from pyrate.configuration import Configuration
@@ -221,6 +222,34 @@ class TestReferencePixelTests:
         assert res == exp_refpx
 
 
+class TestRefPixelSummedAreaTable:
+    """
+    Tests the summed-area table candidate scoring against the chip loop
+    """
+
+    @classmethod
+    def setup_method(cls):
+        cls.params = cf.get_config_params(TEST_CONF_ROIPAC)
+        cls.params[cf.REFNX] = REFNX
+        cls.params[cf.REFNY] = REFNY
+        cls.params[cf.REF_CHIP_SIZE] = CHIPSIZE
+        cls.params[cf.REF_MIN_FRAC] = MIN_FRAC
+        cls.ifgs = small_data_setup()
+        for i in cls.ifgs:
+            i.convert_to_nans()
+
+    @pytest.mark.parametrize("chipsize", [3, 5, 15])
+    def test_chip_sds_match_chip_loop(self, chipsize):
+        self.params[cf.REF_CHIP_SIZE] = chipsize
+        half_patch_size, thresh, grid = ref_pixel_setup(self.ifgs, self.params)
+        phase_data = [i.phase_data for i in self.ifgs]
+        exp = np.array([_ref_pixel_multi(g, half_patch_size, phase_data, thresh, self.params)
+                        for g in grid])
+        ys, xs = np.array(grid).T
+        res = np.mean([_chip_sds(p, ys, xs, half_patch_size, thresh) for p in phase_data], axis=0)
+        np.testing.assert_allclose(res, exp, rtol=1e-5)
+        assert find_min_mean(res, grid) == find_min_mean(exp, grid)
+
 def _expected_ref_pixel(ifgs, cs):
     """Helper function for finding reference pixel when refnx/y=2"""
 
@@ -448,6 +448,160 @@ class TestWriteUnw:
                 shared.write_unw_from_data_or_geotiff(geotif_or_data=g, dest_unw=dest_unw, ifg_proc=0)
 
 
+@pytest.mark.parametrize("block_bytes", [1, 100, 2 ** 24])
+def test_write_unw_from_data_in_blocks(tempdir, monkeypatch, block_bytes):
+    monkeypatch.setattr(shared, 'BLOCK_BYTES', block_bytes)
+    data = np.random.rand(37, 11)
+    data[0, 0] = nan
+    dest_unw = join(tempdir(), 'blocks.unw')
+    shared.write_unw_from_data_or_geotiff(geotif_or_data=data, dest_unw=dest_unw, ifg_proc=1)
+    res = np.fromfile(dest_unw, dtype='>f4').reshape(data.shape)
+    np.testing.assert_array_equal(res, data.astype(np.float32))
+
+
+def test_save_numpy_phase_cubes_match_ifg_tiles(tempdir):
+    ifgs = common.small_data_setup()
+    ifg_paths = [i.data_path for i in ifgs]
+    tiles = shared.create_tiles(ifgs[0].shape, 3, 4)
+    params = {cf.TMPDIR: tempdir(), 'tiles': tiles}
+    shared.save_numpy_phase(ifg_paths, params)
+    assert len(os.listdir(params[cf.TMPDIR])) == len(tiles) + 2
+    ifg_dict = {i.data_path: i for i in ifgs}
+    costs = shared.tile_costs(params)
+    for n, t in enumerate(tiles):
+        valid = 0
+        for i in ifgs:
+            part = shared.IfgPart(i.data_path, t, ifg_dict, params)
+            exp = i.phase_data[t.top_left_y:t.bottom_right_y, t.top_left_x:t.bottom_right_x]
+            assert_array_equal(part.phase_data, exp)
+            assert isinstance(part.phase_data.base, np.memmap)
+            assert not part.phase_data.flags.writeable
+            valid += np.sum(~isnan(exp))
+        assert costs[n] == valid
+
+
+@pytest.mark.parametrize("parallel", [0, 1])
+@pytest.mark.parametrize("schedule", [cf.STATIC_TILES, cf.DYNAMIC_TILES])
+def test_tiles_split_runs_every_tile_once(tempdir, parallel, schedule):
+    tiles = shared.create_tiles((20, 30), 3, 4)
+    preread_ifgs = {'a': shared.PrereadIfg('a', 'a', 0.5, None, None, 1.0, 20, 30, {})}
+    params = {cf.TMPDIR: tempdir(), cf.TILES: tiles, cf.PREREAD_IFGS: preread_ifgs,
+              cf.PARALLEL: parallel, cf.PROCESSES: 2, cf.TILE_SCHEDULE: schedule}
+    outdir = params[cf.TMPDIR]
+
+    def _save_tile_index(tile, params):
+        np.save(join(outdir, 'tile_{}.npy'.format(tile.index)), tile.index)
+
+    shared.tiles_split(_save_tile_index, params)
+    assert sorted(os.listdir(outdir)) == sorted('tile_{}.npy'.format(t.index) for t in tiles)
+
+
+def test_shared_params_sends_handle_and_maps_arrays(tempdir):
+    import pickle
+    vcmt = np.random.rand(50, 50)
+    preread_ifgs = {str(i): shared.PrereadIfg(str(i), str(i), 0.5, None, None, 1.0, 20, 30, {'a': 'b' * 1000})
+                    for i in range(50)}
+    params = {cf.TMPDIR: tempdir(), cf.VCMT: vcmt, cf.PREREAD_IFGS: preread_ifgs, cf.PARALLEL: 1}
+    with shared.SharedParams(params) as shared_params:
+        assert shared_params.load() is params
+        handle = pickle.dumps(shared_params)
+        assert len(handle) < 500
+        worker_params = pickle.loads(handle).load()
+        assert isinstance(worker_params[cf.VCMT], np.memmap)
+        assert_array_equal(worker_params[cf.VCMT], vcmt)
+        assert sorted(worker_params[cf.PREREAD_IFGS]) == sorted(preread_ifgs)
+        assert pickle.loads(handle).load() is worker_params  # loaded once per process
+    assert os.listdir(params[cf.TMPDIR]) == []
+    # a later publication of the same size in the same place is loaded afresh
+    params[cf.VCMT] = vcmt + 1
+    with shared.SharedParams(params) as shared_params:
+        assert_array_equal(pickle.loads(pickle.dumps(shared_params)).load()[cf.VCMT], vcmt + 1)
+
+
+def test_worker_pool_reused_by_nested_calls(tempdir):
+    params = {cf.TMPDIR: tempdir(), cf.TILES: shared.create_tiles((20, 30), 2, 2), cf.PREREAD_IFGS: {},
+              cf.PARALLEL: 1, cf.PROCESSES: 2, cf.TILE_SCHEDULE: cf.STATIC_TILES}
+    outdir = params[cf.TMPDIR]
+
+    def _save_pid(tile, params):
+        np.save(join(outdir, 'pid_{}_{}.npy'.format(tile.index, os.getpid())), tile.index)
+
+    with shared.worker_pool(params) as pool:
+        with shared.worker_pool(params) as inner:
+            assert inner is pool
+        shared.tiles_split(_save_pid, params)
+        shared.tiles_split(_save_pid, params)
+    assert shared._worker_pool is None
+    pids = {f.split('_')[2] for f in os.listdir(outdir)}
+    assert str(os.getpid()) + '.npy' not in pids and len(pids) <= params[cf.PROCESSES]
+    with shared.worker_pool({cf.PARALLEL: 0}) as pool:
+        assert pool is None
+
+
+@pytest.mark.parametrize("shape", [(100, 40), (37, 211)])
+@pytest.mark.parametrize("tile_budget", [-1, 1, 2 ** 14, 2 ** 20, 2 ** 30])
+def test_plan_tiles_fit_memory_budget(shape, tile_budget):
+    nifgs, nepochs = 17, 12
+    budget = shared.WORKER_MEMORY_OVERHEAD + tile_budget
+    rows, cols = shared.plan_tiles(shape, nifgs, nepochs, budget, min_tiles=4)
+    tiles = shared.create_tiles(shape, rows, cols)
+    assert len(tiles) >= 4
+    per_pixel = shared.tile_memory_per_pixel(nifgs, nepochs)
+    sizes = [(t.bottom_right_y - t.top_left_y) * (t.bottom_right_x - t.top_left_x) for t in tiles]
+    if tile_budget >= per_pixel:  # the worker overhead is reserved from the budget
+        assert max(sizes) * per_pixel <= tile_budget
+    else:  # smallest possible tiles
+        assert max(sizes) == 1
+    if tile_budget == 2 ** 30:  # tile count set by the minimum
+        assert rows * cols < 2 * 4
+
+
+def test_tile_costs_estimated_from_preread_ifgs(tempdir):
+    tiles = shared.create_tiles((20, 30), 3, 4)
+    preread_ifgs = {'a': shared.PrereadIfg('a', 'a', 0.25, None, None, 1.0, 20, 30, {}),
+                    'b': shared.PrereadIfg('b', 'b', 0.75, None, None, 1.0, 20, 30, {}),
+                    'epochlist': None}
+    params = {cf.TMPDIR: tempdir(), cf.TILES: tiles, cf.PREREAD_IFGS: preread_ifgs}
+    sizes = [(t.bottom_right_y - t.top_left_y) * (t.bottom_right_x - t.top_left_x) for t in tiles]
+    np.testing.assert_array_equal(shared.tile_costs(params), np.array(sizes) * 1.0)
+
+
+def test_output_geotiff_writer_windows_and_statistics(tempdir):
+    data = np.random.rand(300, 270).astype(np.float32) * 10
+    data[np.random.rand(*data.shape) < 0.2] = np.nan
+    md = {ifc.EPOCH_DATE: '2020-01-01', ifc.DATA_TYPE: ifc.LINRATE}
+    dest = join(tempdir(), 'linear_rate.tif')
+    with shared.OutputGeotiffWriter(md, [150.0, 0.001, 0, -34.0, 0, -0.001], '', data.shape, dest, nan) as w:
+        for t in shared.create_tiles(data.shape, 3, 2):
+            w.write(data[t.top_left_y:t.bottom_right_y, t.top_left_x:t.bottom_right_x], t.top_left_x, t.top_left_y)
+    ds = gdal.Open(dest)
+    band = ds.GetRasterBand(1)
+    assert_array_equal(band.ReadAsArray(), data)
+    assert band.GetBlockSize() == [shared.OUTPUT_BLOCK_SIZE, shared.OUTPUT_BLOCK_SIZE]
+    stats = band.GetStatistics(True, False)  # saved statistics only, not computed
+    np.testing.assert_allclose(stats, [np.nanmin(data), np.nanmax(data), np.nanmean(data), np.nanstd(data)],
+                               rtol=1e-5)
+
+
+def test_output_geotiff_writer_misaligned_windows_keep_file_size(tempdir):
+    # windows not aligned to the internal tiles, with a GDAL cache too small
+    # to hold them, must not leave rewritten compressed tiles in the file
+    data = np.random.rand(700, 650).astype(np.float32)
+    md = {ifc.EPOCH_DATE: '2020-01-01', ifc.DATA_TYPE: ifc.LINRATE}
+    dest = join(tempdir(), 'linear_rate.tif')
+    cache_max = gdal.GetCacheMax()
+    gdal.SetCacheMax(2 ** 19)
+    try:
+        with shared.OutputGeotiffWriter(md, [150.0, 0.001, 0, -34.0, 0, -0.001], '', data.shape, dest, nan) as w:
+            for t in shared.create_tiles(data.shape, 7, 6):
+                w.write(data[t.top_left_y:t.bottom_right_y, t.top_left_x:t.bottom_right_x],
+                        t.top_left_x, t.top_left_y)
+    finally:
+        gdal.SetCacheMax(cache_max)
+    assert os.path.getsize(dest) < 1.1 * data.nbytes
+    assert_array_equal(gdal.Open(dest).ReadAsArray(), data)
+
+
 class TestGeodesy:
 
     def test_utm_zone(self):
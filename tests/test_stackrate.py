@@ -30,7 +30,7 @@ import pyrate.core.ref_phs_est
 import pyrate.core.refpixel
 import tests.common
 from pyrate.core import shared, config as cf, covariance as vcm_module
-from pyrate.core.stack import stack_rate_pixel, mask_rate
+from pyrate.core.stack import stack_rate_pixel, stack_rate_array, stack_rate_batch, mask_rate
 from pyrate import correct, prepifg, conv2tif
 from pyrate.configuration import Configuration
 from tests import common
@@ -74,6 +74,35 @@ class TestStackRatePixel:
         assert_array_almost_equal(samples, expsamp)
 
 
+class TestStackRateBatch:
+    """
+    Tests the batched stacking engine against the pixel by pixel algorithm
+    """
+
+    def setup_method(self):
+        nifgs, rows, cols = 12, 9, 8
+        rng = np.random.RandomState(5)
+        spans = rng.uniform(0.1, 2.0, nifgs)
+        self.ifgs = [SinglePixelIfg(t, 0) for t in spans]
+        for ifg in self.ifgs:
+            ifg.phase_data = 3.0 * ifg.time_span + rng.normal(0, 0.3, (rows, cols))
+        self.ifgs[2].phase_data[:3, :3] += 20  # outliers to be rejected
+        self.ifgs[5].phase_data[0, :] = nan
+        m = rng.rand(nifgs, nifgs)
+        self.vcmt = m.dot(m.T) * 0.05 + eye(nifgs) * 0.2
+        self.mst = ones((nifgs, rows, cols), dtype=bool)
+        self.mst[7, 4:, :] = False
+        self.mst[:10, -1, -1] = False  # below pixel threshold
+        self.params = default_params()
+
+    def test_stack_rate_batch_matches_pixel(self):
+        exp = stack_rate_array(self.ifgs, self.params, self.vcmt, self.mst.copy())
+        res = stack_rate_batch(self.ifgs, self.params, self.vcmt, self.mst.copy())
+        assert np.isnan(res[0][-1, -1])
+        for r, e in zip(res, exp):
+            np.testing.assert_allclose(r, e, rtol=1e-5, atol=1e-6)
+
+
 class TestMaskRate:
     """
     Test the maxsig threshold masking algorithm
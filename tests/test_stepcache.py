@@ -0,0 +1,91 @@
+#   This Python module is part of the PyRate software package.
+#
+#   Copyright 2020 Geoscience Australia
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+"""
+This module contains tests for the stepcache.py PyRate module.
+"""
+import os
+from pathlib import Path
+import numpy as np
+import pytest
+
+from pyrate.core import config as cf, stepcache
+
+
+@pytest.fixture
+def params(tempdir):
+    return {cf.OUT_DIR: tempdir()}
+
+
+def _write(path, arr):
+    np.save(file=path, arr=arr)
+    return Path(path)
+
+
+def test_file_fingerprint_follows_contents(params):
+    manifest = stepcache.load_manifest(params)
+    a = _write(os.path.join(params[cf.OUT_DIR], 'a.npy'), np.arange(10))
+    b = _write(os.path.join(params[cf.OUT_DIR], 'b.npy'), np.arange(10))
+    assert stepcache.file_fingerprint(a, manifest) == stepcache.file_fingerprint(b, manifest)
+    assert str(a) in manifest['files']
+    _write(b, np.arange(11))
+    assert stepcache.file_fingerprint(a, manifest) != stepcache.file_fingerprint(b, manifest)
+    assert stepcache.file_fingerprint(os.path.join(params[cf.OUT_DIR], 'c.npy'), manifest) is None
+
+
+def test_hash_key_depends_on_all_parts():
+    key = stepcache.hash_key('orbfit', 'abc', [1, 2.0, None])
+    assert key == stepcache.hash_key('orbfit', 'abc', [1, 2.0, None])
+    assert key != stepcache.hash_key('orbfit', 'abc', [1, 2.5, None])
+    assert key != stepcache.hash_key('refphase', 'abc', [1, 2.0, None])
+
+
+def test_step_key_follows_step_state_and_params(params):
+    params.update({cf.STEP_STATE: 'abc', cf.ORBITAL_FIT: 1, cf.ORBITAL_FIT_DEGREE: 1})
+    key = stepcache.step_key(params, 'orbfit')
+    assert key == stepcache.step_key(dict(params), 'orbfit')
+    assert key != stepcache.step_key(dict(params, **{cf.ORBITAL_FIT_DEGREE: 2}), 'orbfit')
+    assert key != stepcache.step_key(dict(params, **{cf.STEP_STATE: 'abd'}), 'orbfit')
+    # parameters of other steps do not change the key
+    assert key == stepcache.step_key(dict(params, **{cf.SLPF_CUTOFF: 1.0}), 'orbfit')
+
+
+def test_outputs_reused_only_if_current(params):
+    outputs = [_write(os.path.join(params[cf.OUT_DIR], 'out_{}.npy'.format(i)), np.arange(i)) for i in range(3)]
+
+    # nothing recorded yet: outputs are stale and deleted
+    assert not stepcache.invalidate_stale(params, 'step', 'key1', outputs)
+    assert not any(p.exists() for p in outputs)
+
+    for i, p in enumerate(outputs):
+        _write(p, np.arange(i))
+    stepcache.record(params, [('step', 'key1', outputs)])
+    assert stepcache.invalidate_stale(params, 'step', 'key1', outputs)
+    assert all(p.exists() for p in outputs)
+
+    # modified outputs are not reused
+    os.utime(outputs[1], ns=(0, 0))
+    assert not stepcache.is_current(params, 'step', 'key1', outputs)
+    stepcache.record(params, [('step', 'key1', outputs)])
+
+    # a new key invalidates the outputs
+    assert not stepcache.invalidate_stale(params, 'step', 'key2', outputs)
+    assert not any(p.exists() for p in outputs)
+
+
+def test_unreadable_manifest_ignored(params):
+    with open(stepcache.manifest_path(params), 'w') as f:
+        f.write('{not json')
+    assert stepcache.load_manifest(params) == {'steps': {}, 'files': {}}
@@ -19,8 +19,10 @@ This Python module contains tests for the timeseries.py PyRate module.
 """
 import os
 import shutil
+import tracemalloc
 import pytest
 from datetime import date, timedelta
+from types import SimpleNamespace
 from numpy import nan, asarray, where, array
 import numpy as np
 from numpy.testing import assert_array_almost_equal
@@ -29,10 +31,12 @@ import pyrate.core.orbital
 import pyrate.core.ref_phs_est
 import pyrate.core.refpixel
 import tests.common as common
-from pyrate.core import config as cf, mst, covariance
+from pyrate.core import config as cf, mst, covariance, shared, timeseries
 from pyrate import correct, prepifg, conv2tif
 from pyrate.configuration import Configuration
 from pyrate.core.timeseries import time_series, linear_rate_pixel, linear_rate_array, TimeSeriesError
+from pyrate.core.timeseries import _time_series_setup, _time_series_pixel, _time_series_svd_by_pattern
+from pyrate.core.algorithm import get_epochs
 
 
 def default_params():
@@ -107,6 +111,32 @@ class TestTimeSeries:
         assert_array_almost_equal(tscum, expected, decimal=2)
 
 
+class TestTimeSeriesSVDByPattern:
+    """Verifies the pattern-deduplicated SVD solver against the per-pixel solver"""
+
+    @classmethod
+    def setup_class(cls):
+        cls.ifgs = common.small_data_setup()
+        for i in cls.ifgs:
+            i.convert_to_nans()
+        cls.params = default_params()
+        cls.params[cf.TIME_SERIES_METHOD] = 2
+        cls.params[cf.TIME_SERIES_PTHRESH] = 3
+        cls.mstmat = mst.mst_boolean_array(cls.ifgs)
+
+    @pytest.mark.parametrize("interp", [0, 1])
+    def test_svd_by_pattern_matches_pixel_solver(self, interp):
+        b0_mat, _, p_thresh, sm_factor, sm_order, _, ifg_data, mst_mat, ncols, nrows, nvelpar, _, tsvel = \
+            _time_series_setup(self.ifgs, self.params, self.mstmat.copy())
+        exp = np.empty_like(tsvel)
+        for row in range(nrows):
+            for col in range(ncols):
+                exp[row, col] = _time_series_pixel(row, col, b0_mat, sm_factor, sm_order, ifg_data, mst_mat,
+                                                   nvelpar, p_thresh, interp, None, 2)
+        res = _time_series_svd_by_pattern(b0_mat, ifg_data, mst_mat, nvelpar, p_thresh, interp, tsvel)
+        np.testing.assert_array_almost_equal(exp, res, decimal=5)
+
+
 class TestLegacyTimeSeriesEquality:
 
     @classmethod
@@ -401,3 +431,60 @@ class TestLinearRateArray:
         with pytest.raises(TimeSeriesError):
             res = linear_rate_array(self.tscuml0, self.ifgs, self.params)
 
+
+    def test_linear_rate_array_matches_pixel(self):
+        """
+        The whole-array regression should reproduce linear_rate_pixel
+        for every pixel, including pixels with too few observations
+        """
+        tscuml = self.tscuml.copy()
+        tscuml[0, 0, :] = nan
+        tscuml[0, 1, 1:] = nan
+        tscuml[0, 2, 2:] = nan
+        tscuml[1:, 3:, 4::3] = nan
+        t = asarray(get_epochs(self.ifgs)[0].spans)
+        res = linear_rate_array(tscuml, self.ifgs, self.params)
+        nrows, ncols, _ = tscuml.shape
+        for k, arr in enumerate(res):
+            exp = np.array([[linear_rate_pixel(tscuml[r, c, :], t)[k] for c in range(ncols)]
+                            for r in range(nrows)], dtype=np.float32)
+            np.testing.assert_allclose(arr, exp, rtol=1e-5, atol=1e-6)
+
+
+@pytest.mark.parametrize("shape, nepochs, nifgs", [((80, 60), 12, 20), ((60, 70), 40, 60)])
+def test_tile_memory_per_pixel_bounds_time_series_tile(tempdir, shape, nepochs, nifgs):
+    """
+    The memory model used to plan tiles should bound the measured peak of
+    the time series of a tile with a margin, without overestimating it by much
+    """
+    rows, cols = shape
+    dates = [date(2010, 1, 1) + timedelta(days=12 * i) for i in range(nepochs)]
+    pairs = ([(i, i + 1) for i in range(nepochs - 1)] + [(i, i + 2) for i in range(nepochs - 2)])[:nifgs]
+    names = ['{}-{}'.format(*p) for p in pairs]
+    outdir = tempdir()
+    tile = shared.create_tiles(shape, 1, 1)[0]
+    params = {**default_params(), cf.TIME_SERIES_METHOD: 2, cf.TMPDIR: outdir, cf.OUT_DIR: outdir,
+              'savetsincr': 0, cf.VCMT: np.eye(nifgs),
+              cf.INTERFEROGRAM_FILES: [SimpleNamespace(tmp_sampled_path=n) for n in names],
+              cf.PREREAD_IFGS: {n: shared.PrereadIfg(n, n, 0.1, dates[a], dates[b], (dates[b] - dates[a]).days / 365.25,
+                                                      rows, cols, {}) for n, (a, b) in zip(names, pairs)}}
+    cube = np.random.RandomState(1).normal(size=(nifgs, rows, cols)).astype(np.float32)
+    cube[:nifgs // 2, :rows // 3, :cols // 3] = nan
+    np.save(shared.phase_cube_path(params, tile.index), cube)
+    with open(shared.phase_cube_index_path(params), 'w') as f:
+        f.write('\n'.join(names))
+    os.makedirs(os.path.join(outdir, cf.MST_DIR))
+    np.save(Configuration.mst_path(params, tile.index), ~np.isnan(cube))
+    del cube
+
+    tracemalloc.start()
+    try:
+        getattr(timeseries, '__calc_time_series_for_tile')(tile, params)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+        shared._phase_cubes.clear()
+        shutil.rmtree(outdir)
+    measured = peak / (rows * cols)
+    model = shared.tile_memory_per_pixel(nifgs, nepochs)
+    assert 1.2 * measured <= model < 3 * measured
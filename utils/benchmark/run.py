@@ -0,0 +1,282 @@
+#   This Python module is part of the PyRate software package.
+#
+#   Copyright 2020 Geoscience Australia
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+"""
+This script benchmarks the PyRate workflow on synthetic interferogram stacks
+over a sweep of raster sizes, numbers of epochs and interferograms. The wall
+time, CPU time and peak memory of each step are appended to a history file of
+JSON lines, and steps slower than earlier runs of the same case are reported
+as regressions.
+
+Run from the 'PyRate' directory, e.g.:
+
+    python -m utils.benchmark.run --sizes 100 200 --epochs 10 20 --ifgs-per-epoch 2
+
+or with MPI:
+
+    mpirun -np 4 python -m utils.benchmark.run --sizes 400
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import argparse
+import itertools
+import subprocess
+from pathlib import Path
+from statistics import median
+from typing import List
+
+import numpy as np
+import scipy
+
+from pyrate import conv2tif, prepifg, correct, merge
+from pyrate.core import mpiops, metrics
+from pyrate.core.logger import pyratelogger as log
+from pyrate.core.stack import stack_calc_wrapper
+from pyrate.core.timeseries import timeseries_calc_wrapper
+from pyrate.configuration import Configuration
+from utils.benchmark.synthetic import generate_stack, write_config
+
+# the commands run on each synthetic stack; 'correct' is timed by its steps
+COMMANDS = [
+    ('conv2tif', conv2tif.main),
+    ('prepifg', prepifg.main),
+    ('correct', correct.main),
+    ('timeseries', timeseries_calc_wrapper),
+    ('stack', stack_calc_wrapper),
+    ('merge', merge.main),
+]
+
+# steps reported for each case: the correct steps, run by 'ref_pixel_calc_wrapper', 'orb_fit_calc_wrapper',
+# 'ref_phase_est_wrapper', 'mst_calc_wrapper', 'wrap_spatio_temporal_filter' and 'maxvar_vcm_calc_wrapper',
+# then the commands
+STEPS = ['conv2tif', 'prepifg', 'refpixel', 'orbfit', 'refphase', 'mst', 'apscorrect', 'maxvar',
+         'write_corrections', 'timeseries', 'stack', 'merge']
+
+HISTORY_FILE = 'benchmark_history.jsonl'
+
+# steps slower than this factor of the median of earlier runs are regressions
+REGRESSION_FACTOR = 1.25
+
+# number of earlier runs of a case compared against
+BASELINE_RUNS = 5
+
+
+def case_name(case: dict) -> str:
+    """
+    Returns a name identifying a benchmark case
+
+    :param dict case: case parameters
+
+    :return: name of the case
+    :rtype: str
+    """
+    return '_'.join(f'{k}{v}' for k, v in sorted(case.items()))
+
+
+def sweep(sizes: List[int], epochs: List[int], ifgs_per_epoch: List[float], nan_fractions: List[float],
+          nan_pattern: str, processes: List[int]) -> List[dict]:
+    """
+    Returns the benchmark cases of a parameter sweep
+
+    :param list sizes: raster sizes; rasters are square
+    :param list epochs: numbers of epochs
+    :param list ifgs_per_epoch: numbers of interferograms per epoch
+    :param list nan_fractions: fractions of pixels with no data
+    :param str nan_pattern: pattern of pixels with no data
+    :param list processes: numbers of joblib processes; 1 runs in serial
+
+    :return: list of cases
+    :rtype: list
+    """
+    cases = []
+    for size, nepochs, per_epoch, nan_fraction, nproc in itertools.product(
+            sizes, epochs, ifgs_per_epoch, nan_fractions, processes):
+        nifgs = int(np.clip(round(per_epoch * nepochs), nepochs - 1, nepochs * (nepochs - 1) // 2))
+        cases.append({'size': size, 'epochs': nepochs, 'ifgs': nifgs, 'nan': nan_fraction,
+                      'pattern': nan_pattern, 'processes': nproc, 'mpi': mpiops.size})
+    return cases
+
+
+def run_case(case: dict, workdir: Path, repeats: int = 1) -> dict:
+    """
+    Generate the synthetic stack of a case and time the PyRate workflow on
+    it. Each repeat runs in a fresh output directory so no step outputs are
+    reused; the fastest repeat of each step is kept.
+
+    :param dict case: case parameters
+    :param Path workdir: directory for the synthetic stack and outputs
+    :param int repeats: number of times to run the workflow
+
+    :return: steps: dictionary of wall_time, cpu_time and peak_rss of each step
+    :rtype: dict
+    """
+    case_dir = workdir.joinpath(case_name(case))
+    files = mpiops.run_once(generate_stack, case_dir.joinpath('obs'), (case['size'], case['size']), case['epochs'],
+                            case['ifgs'], case['nan'], case['pattern'])
+    parallel = {'parallel': int(case['processes'] > 1), 'processes': case['processes']}
+    best = {}
+    for i in range(repeats):
+        outdir = case_dir.joinpath(f'out_{i}')
+        conf = case_dir.joinpath(f'pyrate_{i}.conf')
+        mpiops.run_once(write_config, conf, files, outdir.as_posix(), **parallel)
+        for command, func in COMMANDS:
+            params = mpiops.run_once(lambda: Configuration(conf.as_posix()).__dict__)
+            with metrics.measure('step', command):
+                func(params)
+        metrics.write_metrics(params, 'benchmark')
+        if mpiops.rank == 0:
+            with open(metrics.metrics_path(params, 'benchmark')) as f:
+                steps = json.load(f)['steps']
+            for step in [s for s in STEPS if s in steps]:
+                s = steps[step]
+                if step not in best or s['wall_time'] < best[step]['wall_time']:
+                    best[step] = {k: s[k] for k in ['wall_time', 'cpu_time', 'peak_rss']}
+        mpiops.run_once(shutil.rmtree, outdir, ignore_errors=True)
+    mpiops.run_once(shutil.rmtree, case_dir, ignore_errors=True)
+    return best
+
+
+def _git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL,
+                                       cwd=Path(__file__).parent).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def environment() -> dict:
+    """
+    Returns a description of the machine and software the benchmark runs on
+
+    :return: dictionary of host, cpu count and versions
+    :rtype: dict
+    """
+    return {
+        'host': platform.node(),
+        'cpus': os.cpu_count(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'scipy': scipy.__version__,
+        'commit': _git_commit(),
+    }
+
+
+def load_history(path: Path) -> List[dict]:
+    """
+    Load the benchmark history; lines that can not be parsed are skipped.
+
+    :param Path path: path of the history file
+
+    :return: list of history entries
+    :rtype: list
+    """
+    history = []
+    if path.exists():
+        with open(path) as f:
+            for line in f:
+                try:
+                    history.append(json.loads(line))
+                except ValueError:
+                    continue
+    return history
+
+
+def append_history(path: Path, entry: dict) -> None:
+    """
+    Append an entry to the benchmark history
+
+    :param Path path: path of the history file
+    :param dict entry: history entry
+
+    :return: None, file saved to disk
+    """
+    with open(path, 'a') as f:
+        f.write(json.dumps(entry, sort_keys=True) + '\n')
+
+
+def regressions(history: List[dict], entry: dict, factor: float = REGRESSION_FACTOR,
+                runs: int = BASELINE_RUNS) -> List[dict]:
+    """
+    Compare the step times of an entry with the median of the last runs of
+    the same case on the same host.
+
+    :param list history: earlier history entries
+    :param dict entry: history entry to check
+    :param float factor: slowdown factor above which a step is a regression
+    :param int runs: number of earlier runs to compare against
+
+    :return: list of regressed steps with their time and baseline time
+    :rtype: list
+    """
+    earlier = [h for h in history if h['case'] == entry['case'] and h['env']['host'] == entry['env']['host']]
+    earlier = earlier[-runs:]
+    found = []
+    for step, s in entry['steps'].items():
+        times = [h['steps'][step]['wall_time'] for h in earlier if step in h['steps']]
+        if not times:
+            continue
+        baseline = median(times)
+        if s['wall_time'] > factor * baseline:
+            found.append({'step': step, 'wall_time': s['wall_time'], 'baseline': baseline})
+    return found
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(prog='pyrate-benchmark', description=__doc__,
+                                     formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 200], help="raster rows and columns")
+    parser.add_argument('--epochs', type=int, nargs='+', default=[10, 20], help="numbers of epochs")
+    parser.add_argument('--ifgs-per-epoch', type=float, nargs='+', default=[2], help="interferograms per epoch")
+    parser.add_argument('--nan-fractions', type=float, nargs='+', default=[0.05], help="fractions of NaN pixels")
+    parser.add_argument('--nan-pattern', default='patches', choices=['none', 'random', 'patches'])
+    parser.add_argument('--processes', type=int, nargs='+', default=[1], help="joblib processes; 1 is serial")
+    parser.add_argument('--repeats', type=int, default=1, help="runs of each case; the fastest is kept")
+    parser.add_argument('--workdir', default='benchmark_data', help="directory for synthetic data and outputs")
+    parser.add_argument('--history', default=HISTORY_FILE, help="history file of benchmark results")
+    parser.add_argument('--fail-on-regression', action='store_true',
+                        help="exit with an error if any step is slower than earlier runs")
+    args = parser.parse_args(args)
+
+    workdir, history_path = Path(args.workdir), Path(args.history)
+    history = load_history(history_path)
+    env = environment()
+    found = []
+    for case in sweep(args.sizes, args.epochs, args.ifgs_per_epoch, args.nan_fractions, args.nan_pattern,
+                      args.processes):
+        log.info(f'Benchmarking {case_name(case)}')
+        steps = run_case(case, workdir, args.repeats)
+        if mpiops.rank != 0:
+            continue
+        entry = {'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'case': case, 'env': env, 'steps': steps}
+        for r in regressions(history, entry):
+            log.warning(f"Regression in {case_name(case)} '{r['step']}': {r['wall_time']:.3f}s, "
+                        f"baseline {r['baseline']:.3f}s")
+            found.append(r)
+        append_history(history_path, entry)
+        history.append(entry)
+        for step, s in steps.items():
+            print(f"{case_name(case):60s} {step:18s} {s['wall_time']:10.3f}s {s['peak_rss'] / 2 ** 20:10.1f}MB")
+
+    found = mpiops.comm.bcast(found, root=0)
+    if found and args.fail_on_regression:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
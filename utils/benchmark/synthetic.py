@@ -0,0 +1,305 @@
+#   This Python module is part of the PyRate software package.
+#
+#   Copyright 2020 Geoscience Australia
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+"""
+This Python module generates synthetic GAMMA-format interferogram stacks for
+benchmarking PyRate. Each epoch has a displacement made of a linear
+deformation signal, an orbital ramp and spatially correlated atmospheric
+noise; interferograms are the differences of their epochs, with NaN areas
+written as the no-data value.
+"""
+import os
+from datetime import date, timedelta
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+import numpy as np
+from scipy.ndimage import gaussian_filter
+
+from pyrate.core import ifgconstants as ifc
+from pyrate.core.shared import write_unw_from_data_or_geotiff
+
+GAMMA = 1
+RADAR_FREQUENCY = 5.3e9  # Hz, C-band
+INCIDENCE_ANGLE = 35.0  # degrees
+CORNER_LAT = -34.0
+CORNER_LON = 150.0
+PIXEL_SIZE = 8.33333e-04  # decimal degrees, ~90m
+NAN_PATTERNS = ['none', 'random', 'patches']
+
+# parameters of the generated PyRate configuration, besides the input and output paths
+DEFAULT_CONFIG = {
+    'processor': 1,
+    'cohmask': 0,
+    'orbfit': 1,
+    'apsest': 1,
+    'parallel': 0,
+    'processes': 1,
+    'ifglksx': 1,
+    'ifglksy': 1,
+    'ifgcropopt': 1,
+    'noDataValue': 0.0,
+    'nan_conversion': 1,
+    'refx': -1,
+    'refy': -1,
+    'refnx': 5,
+    'refny': 5,
+    'refchipsize': 5,
+    'refminfrac': 0.5,
+    'refest': 1,
+    'orbfitmethod': 1,
+    'orbfitdegrees': 1,
+    'tlpfcutoff': 0.25,
+    'tsmethod': 2,
+    'ts_pthr': 3,
+    'pthr': 3,
+    'savenpy': 0,
+}
+
+
+def epoch_dates(nepochs: int, interval: int = 12, start: date = date(2010, 1, 1)) -> List[date]:
+    """
+    Returns regularly spaced acquisition dates
+
+    :param int nepochs: number of epochs
+    :param int interval: days between acquisitions
+    :param date start: date of the first acquisition
+
+    :return: list of dates
+    :rtype: list
+    """
+    return [start + timedelta(days=interval * i) for i in range(nepochs)]
+
+
+def ifg_network(nepochs: int, nifgs: int) -> List[Tuple[int, int]]:
+    """
+    Returns a small baseline network of interferograms: every pair of
+    consecutive epochs, then the pairs with the shortest temporal baselines
+    until there are 'nifgs' interferograms. The network is always connected.
+
+    :param int nepochs: number of epochs
+    :param int nifgs: number of interferograms, between nepochs - 1 and
+        nepochs * (nepochs - 1) / 2
+
+    :return: list of (first, second) epoch indices
+    :rtype: list
+    """
+    max_ifgs = nepochs * (nepochs - 1) // 2
+    if nepochs < 2 or not nepochs - 1 <= nifgs <= max_ifgs:
+        raise ValueError(f"{nifgs} interferograms can not connect {nepochs} epochs; "
+                         f"between {nepochs - 1} and {max_ifgs} are required")
+    pairs = sorted(((i, j) for i in range(nepochs) for j in range(i + 1, nepochs)), key=lambda p: (p[1] - p[0], p[0]))
+    return sorted(pairs[:nifgs])
+
+
+def _deformation(rows, cols):
+    """
+    Returns a subsidence bowl with a peak of one, centred in the raster
+    """
+    y, x = np.mgrid[0:rows, 0:cols]
+    sigma = max(rows, cols) / 6
+    return -np.exp(-((y - rows / 2) ** 2 + (x - cols / 2) ** 2) / (2 * sigma ** 2))
+
+
+def _ramp(rows, cols, amplitude, rng):
+    """
+    Returns a planar orbital ramp with a random direction and offset
+    """
+    y, x = np.mgrid[0:rows, 0:cols]
+    a, b, c = rng.uniform(-1, 1, size=3)
+    plane = a * y / max(rows - 1, 1) + b * x / max(cols - 1, 1) + c
+    return amplitude * plane / 3
+
+
+def _atmosphere(rows, cols, std, rng):
+    """
+    Returns spatially correlated noise with a correlation length of a tenth
+    of the raster size
+    """
+    noise = gaussian_filter(rng.standard_normal((rows, cols)), sigma=max(rows, cols) / 10, mode='wrap')
+    return std * noise / max(noise.std(), np.finfo(float).eps)
+
+
+def epoch_displacements(shape: Tuple[int, int], dates: List[date], velocity: float = 20.0,
+                        ramp: float = 10.0, atmosphere: float = 5.0, seed: int = 0,
+                        out: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    Returns the synthetic displacement of each epoch relative to a constant
+    reference, in millimetres. The epochs are computed one at a time, so
+    passing a memory mapped 'out' array keeps only one epoch in memory.
+
+    :param tuple shape: (rows, cols) of the rasters
+    :param list dates: acquisition dates
+    :param float velocity: peak rate of the deformation signal in mm/yr
+    :param float ramp: amplitude of the orbital ramps in mm
+    :param float atmosphere: standard deviation of the atmospheric noise in mm
+    :param int seed: random seed
+    :param ndarray out: array of size (nepochs, rows, cols) to fill (optional)
+
+    :return: displacements: array of size (nepochs, rows, cols)
+    :rtype: ndarray
+    """
+    rows, cols = shape
+    rng = np.random.RandomState(seed)
+    bowl = _deformation(rows, cols)
+    disp = np.empty((len(dates), rows, cols), dtype=np.float32) if out is None else out
+    for i, d in enumerate(dates):
+        years = (d - dates[0]).days * ifc.YEARS_PER_DAY
+        disp[i] = velocity * years * bowl + _ramp(rows, cols, ramp, rng) + _atmosphere(rows, cols, atmosphere, rng)
+    return disp
+
+
+def nan_mask(shape: Tuple[int, int], fraction: float, pattern: str, rng: np.random.RandomState) -> np.ndarray:
+    """
+    Returns a mask of pixels with no data in an interferogram
+
+    :param tuple shape: (rows, cols) of the raster
+    :param float fraction: fraction of pixels with no data
+    :param str pattern: 'none', 'random' for scattered pixels or 'patches'
+        for rectangular areas, as in decorrelated regions
+    :param RandomState rng: random number generator
+
+    :return: mask: boolean array, True where there is no data
+    :rtype: ndarray
+    """
+    if pattern not in NAN_PATTERNS:
+        raise ValueError(f"NaN pattern must be one of {NAN_PATTERNS}, not '{pattern}'")
+    rows, cols = shape
+    mask = np.zeros(shape, dtype=bool)
+    target = int(round(fraction * rows * cols))
+    if pattern == 'none' or target == 0:
+        return mask
+    if pattern == 'random':
+        mask.flat[rng.choice(rows * cols, size=target, replace=False)] = True
+        return mask
+    while mask.sum() < target:
+        h, w = rng.randint(1, max(rows // 5, 1) + 1), rng.randint(1, max(cols // 5, 1) + 1)
+        y, x = rng.randint(0, rows - h + 1), rng.randint(0, cols - w + 1)
+        mask[y:y + h, x:x + w] = True
+    return mask
+
+
+def _mm_to_radians(mm):
+    wavelength = ifc.SPEED_OF_LIGHT_METRES_PER_SECOND / RADAR_FREQUENCY
+    return mm * 4 * np.pi / (wavelength * ifc.MM_PER_METRE)
+
+
+def _write_epoch_header(path, d):
+    with open(path, 'w') as f:
+        f.write(f"date: {d.year} {d.month:02d} {d.day:02d} 12 00 00.0000\n"
+                f"radar_frequency: {RADAR_FREQUENCY:e} Hz\n"
+                f"incidence_angle: {INCIDENCE_ANGLE} degrees\n")
+
+
+def _write_dem_header(path, rows, cols):
+    with open(path, 'w') as f:
+        f.write(f"DEM_projection:     EQA\n"
+                f"data_format:        REAL*4\n"
+                f"width:              {cols}\n"
+                f"nlines:             {rows}\n"
+                f"corner_lat:     {CORNER_LAT}  decimal degrees\n"
+                f"corner_lon:     {CORNER_LON}  decimal degrees\n"
+                f"post_lat:   {-PIXEL_SIZE}  decimal degrees\n"
+                f"post_lon:    {PIXEL_SIZE}  decimal degrees\n"
+                f"ellipsoid_name: WGS 84\n")
+
+
+def _write_list(path, names):
+    with open(path, 'w') as f:
+        f.write('\n'.join(str(n) for n in names) + '\n')
+
+
+def generate_stack(obs_dir: str, shape: Tuple[int, int], nepochs: int, nifgs: int, nan_fraction: float = 0.05,
+                   nan_pattern: str = 'patches', velocity: float = 20.0, ramp: float = 10.0,
+                   atmosphere: float = 5.0, seed: int = 0) -> dict:
+    """
+    Write a synthetic GAMMA-format stack: unwrapped interferograms in
+    radians, epoch and DEM headers, a flat DEM and the interferogram and
+    header lists. Epoch displacements are held in a memory mapped file so
+    large stacks need not fit in memory.
+
+    :param str obs_dir: directory to write the stack to
+    :param tuple shape: (rows, cols) of the rasters
+    :param int nepochs: number of epochs
+    :param int nifgs: number of interferograms
+    :param float nan_fraction: fraction of pixels with no data in each interferogram
+    :param str nan_pattern: 'none', 'random' or 'patches'
+    :param float velocity: peak rate of the deformation signal in mm/yr
+    :param float ramp: amplitude of the orbital ramps in mm
+    :param float atmosphere: standard deviation of the atmospheric noise in mm
+    :param int seed: random seed
+
+    :return: files: dictionary of the 'ifgfilelist', 'hdrfilelist', 'demfile'
+        and 'demHeaderFile' configuration parameters of the stack
+    :rtype: dict
+    """
+    obs_dir = Path(obs_dir)
+    obs_dir.mkdir(parents=True, exist_ok=True)
+    rows, cols = shape
+    dates = epoch_dates(nepochs)
+    pairs = ifg_network(nepochs, nifgs)
+    rng = np.random.RandomState(seed)
+
+    epochs_file = obs_dir.joinpath('epochs.npy')
+    disp = np.lib.format.open_memmap(epochs_file, mode='w+', dtype=np.float32, shape=(nepochs, rows, cols))
+    epoch_displacements(shape, dates, velocity, ramp, atmosphere, seed, out=disp)
+
+    headers = []
+    for d in dates:
+        headers.append(obs_dir.joinpath(f"{d:%Y%m%d}_slc.par"))
+        _write_epoch_header(headers[-1], d)
+
+    ifgs = []
+    for first, second in pairs:
+        phase = _mm_to_radians(disp[second] - disp[first])
+        phase[nan_mask(shape, nan_fraction, nan_pattern, rng)] = DEFAULT_CONFIG['noDataValue']
+        ifgs.append(obs_dir.joinpath(f"{dates[first]:%Y%m%d}-{dates[second]:%Y%m%d}_utm.unw"))
+        write_unw_from_data_or_geotiff(phase, ifgs[-1].as_posix(), GAMMA)
+    del disp
+    os.remove(epochs_file)
+
+    dem = obs_dir.joinpath('dem.dem')
+    write_unw_from_data_or_geotiff(np.zeros(shape, dtype=np.float32), dem.as_posix(), GAMMA)
+    _write_dem_header(obs_dir.joinpath('dem.par'), rows, cols)
+    _write_list(obs_dir.joinpath('ifms'), ifgs)
+    _write_list(obs_dir.joinpath('headers'), headers)
+
+    return {
+        'ifgfilelist': obs_dir.joinpath('ifms').as_posix(),
+        'hdrfilelist': obs_dir.joinpath('headers').as_posix(),
+        'demfile': dem.as_posix(),
+        'demHeaderFile': obs_dir.joinpath('dem.par').as_posix(),
+    }
+
+
+def write_config(path: str, files: dict, outdir: str, **params) -> str:
+    """
+    Write a PyRate configuration file for a synthetic stack
+
+    :param str path: path of the configuration file
+    :param dict files: input file parameters returned by generate_stack
+    :param str outdir: PyRate output directory
+    :param dict params: configuration parameters overriding DEFAULT_CONFIG
+
+    :return: path of the configuration file
+    :rtype: str
+    """
+    conf = dict(DEFAULT_CONFIG, **files)
+    conf.update(params)
+    conf['outdir'] = outdir
+    with open(path, 'w') as f:
+        for k, v in conf.items():
+            f.write(f"{k}: {v}\n")
+    return str(path)